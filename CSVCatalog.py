@@ -1,18 +1,325 @@
+import contextlib
+import os
 import pymysql
 import json
+import sqlite3
+import threading
+import time
 
+# Seconds a cached table definition is used before it is loaded from the catalog again, or None to use it until the
+# catalog is changed by this process.
+default_cache_ttl = None
+
+# Maximum number of connections a ConnectionPool opens.
+default_pool_size = 4
+
+# Seconds a connection may stay idle in a ConnectionPool before it is checked with a ping when it is taken again.
+ping_interval = 30
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of database connections. Connections are only opened when a query needs one
+    (so creating a pool does not touch the network), are reused across queries, and at most size of them are
+    open at a time: a thread that needs one while all of them are in use waits for one to be released.
+    """
+
+    def __init__(self, connect, size=None):
+        """
+        :param connect: Function opening a new connection.
+        :param size: Maximum number of open connections. Defaults to default_pool_size.
+        """
+        self.connect = connect
+        self.size = size or default_pool_size
+        self.open_count = 0
+        # Idle connections, with the time they were released.
+        self.idle = []
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Takes an idle connection, or opens one if fewer than size are open, or waits for one to be released.
+        A connection that was idle for more than ping_interval seconds is pinged first and replaced if the ping
+        fails.
+
+        :return: A connection, to be given back with release.
+        """
+        with self.condition:
+            while not self.idle and self.open_count >= self.size:
+                self.condition.wait()
+            if self.idle:
+                cnx, released_at = self.idle.pop()
+            else:
+                cnx, released_at = None, None
+                self.open_count += 1
+
+        try:
+            if cnx is None:
+                return self.connect()
+            if time.monotonic() - released_at > ping_interval:
+                try:
+                    cnx.ping(reconnect=False)
+                except Exception as e:
+                    self.__close__(cnx)
+                    return self.connect()
+            return cnx
+        except Exception as e:
+            self.discard(None)
+            raise e
+
+    def release(self, cnx):
+        """
+        Gives a connection back to the pool.
+
+        :param cnx: A connection returned by acquire.
+        :return: Nothing
+        """
+        with self.condition:
+            self.idle.append((cnx, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, cnx):
+        """
+        Closes a connection returned by acquire that failed, instead of giving it back to the pool.
+
+        :param cnx: The connection, or None if it could not be opened.
+        :return: Nothing
+        """
+        if cnx is not None:
+            self.__close__(cnx)
+        with self.condition:
+            self.open_count -= 1
+            self.condition.notify()
+
+    def __close__(self, cnx):
+        try:
+            cnx.close()
+        except Exception as e:
+            pass
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager holding a connection of the pool. The connection is discarded if the block raises a
+        database error, and given back to the pool otherwise.
+        """
+        cnx = self.acquire()
+        try:
+            yield cnx
+        except pymysql.MySQLError as e:
+            self.discard(cnx)
+            raise e
+        except BaseException as e:
+            self.release(cnx)
+            raise e
+        self.release(cnx)
+
+
+# The connection pools of the process, one per database and user (see get_pool).
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, connect, size=None):
+    """
+    Gets the pool shared by all the catalogs that connect to the same database.
+
+    :param key: Identifies the database and user, e.g. (host, port, user, password, db).
+    :param connect: Function opening a new connection, used if the pool does not exist yet.
+    :param size: Maximum number of open connections of a new pool.
+    :return: The ConnectionPool.
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(connect, size)
+            _pools[key] = pool
+        return pool
+
+
+class CatalogBackend:
+    """
+    Stores the catalog tables (csvtables, csvcolumns and csvindexes, see create.sql). TableDefinition and
+    CSVCatalog only run their queries through run_q, so they work with any backend.
+    """
+
+    # Identifies the database of the backend, e.g. in the keys of definition_cache.
+    key = None
+
+    def run_q(self, q, args, fetch=False):
+        """
+        Runs a query and commits it.
+
+        :param q: The query string, with %s placeholders.
+        :param args: Any arguments passed
+        :param fetch: Whether the query needs to return data
+        :return: Result from query as a list of dictionaries, if applicable
+        """
+        raise NotImplementedError()
+
+    def run_many(self, statements):
+        """
+        Runs statements in a single transaction, each one with executemany, so that inserting many rows is one
+        batched statement instead of one query and commit per row.
+
+        :param statements: List of (query string with %s placeholders, list of argument tuples).
+        :return: Nothing
+        """
+        raise NotImplementedError()
+
+
+class MySQLBackend(CatalogBackend):
+    """
+    The catalog in a MySQL database, created with create.sql. Queries take a connection from the ConnectionPool
+    shared by all the backends of the same database, which connects on first use.
+    """
+
+    def __init__(self, dbhost, dbport, dbuser, dbpw, db, pool_size=None):
+        """
+        :param pool_size: Maximum number of connections of the pool, if it does not exist yet. Defaults to
+            default_pool_size.
+        """
+
+        def connect():
+            return pymysql.connect(
+                host=dbhost,
+                port=dbport,
+                user=dbuser,
+                password=dbpw,
+                db=db,
+                cursorclass=pymysql.cursors.DictCursor
+            )
+
+        self.key = ("mysql", dbhost, dbport, dbuser, db)
+        self.pool = get_pool((dbhost, dbport, dbuser, dbpw, db), connect, pool_size)
+
+    def run_q(self, q, args, fetch=False):
+        with self.pool.connection() as cnx:
+            return run_q(cnx, q, args, fetch)
+
+    def run_many(self, statements):
+        with self.pool.connection() as cnx:
+            run_many(cnx, statements)
+
+
+# Schema of the catalog tables in the SQLite backend, the tables and constraints of create.sql.
+sqlite_schema = """
+create table if not exists csvtables (
+  table_name varchar(45) not null,
+  path varchar(100) not null,
+  primary key (table_name)
+);
+
+create table if not exists csvcolumns (
+  table_name varchar(45) not null,
+  column_name varchar(256) not null,
+  type varchar(6) not null check (type in ('text', 'number')),
+  not_null tinyint not null,
+  primary key (table_name, column_name),
+  foreign key (table_name) references csvtables (table_name) on delete cascade
+);
+
+create table if not exists csvindexes (
+  table_name varchar(45) not null,
+  column_name varchar(45) not null,
+  type varchar(7) not null check (type in ('PRIMARY', 'UNIQUE', 'INDEX', 'ORDERED')),
+  index_name varchar(45) not null,
+  index_order varchar(45) not null,
+  primary key (table_name, index_name, column_name),
+  foreign key (table_name, column_name) references csvcolumns (table_name, column_name) on delete cascade
+);
+"""
+
+
+class SQLiteBackend(CatalogBackend):
+    """
+    The catalog in an embedded SQLite database file, for a single machine: no server is needed and a query does
+    not leave the process. The catalog tables are created if the file does not have them.
+    """
+
+    def __init__(self, file_name=":memory:"):
+        """
+        :param file_name: Path of the database file, or ":memory:" for a catalog that only lives in this backend.
+        """
+        if file_name == ":memory:":
+            self.key = ("sqlite", id(self))
+        else:
+            self.key = ("sqlite", os.path.abspath(file_name))
+
+        # A single connection, used by one thread at a time.
+        self.cnx = sqlite3.connect(file_name, check_same_thread=False)
+        self.cnx.row_factory = sqlite3.Row
+        self.cnx.execute("pragma foreign_keys = on")
+        self.cnx.executescript(sqlite_schema)
+        self.upgrade_schema()
+        self.lock = threading.Lock()
+
+    def upgrade_schema(self):
+        """
+        Catalogs created before a column could be in several indexes have the key (table_name, column_name) on
+        csvindexes. SQLite cannot change the key of a table, so the table is recreated with the current key and
+        its rows copied.
+
+        :return: Nothing
+        """
+        key = [r["name"] for r in self.cnx.execute("pragma table_info(csvindexes)").fetchall() if r["pk"] > 0]
+        if "index_name" in key:
+            return
+        self.cnx.executescript("""
+begin;
+alter table csvindexes rename to csvindexes_old;
+""" + sqlite_schema + """
+insert into csvindexes (table_name, column_name, type, index_name, index_order)
+  select table_name, column_name, type, index_name, index_order from csvindexes_old;
+drop table csvindexes_old;
+commit;
+""")
+
+    def run_q(self, q, args, fetch=False):
+        if args is None:
+            args = ()
+        elif not isinstance(args, (tuple, list)):
+            args = (args,)
+
+        print("Q = ", q)
+        with self.lock:
+            try:
+                cursor = self.cnx.execute(q.replace("%s", "?"), args)
+                if fetch:
+                    result = [dict(r) for r in cursor.fetchall()]
+                else:
+                    result = None
+            except Exception as e:
+                self.cnx.rollback()
+                raise e
+            self.cnx.commit()
+        return result
+
+    def run_many(self, statements):
+        with self.lock:
+            try:
+                for q, args_list in statements:
+                    print("Q = ", q)
+                    self.cnx.executemany(q.replace("%s", "?"), args_list)
+            except Exception as e:
+                self.cnx.rollback()
+                raise e
+            self.cnx.commit()
 
 
 def run_q(cnx, q, args, fetch=False):
     """
     Method to run queries on your AWS MySQL Database.
 
-    :param cnx: Connection to database
+    :param cnx: Connection to database, or a CatalogBackend to run the query.
     :param q: The query string
     :param args: Any arguments passed
     :param fetch: Whether the query needs to return data
     :return: Result from query, if applicable
     """
+    if isinstance(cnx, CatalogBackend):
+        return cnx.run_q(q, args, fetch)
+
     cursor = cnx.cursor()
     print("Q = ", q)
     cursor.execute(q, args)
@@ -24,6 +331,33 @@ def run_q(cnx, q, args, fetch=False):
     return result
 
 
+def run_many(cnx, statements):
+    """
+    Runs statements in a single transaction, each one with executemany. pymysql sends the rows of an insert as
+    one multi-row statement.
+
+    :param cnx: Connection to database, or a CatalogBackend to run the statements.
+    :param statements: List of (query string, list of argument tuples). Statements without rows are skipped.
+    :return: Nothing
+    """
+    statements = [(q, args_list) for q, args_list in statements if args_list]
+    if not statements:
+        return
+    if isinstance(cnx, CatalogBackend):
+        cnx.run_many(statements)
+        return
+
+    cursor = cnx.cursor()
+    try:
+        for q, args_list in statements:
+            print("Q = ", q)
+            cursor.executemany(q, args_list)
+    except Exception as e:
+        cnx.rollback()
+        raise e
+    cnx.commit()
+
+
 class ColumnDefinition:
     """
     A class defining a column.
@@ -79,9 +413,10 @@ class IndexDefinition:
     """
     A class defining an index.
     Represents the definition of an index.
+    An ORDERED index keeps its keys sorted, so it also answers range, leftmost-prefix and ordered scans.
 
     """
-    index_types = ("PRIMARY", "UNIQUE", "INDEX")
+    index_types = ("PRIMARY", "UNIQUE", "INDEX", "ORDERED")
 
     def __init__(self, index_name, index_type, column_names):
         """
@@ -111,6 +446,68 @@ class IndexDefinition:
         return result
 
 
+class DefinitionCache:
+    """
+    Process-wide cache of the table definitions loaded from the catalog, so that opening a table whose definition
+    is cached does not query the database.
+
+    Every change to the catalog (create or drop a table, add or drop a column or an index) increments the catalog
+    version, and a definition loaded at an older version is loaded again. A definition changed by another process
+    is only seen once its ttl expired.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        :param ttl: Seconds a definition is used before it is loaded again, or None for no limit.
+        """
+        self.ttl = ttl
+        self.version = 0
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: The key of the catalog backend and the name of the table.
+        :return: The cached TableDefinition, or None if it is not cached, stale or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            version, loaded_at, definition = entry
+            if version != self.version or (self.ttl is not None and time.monotonic() - loaded_at > self.ttl):
+                del self.entries[key]
+                return None
+            return definition
+
+    def put(self, key, definition, version):
+        """
+        :param key: The key of the catalog backend and the name of the table.
+        :param definition: A TableDefinition loaded from the catalog.
+        :param version: The catalog version read before loading it. The definition is not cached if the catalog
+            changed since.
+        :return: Nothing
+        """
+        with self.lock:
+            if version == self.version:
+                self.entries[key] = (version, time.monotonic(), definition)
+
+    def invalidate(self):
+        """
+        Increments the catalog version, so that every cached definition is loaded again. A change can touch
+        several tables (e.g. drop_col_in_sql), so all of them are invalidated.
+
+        :return: Nothing
+        """
+        with self.lock:
+            self.version += 1
+            self.entries = {}
+
+
+# The definition cache shared by all the catalogs of the process.
+definition_cache = DefinitionCache(default_cache_ttl)
+
+
 class TableDefinition:
     """
     Represents the definition of a table in the CSVCatalog.
@@ -130,7 +527,8 @@ class TableDefinition:
             May be just a subset of the columns.
         :param index_definitions: List of index definitions. Column names must be valid.
         :param cnx: Database connection to use. If None, create a default connection.
-        :param load: Whether you are creating a new TableDefinition or loading a preexisting one.
+        :param load: Whether you are creating a new TableDefinition or loading a preexisting one. None only sets
+            the table and file names, without querying the catalog (see copy).
         """
         self.cnx = cnx
         self.table_name = t_name
@@ -138,6 +536,9 @@ class TableDefinition:
         self.columns = None
         self.indexes = None
 
+        if load is None:
+            return
+
         if not load:
 
             if t_name is None or csv_f is None:
@@ -145,17 +546,7 @@ class TableDefinition:
 
 
             self.file_name = csv_f
-            self.save_core_definition()
-
-            if column_definitions is not None:
-
-                for c in column_definitions:
-                    self.add_column_definition(c)
-
-            if index_definitions is not None:
-                for idx in index_definitions:
-                    # self.define_index(idx)
-                    self.define_index(idx.name, idx.column_names, idx.type)
+            self.save_definition(column_definitions, index_definitions)
 
         else:
             self.load_core_definition()  # load self.file_name
@@ -165,6 +556,22 @@ class TableDefinition:
     def __str__(self):
         return json.dumps(self.to_json(), indent=2)
 
+    def copy(self, cnx=None):
+        """
+        Copies the definition without querying the catalog. Column and index definitions are copied too, so that
+        changing the copy does not change the original.
+
+        :param cnx: Database connection of the copy.
+        :return: The new TableDefinition.
+        """
+        result = TableDefinition(self.table_name, self.file_name, cnx=cnx, load=None)
+        if self.columns is not None:
+            result.columns = [ColumnDefinition(c.column_name, c.column_type, c.not_null) for c in self.columns]
+        if self.indexes is not None:
+            result.indexes = [IndexDefinition(i.index_name, i.index_type, list(i.column_names))
+                              for i in self.indexes]
+        return result
+
     def load_columns(self):
         """
         Method to query the metadata table and update self.columns with ColumnDefinitions stored
@@ -200,32 +607,19 @@ class TableDefinition:
 
         if self.indexes is None:
             self.indexes = []
-        dic = {}
-        for entry in self.indexes:
-            dic[entry["index_name"]] = entry
 
+        # Rows of each index, the indexes in the order of their first row.
+        dic = {}
         for r in res:
-            idx_name = r["index_name"]
-            if idx_name in dic:
-                idx = dic[idx_name]
-                idx.column_names.append(r["column_name"])
+            if r["index_name"] not in dic:
+                dic[r["index_name"]] = []
+            dic[r["index_name"]].append(r)
 
-            else:
-                idx = IndexDefinition(idx_name, r["type"], [r["column_name"]])
-                dic[idx_name] = idx
-
-        if self.indexes is None:
-            self.indexes = []
-
-        for key in dic.keys():
-            obj = dic[key]
-
-            self.indexes.append(obj)
-            order_count = len(obj.column_names)
-            for i in range(order_count):
-                q = "update csvindexes set index_order = if(index_name = %s and type = %s and column_name = %s, %s, index_order)"
-                v = (obj.index_name, obj.index_type, obj.column_names[i], i)
-                run_q(self.cnx, q, v)
+        # The columns of an index are in index_order (the leftmost column has the smallest one).
+        for idx_name, rows in dic.items():
+            rows.sort(key=lambda r: int(r["index_order"]))
+            idx = IndexDefinition(idx_name, rows[0]["type"], [r["column_name"] for r in rows])
+            self.indexes.append(idx)
 
     def load_core_definition(self):
         """
@@ -251,8 +645,39 @@ class TableDefinition:
         :return: Nothing
         """
         print("Running save core definition")
+        run_many(self.cnx, [self.core_definition_statement()])
+        definition_cache.invalidate()
+
+    def core_definition_statement(self):
+        """
+        :return: The insert of the table into 'csvtables', as (query, list of argument tuples) for run_many.
+        """
         q = "insert into csvtables values(%s, %s)"
-        result = run_q(self.cnx, q, (self.table_name, self.file_name), fetch=True)
+        return q, [(self.table_name, self.file_name)]
+
+    def save_definition(self, column_definitions=None, index_definitions=None):
+        """
+        Inserts a new table with its columns and indexes into the catalog in a single transaction, with one
+        batched insert per catalog table.
+
+        :param column_definitions: List of ColumnDefinitions, or None.
+        :param index_definitions: List of IndexDefinitions, or None.
+        :return: Nothing
+        """
+        print("Running save definition")
+        column_definitions = column_definitions or []
+        index_definitions = index_definitions or []
+        indexes = [(idx.index_name, idx.column_names, idx.index_type) for idx in index_definitions]
+
+        run_many(self.cnx, [self.core_definition_statement(),
+                            self.column_definitions_statement(column_definitions),
+                            self.index_definitions_statement(indexes)])
+        definition_cache.invalidate()
+
+        for c in column_definitions:
+            self.add_column_to_definition(c)
+        for index_name, columns, type in indexes:
+            self.add_index_to_definition(index_name, columns, type)
 
     def add_column_definition(self, c):
         """
@@ -262,9 +687,36 @@ class TableDefinition:
         :param c: ColumnDefinition obj. New column. Cannot be duplicate or column not in the file.
         :return: None
         """
+        self.add_column_definitions([c])
+
+    def add_column_definitions(self, column_definitions):
+        """
+        Adds several column definitions with one batched insert into 'csvcolumns', in a single transaction.
+
+        :param column_definitions: List of ColumnDefinitions. Cannot be duplicates or columns not in the file.
+        :return: None
+        """
         #SQL will throw the error if table integrity is not kept and a column with a duplicate
+        run_many(self.cnx, [self.column_definitions_statement(column_definitions)])
+        definition_cache.invalidate()
+        for c in column_definitions:
+            self.add_column_to_definition(c)
+
+    def column_definitions_statement(self, column_definitions):
+        """
+        :param column_definitions: List of ColumnDefinitions.
+        :return: The insert of the columns into 'csvcolumns', as (query, list of argument tuples) for run_many.
+        """
         q = "insert into csvcolumns values(%s, %s, %s, %s)"
-        result = run_q(self.cnx, q, (self.table_name, c.column_name, c.column_type, c.not_null), fetch=True)
+        return q, [(self.table_name, c.column_name, c.column_type, c.not_null) for c in column_definitions]
+
+    def add_column_to_definition(self, c):
+        """
+        Adds a column definition to self.columns only, after it was saved.
+
+        :param c: ColumnDefinition obj.
+        :return: None
+        """
         if self.columns is None:
             self.columns = []
         self.columns.append(c)
@@ -295,26 +747,34 @@ class TableDefinition:
         if column_to_drop is not None:
             self.columns.remove(column_to_drop)
             self.drop_col_in_sql(cn)
+
+            # The column is removed from every index it is in, an index left without columns is dropped.
+            for idx in list(self.indexes or []):
+                if cn in idx.column_names:
+                    idx.column_names = [c for c in idx.column_names if c != cn]
+                    if not idx.column_names:
+                        self.indexes.remove(idx)
             print("Column '" + cn + "' has been dropped!")
 
         return
 
     def drop_col_in_sql(self, cn):
         """
-        Deletes the row in sql for the given column.
+        Deletes the row in sql for the given column, and its rows in every index of the table it is in.
 
         :param cn: Column name (string)
         :return: Returns nothing, executes SQL query
         """
         # drop corresponding indexes
-        q = "delete from csvindexes where column_name =  %s"
-        v = (cn)
+        q = "delete from csvindexes where table_name = %s and column_name = %s"
+        v = (self.table_name, cn)
         res = run_q(self.cnx, q, v, fetch=True)
 
         # drop column
-        q = "delete from csvcolumns where column_name =  %s"
-        v = (cn)
+        q = "delete from csvcolumns where table_name = %s and column_name = %s"
+        v = (self.table_name, cn)
         res = run_q(self.cnx, q, v, fetch=True)
+        definition_cache.invalidate()
 
     def to_json(self):
         """
@@ -350,14 +810,32 @@ class TableDefinition:
         :return: Does not return anything.
         """
 
+        run_many(self.cnx, [self.index_definitions_statement([(i_name, cols, type)])])
+        definition_cache.invalidate()
+
+    def index_definitions_statement(self, indexes):
+        """
+        Builds the insert of index columns into 'csvindexes'. The columns added to an existing index (or to an
+        index earlier in the list) get the index_order after its last column.
+
+        :param indexes: List of (index name, list of column names, index type).
+        :return: The insert, as (query, list of argument tuples) for run_many.
+        """
         q = "insert into csvindexes (table_name, column_name, type, index_name, index_order) " + \
             " values(%s, %s, %s, %s, %s)"
-        for i in range(0, len(cols)):
-            #print("check " + cols[0])
-            #v = (self.table_name, cols[i].column_name, type, i_name, str(i))
-            # the most left column has the smallest index_order
-            v = (self.table_name, cols[i], type, i_name, str(i))
-            result = run_q(self.cnx, q, v, fetch=False)
+
+        column_counts = {}
+        for idx in self.indexes or []:
+            column_counts[idx.index_name] = column_counts.get(idx.index_name, 0) + len(idx.column_names)
+
+        args_list = []
+        for i_name, cols, type in indexes:
+            first_order = column_counts.get(i_name, 0)
+            for i in range(0, len(cols)):
+                # the most left column has the smallest index_order
+                args_list.append((self.table_name, cols[i], type, i_name, str(first_order + i)))
+            column_counts[i_name] = first_order + len(cols)
+        return q, args_list
 
     def define_index(self, index_name, columns, type="index"):
         """
@@ -372,6 +850,31 @@ class TableDefinition:
         """
 
         self.save_index_definition(index_name, columns, type)
+        self.add_index_to_definition(index_name, columns, type)
+
+    def define_indexes(self, index_definitions):
+        """
+        Defines several indexes with one batched insert into 'csvindexes', in a single transaction. As with
+        define_index, the columns of an index with the name of an existing one are added to it.
+
+        :param index_definitions: List of IndexDefinitions.
+        :return: Returns nothing
+        """
+        indexes = [(idx.index_name, idx.column_names, idx.index_type) for idx in index_definitions]
+        run_many(self.cnx, [self.index_definitions_statement(indexes)])
+        definition_cache.invalidate()
+        for index_name, columns, type in indexes:
+            self.add_index_to_definition(index_name, columns, type)
+
+    def add_index_to_definition(self, index_name, columns, type):
+        """
+        Adds an index definition to self.indexes only, after it was saved.
+
+        :param index_name: Index name.
+        :param columns: List of columns.
+        :param type: One of the valid index types.
+        :return: Returns nothing
+        """
         if self.indexes is None:
             self.indexes = []
 
@@ -383,7 +886,7 @@ class TableDefinition:
                     obj.column_names.append(col)
                 return
 
-        idx = IndexDefinition(index_name, type, columns)
+        idx = IndexDefinition(index_name, type, list(columns))
         self.indexes.append(idx)
 
     def get_index(self, ind_name):
@@ -433,6 +936,7 @@ class TableDefinition:
         """
         q = "DELETE FROM csvindexes WHERE table_name = '" + self.table_name + "' and index_name = '" + index_name + "'"
         result = run_q(self.cnx, q, None, fetch=True)
+        definition_cache.invalidate()
 
     def describe_table(self):
         """
@@ -451,15 +955,20 @@ class CSVCatalog:
     """
 
     def __init__(self, dbhost="database-4111.cpwlqqnivbtg.us-east-1.rds.amazonaws.com", dbport=3306,
-                  dbuser="admin", dbpw="dbuserdbuser", db="CSVCatalog", debug_mode=None):
-        self.cnx = pymysql.connect(
-            host=dbhost,
-            port=dbport,
-            user=dbuser,
-            password=dbpw,
-            db=db,
-            cursorclass=pymysql.cursors.DictCursor
-        )
+                  dbuser="admin", dbpw="dbuserdbuser", db="CSVCatalog", debug_mode=None, pool_size=None,
+                 backend=None):
+        """
+        The catalog does not connect here. With the default MySQL backend, queries take a connection from the
+        pool shared by all the catalogs of the same database (see ConnectionPool), which connects on first use.
+
+        :param pool_size: Maximum number of connections of the pool, if it does not exist yet. Defaults to
+            default_pool_size.
+        :param backend: The CatalogBackend storing the catalog, e.g. SQLiteBackend("catalog.db"). Defaults to a
+            MySQLBackend on dbhost.
+        """
+        if backend is None:
+            backend = MySQLBackend(dbhost, dbport, dbuser, dbpw, db, pool_size)
+        self.cnx = backend
 
     def __str__(self):
         pass
@@ -488,17 +997,25 @@ class CSVCatalog:
 
         q = "DELETE FROM csvtables WHERE table_name = '" + table_name + "'"
         result = run_q(self.cnx, q, None, fetch=True)
+        definition_cache.invalidate()
         print("Table '" + table_name + "' was dropped")
 
     def get_table(self, table_name):
         """
-        Get a previously created table.
+        Get a previously created table. The definition is taken from the process-wide definition_cache if it is
+        cached, without querying the database, and cached otherwise.
 
         :param table_name: Name of the table.
-        :return: A table (Class TableDefinition)
+        :return: A table (Class TableDefinition), a copy of the cached one.
         """
-        result = TableDefinition(table_name, load=True, cnx=self.cnx)
+        key = (self.cnx.key, table_name)
+        definition = definition_cache.get(key)
+        if definition is None:
+            version = definition_cache.version
+            definition = TableDefinition(table_name, load=True, cnx=self.cnx)
+            definition_cache.put(key, definition, version)
 
+        result = definition.copy(self.cnx)
         return result
 
 
@@ -0,0 +1,730 @@
+from array import array
+import mmap
+import os
+import sys
+
+import CSVIndex
+import DataTableExceptions
+
+try:
+    import numpy
+except ImportError:
+    # The vectorized scan is only available with NumPy installed.
+    numpy = None
+
+
+# First bytes of a column cache file.
+cache_file_magic = b"CSVCOL02"
+
+# Number of rows a streaming select (ColumnStore.iter_select) materialises at a time.
+select_batch_size = 1024
+
+# Number of rows a streaming select compares at a time, so a select with a LIMIT stops scanning early.
+scan_chunk_size = 65536
+
+
+def _typecode(data):
+    """
+    :param data: An array, or a memoryview of a cache file.
+    :return: The array type code ('q', 'd', 'i' or 'B').
+    """
+    if isinstance(data, memoryview):
+        return data.format
+    return data.typecode
+
+
+def parse_number(value, column_name=None):
+    """
+    Parses the text of a number column.
+
+    :param value: The value, a string (or an already parsed number or None).
+    :param column_name: Column name, for the error message.
+    :return: An int, a float, or None for an empty value.
+    """
+    if value is None or not isinstance(value, str):
+        return value
+    value = value.strip()
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_column_definition,
+            message="Invalid number '" + value + "' in column " + str(column_name))
+
+
+def column_types(column_definitions):
+    """
+    :param column_definitions: The ColumnDefinitions of a table.
+    :return: List of (column name, column type, not_null), which is picklable (see CSVParallel.load_chunk).
+    """
+    return [(c.column_name, c.column_type, c.not_null) for c in column_definitions]
+
+
+def values_converter(column_names, types):
+    """
+    Builds the function that converts the values of a CSV record to the types of their columns, once, when the
+    record is read: an empty value (a blank cell) is NULL (None) in every column, number columns are parsed
+    with parse_number, and a NULL value in a not_null column is an error.
+
+    :param column_names: The names of the values, in order.
+    :param types: List of (column name, column type, not_null), see column_types.
+    :return: A function list of values -> list of typed values, or None if there are no values.
+    """
+    numbers = []
+    not_nulls = []
+    for name, column_type, not_null in types:
+        if name not in column_names:
+            continue
+        if column_type == "number":
+            numbers.append((column_names.index(name), name))
+        if not_null:
+            not_nulls.append((column_names.index(name), name))
+    if not column_names:
+        return None
+
+    def convert(values):
+        values = [v if v else None for v in values]
+        for i, name in numbers:
+            v = values[i]
+            if v is None:
+                continue
+            # Same result as parse_number, without its checks and failed int() for the common cases.
+            try:
+                values[i] = float(v) if "." in v else int(v)
+            except ValueError:
+                values[i] = parse_number(v, name)
+        for i, name in not_nulls:
+            if values[i] is None:
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.not_null_violation,
+                    message="NULL value in not null column " + name)
+        return values
+
+    return convert
+
+
+def coerce_template(column_definitions, t):
+    """
+    Converts the values of a template to the types of the columns, once per query. An empty value is NULL, as
+    in the rows (see values_converter).
+
+    :param column_definitions: The ColumnDefinitions of a table.
+    :param t: The template (or None).
+    :return: The template with typed values.
+    """
+    if not t:
+        return t
+    numbers = set([c.column_name for c in column_definitions if c.column_type == "number"])
+    if not numbers.intersection(t) and "" not in t.values():
+        return t
+    result = {}
+    for k, v in t.items():
+        if k in numbers:
+            v = parse_number(v, k)
+        elif v == "":
+            v = None
+        result[k] = v
+    return result
+
+
+class TextColumn:
+    """
+    A dictionary-encoded text column. Every distinct string is stored once, rows hold its integer code.
+
+    """
+
+    def __init__(self, column_name):
+        self.column_name = column_name
+        self.codes = array("i")
+
+        # code -> string, and string -> code
+        self.values = []
+        self.lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def append(self, v):
+        code = self.lookup.get(v)
+        if code is None:
+            code = len(self.values)
+            self.values.append(v)
+            self.lookup[v] = code
+        self.codes.append(code)
+
+    def get(self, i):
+        return self.values[self.codes[i]]
+
+    def coerce(self, v):
+        """
+        :param v: A template value.
+        :return: The value as stored in this column, None for an empty value.
+        """
+        if v == "":
+            return None
+        return v
+
+    def find_ids(self, v, candidates=None):
+        """
+        Finds the rows whose value equals v.
+
+        :param v: The value.
+        :param candidates: List of row ids to check, or None for all rows.
+        :return: List of matching row ids.
+        """
+        code = self.lookup.get(v)
+        if code is None:
+            return []
+        codes = self.codes
+        if candidates is None:
+            return [i for i, c in enumerate(codes) if c == code]
+        return [i for i in candidates if codes[i] == code]
+
+    def mask(self, v, start=0, stop=None):
+        """
+        :param v: The value.
+        :param start: First row id to compare.
+        :param stop: Row id after the last one to compare, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value equals v.
+        """
+        codes = numpy.frombuffer(self.codes, dtype=numpy.intc)[start:stop]
+        code = self.lookup.get(v)
+        if code is None:
+            return numpy.zeros(len(codes), dtype=bool)
+        return codes == code
+
+    def values_mask(self, test, start=0, stop=None):
+        """
+        Tests every distinct value once, and selects the rows by their code.
+
+        :param test: Function value -> bool.
+        :param start: First row id to test.
+        :param stop: Row id after the last one to test, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value passes the test.
+        """
+        codes = numpy.frombuffer(self.codes, dtype=numpy.intc)[start:stop]
+        passed = numpy.array([bool(test(v)) for v in self.values] + [False], dtype=bool)
+        return passed[codes]
+
+    def compare_mask(self, op, v, start=0, stop=None):
+        """
+        :param op: Comparison function, e.g. operator.lt.
+        :param v: The value.
+        :param start: First row id to compare.
+        :param stop: Row id after the last one to compare, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value x is not NULL and op(x, v).
+        """
+        if v is None:
+            return self.values_mask(lambda x: False, start, stop)
+        return self.values_mask(lambda x: x is not None and op(x, v), start, stop)
+
+    def in_mask(self, values, start=0, stop=None):
+        """
+        :param values: List of values.
+        :param start: First row id to compare.
+        :param stop: Row id after the last one to compare, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value is in values.
+        """
+        codes = numpy.frombuffer(self.codes, dtype=numpy.intc)[start:stop]
+        passed = numpy.zeros(len(self.values) + 1, dtype=bool)
+        for v in values:
+            code = self.lookup.get(v)
+            if code is not None:
+                passed[code] = True
+        return passed[codes]
+
+    def gather(self, ids):
+        """
+        :param ids: NumPy array of row ids.
+        :return: List of the values of these rows.
+        """
+        values = self.values
+        codes = numpy.frombuffer(self.codes, dtype=numpy.intc)[ids]
+        return [values[c] for c in codes.tolist()]
+
+
+class NumberColumn:
+    """
+    A typed number column. Values are held in an array('q') of integers, which is converted to an array('d')
+    of floats when the first non-integer value is added. NULLs are recorded in a separate byte mask.
+
+    """
+
+    def __init__(self, column_name):
+        self.column_name = column_name
+        self.data = array("q")
+        self.nulls = bytearray()
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, v):
+        if v is None:
+            self.nulls.append(1)
+            self.data.append(0)
+            return
+
+        self.nulls.append(0)
+        if self.data.typecode == "q" and isinstance(v, int):
+            try:
+                self.data.append(v)
+                return
+            except OverflowError:
+                pass
+        if self.data.typecode == "q":
+            self.data = array("d", self.data)
+        self.data.append(v)
+
+    def get(self, i):
+        if self.nulls[i]:
+            return None
+        return self.data[i]
+
+    def coerce(self, v):
+        """
+        :param v: A template value, e.g. the string "1954".
+        :return: The value as stored in this column, e.g. 1954.
+        """
+        return parse_number(v, self.column_name)
+
+    def find_ids(self, v, candidates=None):
+        """
+        Finds the rows whose value equals v (NULL matches NULL).
+
+        :param v: The value, already coerced.
+        :param candidates: List of row ids to check, or None for all rows.
+        :return: List of matching row ids.
+        """
+        nulls = self.nulls
+        if v is None:
+            if candidates is None:
+                return [i for i, n in enumerate(nulls) if n]
+            return [i for i in candidates if nulls[i]]
+
+        data = self.data
+        if candidates is None:
+            return [i for i, d in enumerate(data) if d == v and not nulls[i]]
+        return [i for i in candidates if data[i] == v and not nulls[i]]
+
+    def __numpy_data__(self):
+        if _typecode(self.data) == "q":
+            return numpy.frombuffer(self.data, dtype=numpy.int64)
+        return numpy.frombuffer(self.data, dtype=numpy.float64)
+
+    def mask(self, v, start=0, stop=None):
+        """
+        :param v: The value, already coerced.
+        :param start: First row id to compare.
+        :param stop: Row id after the last one to compare, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value equals v (NULL matches NULL).
+        """
+        nulls = numpy.frombuffer(self.nulls, dtype=numpy.uint8)[start:stop]
+        if v is None:
+            return nulls == 1
+        return (self.__numpy_data__()[start:stop] == v) & (nulls == 0)
+
+    def values_mask(self, test, start=0, stop=None):
+        """
+        :param test: Function value -> bool, called once per row.
+        :param start: First row id to test.
+        :param stop: Row id after the last one to test, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value passes the test.
+        """
+        if stop is None:
+            stop = len(self)
+        values = self.gather(numpy.arange(start, stop))
+        return numpy.fromiter((bool(test(v)) for v in values), dtype=bool, count=len(values))
+
+    def compare_mask(self, op, v, start=0, stop=None):
+        """
+        :param op: Comparison function, e.g. operator.lt.
+        :param v: The value, already coerced.
+        :param start: First row id to compare.
+        :param stop: Row id after the last one to compare, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value x is not NULL and op(x, v).
+        """
+        nulls = numpy.frombuffer(self.nulls, dtype=numpy.uint8)[start:stop]
+        if v is None:
+            return numpy.zeros(len(nulls), dtype=bool)
+        return op(self.__numpy_data__()[start:stop], v) & (nulls == 0)
+
+    def in_mask(self, values, start=0, stop=None):
+        """
+        :param values: List of values, already coerced.
+        :param start: First row id to compare.
+        :param stop: Row id after the last one to compare, or None for the end of the column.
+        :return: NumPy boolean array, True for the rows whose value is in values (NULL matches NULL).
+        """
+        nulls = numpy.frombuffer(self.nulls, dtype=numpy.uint8)[start:stop]
+        numbers = [v for v in values if v is not None]
+        result = numpy.isin(self.__numpy_data__()[start:stop], numbers) & (nulls == 0)
+        if len(numbers) < len(values):
+            result |= nulls == 1
+        return result
+
+    def gather(self, ids):
+        """
+        :param ids: NumPy array of row ids.
+        :return: List of the values of these rows, None for NULLs.
+        """
+        values = self.__numpy_data__()[ids].tolist()
+        nulls = numpy.frombuffer(self.nulls, dtype=numpy.uint8)[ids]
+        if nulls.any():
+            for i in numpy.flatnonzero(nulls).tolist():
+                values[i] = None
+        return values
+
+
+class ColumnStore:
+    """
+    Column-oriented storage for the rows of a CSVTable (CSVTable(t_name, columnar=True)).
+
+    Each column is held in a typed array: number columns as int/float arrays, text columns as dictionary-encoded
+    integer codes. Row dictionaries are only materialised when a row is read, so the store can be used where a
+    list of rows is expected (len, iteration, indexing and slicing).
+
+    """
+
+    def __init__(self, column_definitions):
+        """
+        :param column_definitions: The ColumnDefinitions of the table, in column order.
+        """
+        self.column_names = []
+        self.columns = {}
+        for c in column_definitions:
+            self.column_names.append(c.column_name)
+            if c.column_type == "number":
+                self.columns[c.column_name] = NumberColumn(c.column_name)
+            else:
+                self.columns[c.column_name] = TextColumn(c.column_name)
+        self.row_count = 0
+
+        # The memory-mapped cache file the columns point into, if the store was loaded by load_store.
+        self.mapped_file = None
+
+    def __len__(self):
+        return self.row_count
+
+    def __iter__(self):
+        for i in range(self.row_count):
+            yield self.row(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.row(j) for j in range(*i.indices(self.row_count))]
+        if i < 0:
+            i += self.row_count
+        if i < 0 or i >= self.row_count:
+            raise IndexError("row id out of range")
+        return self.row(i)
+
+    def convert_row(self, row):
+        """
+        Converts the values of a row read from the CSV file to the types of the columns.
+
+        :param row: Row dictionary with string values.
+        :return: A new row dictionary with typed values.
+        """
+        result = {}
+        for c in self.column_names:
+            result[c] = self.columns[c].coerce(row[c])
+        return result
+
+    def append(self, row):
+        """
+        Adds a row. Values must already have the column types (see convert_row).
+
+        :param row: The row dictionary.
+        :return: Nothing
+        """
+        for c in self.column_names:
+            self.columns[c].append(row[c])
+        self.row_count += 1
+
+    def row(self, i, fields=None):
+        """
+        Materialises a row.
+
+        :param i: Row id.
+        :param fields: Columns to return, or None for all columns.
+        :return: The row dictionary.
+        """
+        if fields is None:
+            fields = self.column_names
+        result = {}
+        for c in fields:
+            result[c] = self.columns[c].get(i)
+        return result
+
+    def coerce_template(self, t):
+        """
+        Converts the values of a template to the types of the columns, once per query.
+
+        :param t: The template (or None).
+        :return: A new template with typed values.
+        """
+        if t is None:
+            return None
+        result = {}
+        for k, v in t.items():
+            column = self.columns.get(k)
+            if column is None:
+                result[k] = v
+            else:
+                result[k] = column.coerce(v)
+        return result
+
+    def find_ids(self, t, candidates=None):
+        """
+        Finds the rows matching a template by comparing the column arrays, without materialising rows.
+
+        :param t: A template with typed values (see coerce_template). Must only reference columns of the store.
+        :param candidates: Row ids to check (e.g. a range), or None for all rows.
+        :return: List of matching row ids, in row order.
+        """
+        if not t:
+            if candidates is None:
+                return list(range(self.row_count))
+            return list(candidates)
+
+        for k, v in t.items():
+            candidates = self.columns[k].find_ids(v, candidates)
+            if not candidates:
+                return []
+        return candidates
+
+    def find_ids_vectorized(self, t, start=0, stop=None):
+        """
+        Finds the rows matching a template with NumPy: one boolean mask per template column, ANDed together.
+
+        :param t: A template with typed values (see coerce_template). Must only reference columns of the store.
+        :param start: First row id to check.
+        :param stop: Row id after the last one to check, or None for all remaining rows.
+        :return: NumPy array of the matching row ids, in row order.
+        """
+        if stop is None:
+            stop = self.row_count
+        mask = numpy.ones(stop - start, dtype=bool)
+        if t:
+            for k, v in t.items():
+                mask &= self.columns[k].mask(v, start, stop)
+        return numpy.flatnonzero(mask) + start
+
+    def select(self, t, fields=None, vectorized=None):
+        """
+        Returns the rows matching a template, projected on fields.
+
+        :param t: A template with typed values (see coerce_template), or None.
+        :param fields: Columns to return, or None for all columns.
+        :param vectorized: Use the NumPy scan engine (masks over the columns and a bulk gather of the projected
+            columns). Defaults to True when NumPy is installed.
+        :return: List of row dictionaries.
+        """
+        return list(self.iter_select(t, fields, vectorized))
+
+    def iter_select(self, t, fields=None, vectorized=None):
+        """
+        Streams the rows matching a template, projected on fields. The columns are compared scan_chunk_size rows
+        at a time and the matching rows are materialised select_batch_size at a time, so a consumer that stops
+        early (e.g. a LIMIT) does not pay for a full scan.
+
+        :param t: A template with typed values (see coerce_template), or None.
+        :param fields: Columns to return, or None for all columns.
+        :param vectorized: Use the NumPy scan engine, see select.
+        :return: A generator over row dictionaries.
+        """
+        if fields is None:
+            fields = self.column_names
+        if vectorized is None:
+            vectorized = numpy is not None
+
+        for start in range(0, self.row_count, scan_chunk_size):
+            stop = min(start + scan_chunk_size, self.row_count)
+            if not vectorized:
+                for row_id in self.find_ids(t, range(start, stop)):
+                    yield self.row(row_id, fields)
+                continue
+
+            yield from self.__iter_gather__(self.find_ids_vectorized(t, start, stop), fields)
+
+    def iter_select_predicate(self, predicate, fields=None, vectorized=None):
+        """
+        Streams the rows for which a predicate is true (see CSVPredicate), projected on fields, scan_chunk_size
+        rows at a time like iter_select. With NumPy the predicate is evaluated as a mask over the columns,
+        otherwise its compiled function tests the materialised rows.
+
+        :param predicate: A CSVPredicate.Predicate with typed values. Must only reference columns of the store.
+        :param fields: Columns to return, or None for all columns.
+        :param vectorized: Use the NumPy scan engine, see select.
+        :return: A generator over row dictionaries.
+        """
+        if fields is None:
+            fields = self.column_names
+        if vectorized is None:
+            vectorized = numpy is not None
+
+        test = None
+        if not vectorized:
+            test = predicate.compile()
+        for start in range(0, self.row_count, scan_chunk_size):
+            stop = min(start + scan_chunk_size, self.row_count)
+            if not vectorized:
+                for row_id in range(start, stop):
+                    row = self.row(row_id)
+                    if test(row):
+                        yield {f: row[f] for f in fields}
+                continue
+
+            yield from self.__iter_gather__(numpy.flatnonzero(predicate.mask(self, start, stop)) + start, fields)
+
+    def __iter_gather__(self, ids, fields):
+        """
+        Materialises rows select_batch_size at a time, with one bulk gather per column.
+
+        :param ids: NumPy array of row ids.
+        :param fields: Columns to return.
+        :return: A generator over row dictionaries.
+        """
+        for i in range(0, len(ids), select_batch_size):
+            batch = ids[i:i + select_batch_size]
+            columns = [self.columns[c].gather(batch) for c in fields]
+            for values in zip(*columns):
+                yield dict(zip(fields, values))
+
+
+def cache_file_name(csv_file_name):
+    """
+    :param csv_file_name: Path of the table's CSV file.
+    :return: Path of the column cache file, next to the CSV file.
+    """
+    return csv_file_name + ".colcache"
+
+
+def save_store(store, file_name, signature, statistics=None):
+    """
+    Writes a ColumnStore to a cache file.
+
+    Layout: the header (see CSVIndex.write_header: signature, statistics, and per column its type, string
+    dictionary and the position of its arrays), then the fixed-width column arrays, each
+    aligned to 8 bytes. The file is written to a temporary name and renamed. Errors (e.g. a read-only directory)
+    are ignored, the cache is simply rebuilt on the next load.
+
+    :param store: The ColumnStore.
+    :param file_name: Path of the cache file.
+    :param signature: Identifies the CSV file and table definition the store was loaded from.
+    :param statistics: JSON of the table statistics, saved with the columns.
+    :return: Nothing
+    """
+    # Collect the arrays to write with their offsets relative to the start of the data section.
+    arrays = []
+    columns = []
+    position = 0
+
+    def add_array(a):
+        nonlocal position
+        offset = position
+        arrays.append(a)
+        position += len(a) * a.itemsize
+        position += -position % 8
+        return offset
+
+    for c in store.column_names:
+        column = store.columns[c]
+        if isinstance(column, TextColumn):
+            columns.append({
+                "column_name": c,
+                "kind": "text",
+                "values": column.values,
+                "codes": add_array(array("i", column.codes))
+            })
+        else:
+            columns.append({
+                "column_name": c,
+                "kind": "number",
+                "typecode": _typecode(column.data),
+                "data": add_array(array(_typecode(column.data), column.data)),
+                "nulls": add_array(array("B", column.nulls))
+            })
+
+    header = {
+        "signature": signature,
+        "byteorder": sys.byteorder,
+        "row_count": store.row_count,
+        "statistics": statistics,
+        "columns": columns
+    }
+
+    tmp_name = file_name + ".tmp"
+    try:
+        with open(tmp_name, "wb") as f:
+            CSVIndex.write_header(f, cache_file_magic, header)
+            for a in arrays:
+                a.tofile(f)
+                f.write(b"\0" * (-(len(a) * a.itemsize) % 8))
+        os.replace(tmp_name, file_name)
+    except OSError:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+
+
+def load_store(column_definitions, file_name, signature):
+    """
+    Opens a cache file written by save_store. The column arrays are memory-mapped views of the file, nothing is
+    parsed or copied except the string dictionaries. The returned store is read-only.
+
+    :param column_definitions: The ColumnDefinitions of the table.
+    :param file_name: Path of the cache file.
+    :param signature: Signature of the current CSV file and table definition.
+    :return: The ColumnStore and the saved statistics JSON, or None and None if there is no valid cache for
+        this signature.
+    """
+    try:
+        with open(file_name, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None, None
+
+    header, data_start = CSVIndex.read_header(mapped, cache_file_magic, signature)
+    if header is None:
+        return None, None
+
+    data = memoryview(mapped)[data_start:]
+
+    def view(offset, typecode, itemsize):
+        # A view that does not fit in the file (a truncated or altered file) fails the load.
+        if offset < 0 or offset + n * itemsize > len(data):
+            raise ValueError("Column array outside of the cache file")
+        return data[offset:offset + n * itemsize].cast(typecode)
+
+    store = ColumnStore(column_definitions)
+    try:
+        n = header["row_count"]
+        if not isinstance(n, int) or n < 0:
+            return None, None
+        if sorted(saved["column_name"] for saved in header["columns"]) != sorted(store.column_names):
+            return None, None
+        for saved in header["columns"]:
+            column = store.columns[saved["column_name"]]
+            if saved["kind"] == "text":
+                column.codes = view(saved["codes"], "i", array("i").itemsize)
+                column.values = saved["values"]
+                column.lookup = {v: code for code, v in enumerate(column.values)}
+            elif saved["typecode"] in ("q", "d"):
+                column.data = view(saved["data"], saved["typecode"], 8)
+                column.nulls = view(saved["nulls"], "B", 1)
+            else:
+                return None, None
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+    store.mapped_file = mapped
+    store.row_count = n
+    return store, header.get("statistics")
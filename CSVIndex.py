@@ -0,0 +1,436 @@
+from array import array
+import bisect
+import json
+import mmap
+import operator
+import os
+import sys
+
+
+# First bytes of an index file.
+index_file_magic = b"CSVIDX02"
+
+
+class HashIndex:
+    """
+    An in-memory hash index on one or more columns of a CSVTable.
+    Maps an index key to the list of positions (row ids) of the rows with that key, in load order.
+
+    The key of a single column index is the column value, the key of a composite index is the tuple of the
+    column values in index order.
+
+    """
+
+    def __init__(self, index_definition):
+        """
+        :param index_definition: The IndexDefinition (from the catalog) this index is built for.
+        """
+        self.index_name = index_definition.index_name
+        self.index_type = index_definition.index_type
+        self.column_names = list(index_definition.column_names)
+
+        # Builds the key from a row (or a template) without intermediate lists or string copies.
+        self.get_key = operator.itemgetter(*self.column_names)
+
+        # key -> list of row ids
+        self.entries = {}
+
+        # Number of rows added to the index.
+        self.row_count = 0
+
+        # The memory-mapped index file the entries point into, if the index was loaded by load_index.
+        # Such an index is read-only.
+        self.mapped_file = None
+
+    def __str__(self):
+        return json.dumps(self.to_json(), indent=2)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def to_json(self):
+        result = {
+            "index_name": self.index_name,
+            "type": self.index_type,
+            "columns": self.column_names,
+            "distinct_keys": self.distinct_keys(),
+            "row_count": self.row_count
+        }
+        return result
+
+    def add(self, key, row_id):
+        """
+        Adds a row to the index.
+
+        :param key: The index key of the row.
+        :param row_id: Position of the row in the table.
+        :return: Nothing
+        """
+        bucket = self.entries.get(key)
+        if bucket is None:
+            self.entries[key] = [row_id]
+        else:
+            bucket.append(row_id)
+        self.row_count += 1
+
+    def add_entries(self, entries, offset):
+        """
+        Adds the entries of a partial index, e.g. one built on a chunk of the table by a CSVParallel worker.
+        Partial indexes must be added in row order, the result is then the same as adding every row.
+
+        :param entries: Dictionary key -> list of row ids relative to the start of the chunk.
+        :param offset: Row id of the first row of the chunk.
+        :return: Nothing
+        """
+        for key, row_ids in entries.items():
+            self.add_ids(key, [row_id + offset for row_id in row_ids])
+
+    def add_ids(self, key, row_ids):
+        """
+        Adds rows with the same key to the index.
+
+        :param key: The index key of the rows.
+        :param row_ids: List of row ids, ascending and after all row ids in the index.
+        :return: Nothing
+        """
+        bucket = self.entries.get(key)
+        if bucket is None:
+            self.entries[key] = row_ids
+        else:
+            bucket.extend(row_ids)
+        self.row_count += len(row_ids)
+
+    def find(self, key):
+        """
+        Looks up a key.
+
+        :param key: The index key.
+        :return: List of row ids with that key. Empty if the key is not in the index.
+        """
+        return self.entries.get(key, [])
+
+    def distinct_keys(self):
+        """
+        :return: The number of distinct keys in the index.
+        """
+        return len(self.entries)
+
+    def rows_per_key(self):
+        """
+        The average number of rows returned by a lookup, i.e. the selectivity of the index. Lower is more selective.
+
+        :return: row_count / distinct_keys, or 0 for an empty index.
+        """
+        if not self.entries:
+            return 0
+        return self.row_count / len(self.entries)
+
+
+def _order_value(v):
+    """
+    Maps a column value to a value that sorts NULL (None) before every other value.
+
+    :param v: A column value.
+    :return: A tuple that compares in the order of the values.
+    """
+    if v is None:
+        return (0,)
+    return (1, v)
+
+
+def order_key(key_tuple):
+    """
+    :param key_tuple: Tuple of column values.
+    :return: The sort key of the tuple, see _order_value.
+    """
+    return tuple([_order_value(v) for v in key_tuple])
+
+
+class OrderedIndex(HashIndex):
+    """
+    An ordered index on one or more columns of a CSVTable (index type "ORDERED").
+
+    Besides equality lookups on the full key it supports leftmost-prefix lookups on a composite index, range
+    lookups on the column that follows the prefix and iteration in key order. The distinct keys are kept in a
+    sorted array that is (re)built on the first ordered access after new keys were added.
+    Keys are compared with the natural order of the column values, NULLs first.
+
+    """
+
+    def __init__(self, index_definition):
+        super().__init__(index_definition)
+
+        # Sorted list of the distinct keys, each as a tuple of column values, and the list of their sort keys.
+        # None when they must be rebuilt.
+        self.sorted_keys = None
+        self.order_keys = None
+
+    def add(self, key, row_id):
+        if key not in self.entries:
+            self.sorted_keys = None
+            self.order_keys = None
+        super().add(key, row_id)
+
+    def add_ids(self, key, row_ids):
+        if key not in self.entries:
+            self.sorted_keys = None
+            self.order_keys = None
+        super().add_ids(key, row_ids)
+
+    def __get_sorted_keys__(self):
+        """
+        :return: The sorted list of distinct keys, each as a tuple of column values.
+        """
+        if self.sorted_keys is None:
+            if len(self.column_names) == 1:
+                keys = [(k,) for k in self.entries.keys()]
+            else:
+                keys = list(self.entries.keys())
+            keys.sort(key=order_key)
+            self.sorted_keys = keys
+            self.order_keys = [order_key(k) for k in keys]
+        return self.sorted_keys
+
+    def __entry_key__(self, key_tuple):
+        """
+        Converts a key from the sorted array back to the key used in self.entries.
+
+        :param key_tuple: Tuple of column values.
+        :return: The entry key.
+        """
+        if len(self.column_names) == 1:
+            return key_tuple[0]
+        return key_tuple
+
+    def find_range(self, prefix=(), low=None, high=None, reverse=False):
+        """
+        Finds the rows whose key starts with prefix and whose next column is between low and high (inclusive).
+        With low and high both None this is a leftmost-prefix lookup. NULL values are never in a bounded range.
+
+        :param prefix: Tuple with the values of the first len(prefix) index columns.
+        :param low: Lower bound for the column after the prefix, or None for no lower bound.
+        :param high: Upper bound for the column after the prefix, or None for no upper bound.
+        :param reverse: Return the rows in descending key order.
+        :return: List of row ids, in key order.
+        """
+        prefix = tuple(prefix)
+        n = len(prefix)
+        if n == len(self.column_names):
+            return list(self.find(self.__entry_key__(prefix)))
+
+        keys = self.__get_sorted_keys__()
+        order_keys = self.order_keys
+        order_prefix = order_key(prefix)
+        if low is None:
+            start = bisect.bisect_left(order_keys, order_prefix)
+        else:
+            start = bisect.bisect_left(order_keys, order_prefix + (_order_value(low),))
+
+        if high is not None:
+            order_high = _order_value(high)
+
+        matched_keys = []
+        for i in range(start, len(keys)):
+            ok = order_keys[i]
+            if ok[:n] != order_prefix:
+                break
+            if high is not None and ok[n] > order_high:
+                break
+            if (low is not None or high is not None) and keys[i][n] is None:
+                continue
+            matched_keys.append(keys[i])
+
+        if reverse:
+            matched_keys.reverse()
+
+        result = []
+        for k in matched_keys:
+            result.extend(self.entries[self.__entry_key__(k)])
+        return result
+
+    def iter_ordered(self, reverse=False):
+        """
+        Iterates over the rows of the table in key order.
+
+        :param reverse: Iterate in descending key order.
+        :return: A generator over row ids.
+        """
+        keys = self.__get_sorted_keys__()
+        if reverse:
+            keys = reversed(keys)
+        for k in keys:
+            yield from self.entries[self.__entry_key__(k)]
+
+
+def create_index(index_definition):
+    """
+    Creates the empty index structure for an index definition.
+
+    :param index_definition: An IndexDefinition from the catalog.
+    :return: An OrderedIndex for an ORDERED index, a HashIndex otherwise.
+    """
+    if index_definition.index_type == "ORDERED":
+        return OrderedIndex(index_definition)
+    return HashIndex(index_definition)
+
+
+def index_file_name(csv_file_name, index_name):
+    """
+    :param csv_file_name: Path of the table's CSV file.
+    :param index_name: Name of the index.
+    :return: Path of the index file, next to the CSV file.
+    """
+    return csv_file_name + "." + index_name + ".idx"
+
+
+def write_header(f, magic, header):
+    """
+    Writes the start of an index or cache file: the magic bytes, the length of the header, the header as UTF-8
+    JSON and padding to 8 bytes. The header is data only, reading it cannot run code.
+
+    :param f: File open for binary writing, at its start.
+    :param magic: The magic bytes of the file type.
+    :param header: Dictionary of JSON values. Tuples are written as lists.
+    :return: Nothing
+    """
+    header = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    f.write(magic)
+    f.write(len(header).to_bytes(8, "little"))
+    f.write(header)
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+def read_header(mapped, magic, signature):
+    """
+    Reads the header written by write_header and checks it belongs to the current file.
+
+    :param mapped: The mapped file.
+    :param magic: The magic bytes of the file type.
+    :param signature: Signature of the current CSV file and table definition.
+    :return: The header and the offset of the data after it, or None and None if the file is not of this type,
+        is truncated, or has another signature or byte order.
+    """
+    start = len(magic) + 8
+    if len(mapped) < start or mapped[:len(magic)] != magic:
+        return None, None
+    header_length = int.from_bytes(mapped[len(magic):start], "little")
+    if header_length > len(mapped) - start:
+        return None, None
+    try:
+        header = json.loads(mapped[start:start + header_length].decode("utf-8"))
+    except ValueError:
+        return None, None
+
+    # The signature is compared as it reads back from JSON (tuples become lists).
+    if not isinstance(header, dict) or header.get("byteorder") != sys.byteorder or \
+            header.get("signature") != json.loads(json.dumps(signature)):
+        return None, None
+
+    data_start = start + header_length
+    data_start += -data_start % 8
+    return header, data_start
+
+
+def save_index(index, file_name, signature):
+    """
+    Writes an index to an index file.
+
+    Layout: the header (see write_header: signature, index definition, row count and the list of keys), then the row ids of all keys as one int64 array followed by an int64
+    array of the offset of each key's row ids in it. The file is written to a temporary name and renamed, so
+    readers never see a partial file. Errors (e.g. a read-only directory) are ignored, the index is simply
+    rebuilt on the next load.
+
+    :param index: A HashIndex or OrderedIndex.
+    :param file_name: Path of the index file.
+    :param signature: Identifies the CSV file and table definition the index was built from.
+    :return: Nothing
+    """
+    if isinstance(index, OrderedIndex):
+        keys = [index.__entry_key__(k) for k in index.__get_sorted_keys__()]
+    else:
+        keys = list(index.entries.keys())
+
+    row_ids = array("q")
+    offsets = array("q", [0])
+    for k in keys:
+        row_ids.extend(index.entries[k])
+        offsets.append(len(row_ids))
+
+    header = {
+        "signature": signature,
+        "byteorder": sys.byteorder,
+        "index_name": index.index_name,
+        "index_type": index.index_type,
+        "column_names": index.column_names,
+        "row_count": len(row_ids),
+        "keys": keys
+    }
+
+    tmp_name = file_name + ".tmp"
+    try:
+        with open(tmp_name, "wb") as f:
+            write_header(f, index_file_magic, header)
+            row_ids.tofile(f)
+            offsets.tofile(f)
+        os.replace(tmp_name, file_name)
+    except OSError:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+
+
+def load_index(index_definition, file_name, signature):
+    """
+    Opens an index file written by save_index. Only the row ids are zero-copy: each key maps to a slice of the
+    mapped array. The keys are decoded from the JSON header and the entries dictionary (and for an ORDERED index
+    the sort keys) is rebuilt, so opening still costs Python work per distinct key. The file saves the scan of
+    the rows and the lists of row ids, not that work: an index with about one row per key opens in about the
+    time it takes to build it.
+
+    :param index_definition: The IndexDefinition the index must match.
+    :param file_name: Path of the index file.
+    :param signature: Signature of the current CSV file and table definition.
+    :return: The index, or None if there is no valid file for this signature (it must then be rebuilt).
+    """
+    try:
+        with open(file_name, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    header, data_start = read_header(mapped, index_file_magic, signature)
+    if header is None or header.get("index_type") != index_definition.index_type or \
+            header.get("column_names") != list(index_definition.column_names):
+        return None
+
+    try:
+        keys = header["keys"]
+        row_count = header["row_count"]
+        data = memoryview(mapped)[data_start:].cast("q")
+        if len(data) != row_count + len(keys) + 1:
+            return None
+        offsets = data[row_count:]
+        row_ids = data[:row_count]
+        if offsets[0] != 0 or offsets[-1] != row_count:
+            return None
+
+        # JSON has no tuples: the keys of a composite index are read back as lists.
+        if len(index_definition.column_names) > 1:
+            keys = [tuple(k) for k in keys]
+
+        index = create_index(index_definition)
+        for i in range(len(keys)):
+            index.entries[keys[i]] = row_ids[offsets[i]:offsets[i + 1]]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    index.mapped_file = mapped
+    index.row_count = row_count
+    if isinstance(index, OrderedIndex):
+        if len(index.column_names) == 1:
+            index.sorted_keys = [(k,) for k in keys]
+        else:
+            index.sorted_keys = list(keys)
+        index.order_keys = [order_key(k) for k in index.sorted_keys]
+    return index
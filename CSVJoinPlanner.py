@@ -0,0 +1,328 @@
+import json
+import operator
+
+import DataTableExceptions
+import CSVOperators
+import CSVStatistics
+
+
+"""
+Multi-way joins. A join of N tables is described by the list of tables, the join predicates between pairs of
+tables and a where template. The where template is pushed down to the tables, and the join order is chosen by
+dynamic programming over the subsets of the tables (bushy plans included), with the cardinality estimates of the
+cost model in CSVStatistics. Every join is a hash join, built on the input with fewer estimated rows.
+
+A joined row is {**row_1, **row_2, ..., **row_N} in the order of the tables, whatever the join order, so a
+column present in several tables is read from the last one. This is the row a chain of pairwise joins
+t1.__smart_join__(t2, ...).__smart_join__(t3, ...) returns.
+"""
+
+
+def _invalid(message):
+    """
+    :param message: Error message.
+    :return: Nothing, raises a DataTableException.
+    """
+    raise DataTableExceptions.DataTableException(
+        code=DataTableExceptions.DataTableException.invalid_argument,
+        message=message)
+
+
+def _resolve_predicates(tables, join_predicates):
+    """
+    Checks the join predicates and replaces the table names by positions.
+
+    :param tables: List of CSVTables, with distinct table names.
+    :param join_predicates: List of (left table name, right table name, on_fields).
+    :return: List of (left position, right position, on_fields).
+    """
+    positions = {}
+    for i, t in enumerate(tables):
+        if t.__table_name__ in positions:
+            _invalid("Table " + t.__table_name__ + " is joined twice")
+        positions[t.__table_name__] = i
+
+    result = []
+    for left_name, right_name, on_fields in join_predicates:
+        if left_name not in positions or right_name not in positions or left_name == right_name:
+            _invalid("Invalid join predicate " + str((left_name, right_name, on_fields)))
+        i = positions[left_name]
+        j = positions[right_name]
+        for t in (tables[i], tables[j]):
+            columns = t.__get_column_names__()
+            for f in on_fields:
+                if f not in columns:
+                    _invalid("Invalid join field " + f + " for table " + t.__table_name__)
+        result.append((i, j, list(on_fields)))
+    return result
+
+
+def _push_down_templates(tables, predicates, where_template):
+    """
+    Splits the where template into one template per table.
+
+    A where column is read from the last table that has it, so it is pushed down to that table, and to the
+    tables whose column is equal to it through join predicates.
+
+    :param tables: List of CSVTables.
+    :param predicates: List of (left position, right position, on_fields).
+    :param where_template: The where template (or None).
+    :return: List of templates, one per table.
+    """
+    templates = [{} for t in tables]
+    if not where_template:
+        return templates
+
+    # Union-find over (table position, column): join predicates make the columns equal.
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            x = parent[x]
+        return x
+
+    for i, j, on_fields in predicates:
+        for f in on_fields:
+            parent[find((i, f))] = find((j, f))
+
+    columns = [t.__get_column_names__() for t in tables]
+    for c, v in where_template.items():
+        owners = [i for i in range(len(tables)) if c in columns[i]]
+        if not owners:
+            continue
+        last = find((owners[-1], c))
+        for i in owners:
+            if find((i, c)) == last:
+                templates[i][c] = v
+    return templates
+
+
+def _join_keys(predicates, left_mask, right_mask):
+    """
+    :param predicates: List of (left position, right position, on_fields).
+    :param left_mask: Bit mask of the tables of the left input.
+    :param right_mask: Bit mask of the tables of the right input.
+    :return: The predicates that connect the inputs, oriented as (left position, right position, on_fields).
+    """
+    result = []
+    for i, j, on_fields in predicates:
+        if left_mask >> i & 1 and right_mask >> j & 1:
+            result.append((i, j, on_fields))
+        elif left_mask >> j & 1 and right_mask >> i & 1:
+            result.append((j, i, on_fields))
+    return result
+
+
+def _join_node(tables, predicates, left, right, left_mask, right_mask):
+    """
+    Builds the plan of a hash join of two sub-plans and estimates its rows and cost.
+
+    :return: The plan, a dictionary.
+    """
+    keys = _join_keys(predicates, left_mask, right_mask)
+    estimated_rows = left["estimated_rows"] * right["estimated_rows"]
+    for i, j, on_fields in keys:
+        distinct = max(tables[i].__estimate_distinct__(on_fields), tables[j].__estimate_distinct__(on_fields))
+        estimated_rows /= distinct
+
+    plan = {
+        "operation": "HASH JOIN",
+        "on": [{"left": tables[i].__table_name__, "right": tables[j].__table_name__, "fields": on_fields}
+               for i, j, on_fields in keys],
+        "left": left,
+        "right": right,
+        "estimated_rows": estimated_rows,
+        "estimated_cost": left["estimated_cost"] + right["estimated_cost"] +
+                          CSVStatistics.hash_join_cost(left["estimated_rows"], right["estimated_rows"])
+    }
+    if not keys:
+        plan["operation"] = "CROSS JOIN"
+    return plan
+
+
+def choose_join_order(tables, join_predicates, where_template=None):
+    """
+    Chooses the join order of a multi-way join and estimates its cost.
+
+    :param tables: List of CSVTables, with distinct table names.
+    :param join_predicates: List of (left table name, right table name, on_fields), e.g.
+        [("people", "batting", ["playerID"]), ("batting", "appearances", ["playerID", "yearID", "teamID"])].
+    :param where_template: The where template of the join.
+    :return: The plan, a dictionary. The leaves are the access plans of the tables (see CSVTable.explain), the
+        inner nodes the joins. The top node also has the estimated cost of the left-deep plan in table order.
+    """
+    if not tables:
+        _invalid("No tables to join")
+
+    predicates = _resolve_predicates(tables, join_predicates)
+    templates = _push_down_templates(tables, predicates, where_template)
+
+    # bit mask of a set of tables -> best plan
+    best = {}
+    for i, t in enumerate(tables):
+        best[1 << i] = t.__choose_access_plan__(templates[i])
+
+    n = len(tables)
+    for mask in range(1, 1 << n):
+        if mask in best:
+            continue
+        low_bit = mask & -mask
+
+        # Every split of the set into two inputs, each split once (the left input has the lowest table).
+        left_mask = (mask - 1) & mask
+        while left_mask:
+            right_mask = mask ^ left_mask
+            if left_mask & low_bit and right_mask:
+                plan = _join_node(tables, predicates, best[left_mask], best[right_mask], left_mask, right_mask)
+                if mask not in best or plan["estimated_cost"] < best[mask]["estimated_cost"]:
+                    best[mask] = plan
+            left_mask = (left_mask - 1) & mask
+
+    plan = dict(best[(1 << n) - 1])
+
+    left_deep = best[1]
+    for i in range(1, n):
+        left_deep = _join_node(tables, predicates, left_deep, best[1 << i], (1 << i) - 1, 1 << i)
+    plan["left_deep_cost"] = left_deep["estimated_cost"]
+
+    return plan
+
+
+def explain_join(tables, join_predicates, where_template=None):
+    """
+    :return: The plan chosen by choose_join_order, as indented JSON.
+    """
+    return json.dumps(choose_join_order(tables, join_predicates, where_template), indent=2)
+
+
+def _is_join(plan):
+    """
+    :param plan: A sub-plan.
+    :return: True for a join, False for a table access.
+    """
+    return plan["operation"] in ("HASH JOIN", "CROSS JOIN")
+
+
+def _key_function(plan, positions, keys):
+    """
+    :param plan: A sub-plan.
+    :param positions: Dictionary table name -> position.
+    :param keys: List of (table position, column) of the join key, all in tables of the sub-plan.
+    :return: Function returning the join key of a row of the sub-plan: the value for a single column, a tuple
+        otherwise.
+    """
+    if not _is_join(plan):
+        if not keys:
+            return lambda r: ()
+        return operator.itemgetter(*[f for i, f in keys])
+    if len(keys) == 1:
+        i, f = keys[0]
+        return lambda r: r[i][f]
+    return lambda r: tuple([r[i][f] for i, f in keys])
+
+
+def _composite_function(plan, positions):
+    """
+    :return: Function returning a row of the sub-plan as a dictionary table position -> row of that table.
+    """
+    if _is_join(plan):
+        return lambda r: r
+    i = positions[plan["table"]]
+    return lambda r: {i: r}
+
+
+def _execute(plan, tables, templates, positions):
+    """
+    Runs a plan. The rows of a table access are the rows of the table, the rows of a join are dictionaries
+    table position -> row of that table, so the rows of the tables are never copied.
+
+    :return: A generator over the rows.
+    """
+    if not _is_join(plan):
+        i = positions[plan["table"]]
+        return tables[i].__iter_find_by_template__(templates[i])
+    return _execute_join(plan, tables, templates, positions)
+
+
+def _execute_join(plan, tables, templates, positions):
+    """
+    Runs a join: builds a hash table on one input and streams the other one through it.
+
+    :return: A generator over the joined rows.
+    """
+    left_keys = []
+    right_keys = []
+    for p in plan["on"]:
+        for f in p["fields"]:
+            left_keys.append((positions[p["left"]], f))
+            right_keys.append((positions[p["right"]], f))
+
+    left = (plan["left"], _execute(plan["left"], tables, templates, positions),
+            _key_function(plan["left"], positions, left_keys), _composite_function(plan["left"], positions))
+    right = (plan["right"], _execute(plan["right"], tables, templates, positions),
+             _key_function(plan["right"], positions, right_keys), _composite_function(plan["right"], positions))
+
+    # Build on the input with fewer estimated rows, probe with the other one.
+    if plan["left"]["estimated_rows"] <= plan["right"]["estimated_rows"]:
+        build, probe = left, right
+    else:
+        build, probe = right, left
+    build_plan, build_rows, build_key, build_composite = build
+    probe_plan, probe_rows, probe_key, probe_composite = probe
+
+    hash_table = {}
+    for br in build_rows:
+        k = build_key(br)
+        bucket = hash_table.get(k)
+        if bucket is None:
+            hash_table[k] = [br]
+        else:
+            bucket.append(br)
+
+    for pr in probe_rows:
+        matches = hash_table.get(probe_key(pr))
+        if matches is None:
+            continue
+        pc = probe_composite(pr)
+        for br in matches:
+            yield {**build_composite(br), **pc}
+
+
+def multi_join(tables, join_predicates, where_template=None, project_fields=None, limit=None, offset=None):
+    """
+    Joins N tables in the order chosen by choose_join_order.
+
+    :param tables: List of CSVTables, with distinct table names.
+    :param join_predicates: List of (left table name, right table name, on_fields).
+    :param where_template: Select template to apply to the result.
+    :param project_fields: List of fields to return from the result.
+    :param limit: Maximum number of rows to return, or None for all rows.
+    :param offset: Number of result rows to skip, or None.
+    :return: CSVTable object that is the joined and filtered rows.
+    """
+    if project_fields == []:
+        project_fields = None
+
+    plan = choose_join_order(tables, join_predicates, where_template)
+    predicates = _resolve_predicates(tables, join_predicates)
+    templates = _push_down_templates(tables, predicates, where_template)
+    positions = {t.__table_name__: i for i, t in enumerate(tables)}
+
+    # The values of the where template have the types of the joined rows, i.e. of the last table with the column.
+    for t in tables:
+        where_template = t.__coerce_template__(where_template)
+
+    def merge(r):
+        row = {}
+        for i in range(len(tables)):
+            row.update(r[i])
+        return row
+
+    rows = _execute(plan, tables, templates, positions)
+    if _is_join(plan):
+        rows = (merge(r) for r in rows)
+    rows = CSVOperators.select(rows, CSVOperators.template_predicate(where_template))
+    rows = CSVOperators.project(CSVOperators.limit(rows, limit, offset), project_fields)
+
+    name = "JOIN(" + ",".join([t.__table_name__ for t in tables]) + ")"
+    return tables[0].__table_from_rows__(name, list(rows))
@@ -0,0 +1,526 @@
+import heapq
+import itertools
+import operator
+
+import DataTableExceptions
+import CSVColumnStore
+import CSVIndex
+import CSVSort
+
+
+"""
+Volcano-style query operators. Every operator takes its input as an iterator of row dictionaries and returns a
+generator, so rows are pulled through a pipeline (scan -> select -> join -> project -> limit) one at a time and
+nothing is materialised between operators. Only the build side of a hash join and one group of equal keys in a
+merge join are held in memory.
+"""
+
+
+# Maximum number of groups hash_aggregate holds in memory before it spills its partial aggregates to disk.
+default_max_groups = 100000
+
+# Maximum number of runs hash_aggregate keeps spilled. More runs are merged into one, so few files are open.
+max_spill_runs = 64
+
+
+def template_predicate(t):
+    """
+    Compiles an equality template into a function that tests a row, with the same semantics as
+    CSVTable.matches_template.
+
+    :param t: A template as a dictionary, or None.
+    :return: A function row -> bool.
+    """
+    if not t:
+        return lambda row: True
+
+    names = list(t.keys())
+    getter = operator.itemgetter(*names)
+    if len(names) == 1:
+        value = t[names[0]]
+    else:
+        value = tuple([t[n] for n in names])
+    return lambda row: getter(row) == value
+
+
+def scan(rows):
+    """
+    :param rows: Any iterable of rows (a list, a ColumnStore, a file reader).
+    :return: A generator over the rows.
+    """
+    yield from rows
+
+
+def select(rows, predicate):
+    """
+    :param rows: Input rows.
+    :param predicate: Function row -> bool.
+    :return: A generator over the rows for which the predicate is true.
+    """
+    for r in rows:
+        if predicate(r):
+            yield r
+
+
+def project(rows, fields):
+    """
+    :param rows: Input rows.
+    :param fields: List of column names, or None for all columns.
+    :return: A generator over new rows holding only the requested columns.
+    """
+    if not fields:
+        yield from rows
+        return
+
+    for r in rows:
+        try:
+            yield {f: r[f] for f in fields}
+        except KeyError as ke:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+
+
+def limit(rows, limit=None, offset=None):
+    """
+    Skips offset rows and stops after limit rows. The input is not pulled any further once the limit is
+    reached, so the operators below it stop early.
+
+    :param rows: Input rows.
+    :param limit: Maximum number of rows to return, or None.
+    :param offset: Number of rows to skip first, or None.
+    :return: An iterator over the rows.
+    """
+    offset = _check_limit(limit, offset)
+    if limit is None:
+        return itertools.islice(rows, offset, None)
+    return itertools.islice(rows, offset, offset + limit)
+
+
+def _check_limit(limit, offset):
+    """
+    :param limit: Maximum number of rows, or None.
+    :param offset: Number of rows to skip, or None.
+    :return: The offset, 0 if it is None. Raises a DataTableException for an invalid limit or offset.
+    """
+    for name, value in [("limit", limit), ("offset", offset)]:
+        if value is not None and (not isinstance(value, int) or value < 0):
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_argument,
+                message="Invalid " + name + " = " + str(value))
+    if offset is None:
+        return 0
+    return offset
+
+
+def merge_rows(lr, rr):
+    """
+    :param lr: Row of the left input.
+    :param rr: Row of the right input.
+    :return: The joined row. A column present in both rows is taken from the right row.
+    """
+    return {**lr, **rr}
+
+
+def projected_merge(fields, right_fields):
+    """
+    Builds a merge function that returns the projection of the joined row, without building the full joined row.
+
+    :param fields: List of fields to return. Each field must be a column of the left or the right input.
+    :param right_fields: Columns of the right input. A field present in both inputs is taken from the right row.
+    :return: A function (left row, right row) -> projected joined row.
+    """
+    right_fields = set(right_fields)
+    sources = [(f, f in right_fields) for f in fields]
+
+    def merge(lr, rr):
+        return {f: rr[f] if from_right else lr[f] for f, from_right in sources}
+    return merge
+
+
+def nested_loop_join(left_rows, right_rows, on_fields):
+    """
+    Joins every left row with every matching right row.
+
+    :param left_rows: Left input.
+    :param right_rows: Right input, a list (it is read once per left row).
+    :param on_fields: List of fields to join on.
+    :return: A generator over the joined rows.
+    """
+    key = operator.itemgetter(*on_fields)
+    for lr in left_rows:
+        k = key(lr)
+        for rr in right_rows:
+            if key(rr) == k:
+                yield merge_rows(lr, rr)
+
+
+def hash_join(build_rows, probe_rows, on_fields, build_is_left, merge=merge_rows):
+    """
+    Builds a hash table on one input keyed by the on_fields, then streams the other input through it.
+
+    :param build_rows: Input to hold in the hash table (the smaller one).
+    :param probe_rows: Input to stream.
+    :param on_fields: List of fields to join on.
+    :param build_is_left: True if build_rows is the left input of the join.
+    :param merge: Function (left row, right row) -> joined row.
+    :return: A generator over the joined rows.
+    """
+    key = operator.itemgetter(*on_fields)
+    hash_table = {}
+    for br in build_rows:
+        k = key(br)
+        bucket = hash_table.get(k)
+        if bucket is None:
+            hash_table[k] = [br]
+        else:
+            bucket.append(br)
+
+    for pr in probe_rows:
+        matches = hash_table.get(key(pr))
+        if matches is None:
+            continue
+        for br in matches:
+            if build_is_left:
+                yield merge(br, pr)
+            else:
+                yield merge(pr, br)
+
+
+def index_nested_loop_join(scan_rows, lookup, scan_is_left, merge=merge_rows):
+    """
+    Streams one input and looks up the matching rows of the other one for every row.
+
+    :param scan_rows: Input to stream.
+    :param lookup: Function row -> list of matching rows of the other input (usually an index probe).
+    :param scan_is_left: True if scan_rows is the left input of the join.
+    :param merge: Function (left row, right row) -> joined row.
+    :return: A generator over the joined rows.
+    """
+    for sr in scan_rows:
+        for pr in lookup(sr):
+            if scan_is_left:
+                yield merge(sr, pr)
+            else:
+                yield merge(pr, sr)
+
+
+def merge_join(left_sorted, right_sorted, key):
+    """
+    Joins two inputs sorted on the join key. Only the right rows of the current key are held in memory.
+
+    :param left_sorted: Left input, sorted by key.
+    :param right_sorted: Right input, sorted by key.
+    :param key: Function returning the join key of a row.
+    :return: A generator over the joined rows, in key order.
+    """
+    left_groups = itertools.groupby(left_sorted, key)
+    right_groups = itertools.groupby(right_sorted, key)
+
+    l_key, l_group = next(left_groups, (None, None))
+    r_key, r_group = next(right_groups, (None, None))
+    while l_group is not None and r_group is not None:
+        if l_key < r_key:
+            l_key, l_group = next(left_groups, (None, None))
+        elif l_key > r_key:
+            r_key, r_group = next(right_groups, (None, None))
+        else:
+            matches = list(r_group)
+            for lr in l_group:
+                for rr in matches:
+                    yield merge_rows(lr, rr)
+            l_key, l_group = next(left_groups, (None, None))
+            r_key, r_group = next(right_groups, (None, None))
+
+
+def _number(v, column_name):
+    """
+    :param v: A non NULL value of a SUM or AVG. Text values (e.g. of a text column) are parsed as numbers.
+    :param column_name: Column name, for the error message.
+    :return: The number, or None for a blank text value.
+    """
+    if type(v) is str:
+        v = CSVColumnStore.parse_number(v, column_name)
+    return v
+
+
+def _aggregate(function, column_name):
+    """
+    Builds the partial aggregate of an aggregate function. A partial aggregate of a group is updated with the
+    rows of the group, and partial aggregates of the same group (spilled by hash_aggregate) can be merged.
+    NULL (None) values are ignored, like in SQL; COUNT(*) counts the rows. Blank cells are already NULL in the
+    rows of a table (see CSVColumnStore.values_converter). Every aggregate but COUNT reads a text value that is
+    a number as the number, e.g. the HR values of a text column; MIN and MAX keep the other text values, and
+    order numbers before them.
+
+    :param function: One of "COUNT", "SUM", "MIN", "MAX", "AVG".
+    :param column_name: The aggregated column, or "*" for COUNT(*).
+    :return: Tuple of the functions new state, update(state, row) -> state, merge(state, state) -> state and
+        final(state) -> aggregate value.
+    """
+    c = column_name
+
+    def add(a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return a + b
+
+    if function == "COUNT" and c == "*":
+        return (lambda: 0, lambda s, r: s + 1, operator.add, lambda s: s)
+
+    if function == "COUNT":
+        return (lambda: 0, lambda s, r: s if r[c] is None else s + 1, operator.add, lambda s: s)
+
+    if function == "SUM":
+        def update(s, r):
+            v = r[c]
+            if v is None:
+                return s
+            if type(v) is str:
+                v = _number(v, c)
+                if v is None:
+                    return s
+            if s is None:
+                return v
+            return s + v
+        return (lambda: None, update, add, lambda s: s)
+
+    if function in ("MIN", "MAX"):
+        better = operator.lt if function == "MIN" else operator.gt
+
+        def pick(a, b):
+            if a is None:
+                return b
+            if b is None:
+                return a
+            try:
+                return b if better(b, a) else a
+            except TypeError:
+                # A number and a text value: numbers come first.
+                return b if better(type(b) is str, type(a) is str) else a
+
+        def update(s, r):
+            v = r[c]
+            if type(v) is str:
+                try:
+                    v = CSVColumnStore.parse_number(v, c)
+                except DataTableExceptions.DataTableException:
+                    pass
+            return pick(s, v)
+        return (lambda: None, update, pick, lambda s: s)
+
+    if function == "AVG":
+        def update(s, r):
+            v = r[c]
+            if v is not None:
+                if type(v) is str:
+                    v = _number(v, c)
+                    if v is None:
+                        return s
+                s[0] += v
+                s[1] += 1
+            return s
+
+        def final(s):
+            if s[1] == 0:
+                return None
+            return s[0] / s[1]
+        return (lambda: [0, 0], update, lambda a, b: [a[0] + b[0], a[1] + b[1]], final)
+
+    raise DataTableExceptions.DataTableException(
+        code=DataTableExceptions.DataTableException.invalid_argument,
+        message="Invalid aggregate function " + str(function))
+
+
+def hash_aggregate(rows, group_by, aggregates, max_groups=None):
+    """
+    GROUP BY with hash aggregation, in a single pass over the input. Every group holds one partial aggregate per
+    aggregate function, the rows are not kept. When more than max_groups groups are in memory, their partial
+    aggregates are sorted by group key and spilled to a temporary file (see CSVSort.spill_run); at the end the
+    spilled runs are merged and the partial aggregates of each group combined. At most max_spill_runs runs are
+    kept, more are merged into one run first.
+
+    :param rows: Input rows.
+    :param group_by: List of the group by columns, or [] for a single group over all rows.
+    :param aggregates: List of (function, column) or (function, column, output name), e.g.
+        [("SUM", "HR"), ("COUNT", "*"), ("AVG", "AB", "avg_ab")]. The default output name is "SUM(HR)".
+    :param max_groups: Maximum number of groups held in memory. Defaults to default_max_groups.
+    :return: A generator over the result rows: the group by columns and the aggregates. Groups come in the
+        order of their first row, or in group key order (NULLs first) if partial aggregates were spilled.
+    """
+    if max_groups is None:
+        max_groups = default_max_groups
+    if not isinstance(max_groups, int) or max_groups < 1:
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_argument,
+            message="Invalid max_groups = " + str(max_groups))
+
+    names = []
+    functions = []
+    for a in aggregates:
+        function, column_name = str(a[0]).upper(), a[1]
+        if column_name == "*" and function != "COUNT":
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_argument,
+                message="Invalid aggregate " + function + "(*)")
+        names.append(a[2] if len(a) > 2 else function + "(" + column_name + ")")
+        functions.append(_aggregate(function, column_name))
+    steps = [(i, f[1]) for i, f in enumerate(functions)]
+
+    # The usual single aggregate is updated without the loop over the aggregates.
+    single_update = functions[0][1] if len(functions) == 1 else None
+
+    group_by = list(group_by)
+    if not group_by:
+        key = lambda r: ()
+        key_values = lambda k: ()
+    elif len(group_by) == 1:
+        key = operator.itemgetter(group_by[0])
+        key_values = lambda k: (k,)
+    else:
+        key = operator.itemgetter(*group_by)
+        key_values = lambda k: k
+
+    def entry_order(entry):
+        return CSVIndex.order_key(key_values(entry[0]))
+
+    def result_row(k, states):
+        row = dict(zip(group_by, key_values(k)))
+        for name, f, s in zip(names, functions, states):
+            row[name] = f[3](s)
+        return row
+
+    def merge_runs(run_files):
+        """
+        :return: A generator over the (group key, partial aggregates) of the runs, combined per group, in key order.
+        """
+        merged = heapq.merge(*[CSVSort.read_run(f) for f in run_files], key=entry_order)
+        for k, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+            states = None
+            for entry_key, partial in entries:
+                if states is None:
+                    states = partial
+                else:
+                    states = [f[2](a, b) for f, a, b in zip(functions, states, partial)]
+            yield k, states
+
+    groups = {}
+    run_files = []
+    try:
+        for r in rows:
+            k = key(r)
+            states = groups.get(k)
+            if states is None:
+                if len(groups) >= max_groups:
+                    run_files.append(CSVSort.spill_run(sorted(groups.items(), key=entry_order)))
+                    groups = {}
+                    if len(run_files) >= max_spill_runs:
+                        merged = CSVSort.spill_run(merge_runs(run_files))
+                        for f in run_files:
+                            f.close()
+                        run_files = [merged]
+                states = [f[0]() for f in functions]
+                groups[k] = states
+            if single_update is not None:
+                states[0] = single_update(states[0], r)
+            else:
+                for i, update in steps:
+                    states[i] = update(states[i], r)
+
+        if not run_files:
+            if not groups and not group_by:
+                # An aggregate over no rows still returns one row, e.g. COUNT(*) = 0.
+                groups[()] = [f[0]() for f in functions]
+            for k, states in groups.items():
+                yield result_row(k, states)
+            return
+
+        if groups:
+            run_files.append(CSVSort.spill_run(sorted(groups.items(), key=entry_order)))
+            groups = {}
+
+        for k, states in merge_runs(run_files):
+            yield result_row(k, states)
+
+    finally:
+        for f in run_files:
+            f.close()
+
+
+class _Descending:
+    """
+    Wraps a sort key value so that it sorts in descending order, for ORDER BY on columns with mixed directions.
+
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _descending_value(v):
+    """
+    :param v: A column value.
+    :return: A value that sorts in the descending order of the values, NULL (None) last. Numbers are negated, other
+        values wrapped in _Descending.
+    """
+    if v is None:
+        return (1,)
+    if isinstance(v, (int, float)):
+        return (0, -v)
+    return (0, _Descending(v))
+
+
+def sort_key(order_fields):
+    """
+    Builds the sort key of an ORDER BY. NULLs (None) sort first in ascending order and last in descending order,
+    like the keys of an ORDERED index (see CSVIndex.order_key).
+
+    :param order_fields: List of (column, descending).
+    :return: The key function and the reverse flag to sort with.
+    """
+    columns = [c for c, descending in order_fields]
+    directions = [descending for c, descending in order_fields]
+
+    if len(set(directions)) == 1:
+        if len(columns) == 1:
+            c = columns[0]
+            return (lambda r: (0,) if r[c] is None else (1, r[c])), directions[0]
+        get_values = operator.itemgetter(*columns)
+        return (lambda r: CSVIndex.order_key(get_values(r))), directions[0]
+
+    def key(r):
+        return tuple([_descending_value(r[c]) if descending else ((0,) if r[c] is None else (1, r[c]))
+                      for c, descending in order_fields])
+    return key, False
+
+
+def order_by(rows, order_fields, limit=None, offset=None, run_size=None):
+    """
+    Sorts the rows. With a limit only the first offset + limit rows are kept, in a bounded heap (O(n log k) time
+    and O(k) memory). Otherwise the rows are sorted with an external merge sort, which spills sorted runs of
+    run_size rows to disk when the input is larger. Rows with equal sort keys keep their input order.
+
+    :param rows: Input rows.
+    :param order_fields: List of (column, descending).
+    :param limit: Maximum number of rows to return, or None for all rows.
+    :param offset: Number of rows to skip, or None.
+    :param run_size: Memory budget of the external sort, in rows (see CSVSort.external_sort).
+    :return: An iterator over the sorted rows.
+    """
+    offset = _check_limit(limit, offset)
+    key, reverse = sort_key(order_fields)
+    if limit is None:
+        return itertools.islice(CSVSort.external_sort(rows, key, run_size, reverse), offset, None)
+
+    if reverse:
+        top = heapq.nlargest(offset + limit, rows, key=key)
+    else:
+        top = heapq.nsmallest(offset + limit, rows, key=key)
+    return iter(top[offset:])
@@ -0,0 +1,383 @@
+import collections
+import concurrent.futures
+import csv
+import io
+import operator
+import os
+
+import DataTableExceptions
+import CSVColumnStore
+
+
+"""
+Parallel loading of a CSV file and parallel hash joins, with a pool of worker processes.
+
+For a load, the file is split on record boundaries, each chunk is parsed, projected and indexed in a worker
+process, and the parent process merges the chunks in file order.
+
+Record boundaries are found with the parity of the quote characters: a newline ends a record only if it is
+preceded by an even number of quotes, so newlines inside quoted values are never split. This assumes the file
+quotes values like csv.writer does (RFC 4180), i.e. quote characters only appear in quoted values.
+"""
+
+
+# Smallest part of a CSV file given to a worker. Smaller files are loaded serially.
+min_chunk_bytes = 1 << 20
+
+# Number of chunks per worker, so faster workers pick up more chunks and results are merged while others run.
+chunks_per_worker = 4
+
+# Number of chunks per worker that may be parsed ahead of the merge, which bounds the memory of a load.
+chunks_in_flight = 2
+
+# Bytes read at a time while counting quotes.
+read_block_bytes = 1 << 20
+
+# Number of hash partitions of a parallel join per worker.
+join_partitions_per_worker = 4
+
+
+def _count_quotes(f, start, end):
+    """
+    :param f: The file, opened in binary mode.
+    :param start: First byte.
+    :param end: Byte after the last one.
+    :return: The number of quote characters between start and end.
+    """
+    f.seek(start)
+    count = 0
+    remaining = end - start
+    while remaining > 0:
+        block = f.read(min(read_block_bytes, remaining))
+        if not block:
+            break
+        count += block.count(b'"')
+        remaining -= len(block)
+    return count
+
+
+def _next_record_end(f, pos, quotes, size):
+    """
+    Finds the end of the record that contains pos.
+
+    :param f: The file, opened in binary mode.
+    :param pos: A byte position.
+    :param quotes: The number of quote characters before pos.
+    :param size: Size of the file.
+    :return: The position after the newline that ends the record, and the number of quotes before it.
+    """
+    while pos < size:
+        f.seek(pos)
+        block = f.read(read_block_bytes)
+        if not block:
+            break
+        i = 0
+        while True:
+            nl = block.find(b"\n", i)
+            if nl == -1:
+                quotes += block.count(b'"', i)
+                break
+            quotes += block.count(b'"', i, nl)
+            if quotes % 2 == 0:
+                return pos + nl + 1, quotes
+            i = nl + 1
+        pos += len(block)
+    return size, quotes
+
+
+def split_file(file_name, parts):
+    """
+    Splits a CSV file into chunks of whole records.
+
+    :param file_name: Path of the CSV file.
+    :param parts: Number of chunks wanted. Fewer are returned for a small file (see min_chunk_bytes).
+    :return: The end of the header record, and a list of (start, end) byte ranges covering the data records.
+    """
+    size = os.path.getsize(file_name)
+    with open(file_name, "rb") as f:
+        header_end, quotes = _next_record_end(f, 0, 0, size)
+        parts = max(1, min(parts, (size - header_end) // min_chunk_bytes))
+
+        boundaries = [header_end]
+        pos = header_end
+        for i in range(1, parts):
+            target = header_end + (size - header_end) * i // parts
+            if target <= pos:
+                continue
+            quotes += _count_quotes(f, pos, target)
+            pos, quotes = _next_record_end(f, target, quotes, size)
+            if pos >= size:
+                break
+            boundaries.append(pos)
+        boundaries.append(size)
+
+    return header_end, [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)
+                        if boundaries[i] < boundaries[i + 1]]
+
+
+def read_header(file_name, header_end):
+    """
+    :param file_name: Path of the CSV file.
+    :param header_end: End of the header record (see split_file).
+    :return: List of the column names in the file.
+    """
+    with open(file_name, "rb") as f:
+        data = f.read(header_end)
+    reader = csv.reader(io.TextIOWrapper(io.BytesIO(data), newline=""), delimiter=",", quotechar='"')
+    return next(reader, [])
+
+
+def load_chunk(task):
+    """
+    Parses one chunk of a CSV file in a worker process.
+
+    Rows are returned as tuples of the projected values. The partial indexes map each key to the row ids
+    relative to the start of the chunk, in file order. Errors are returned instead of raised, because a
+    DataTableException does not survive the trip back to the parent process.
+
+    :param task: Tuple of the file name, the byte range, the header, the column names to load, the lists of
+        index columns and the column types the values are converted to (see CSVColumnStore.values_converter).
+    :return: A dictionary with the rows, the partial indexes and the distinct values of each column, or
+        with the error code and message.
+    """
+    file_name, start, end, header, column_names, index_columns, column_types = task
+
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    positions = {}
+    for i, name in enumerate(header):
+        positions[name] = i
+    if len(column_names) > 1:
+        get_values = operator.itemgetter(*[positions[c] for c in column_names])
+    else:
+        get_values = lambda rec: tuple([rec[positions[c]] for c in column_names])
+    width = len(header)
+    convert = CSVColumnStore.values_converter(column_names, column_types)
+
+    rows = []
+    reader = csv.reader(io.TextIOWrapper(io.BytesIO(data), newline=""), delimiter=",", quotechar='"')
+    try:
+        for rec in reader:
+            if not rec:
+                continue
+            if len(rec) < width:
+                rec = rec + [None] * (width - len(rec))
+            values = get_values(rec)
+            if convert is not None:
+                values = tuple(convert(values))
+            rows.append(values)
+    except DataTableExceptions.DataTableException as e:
+        return {"error": (e.code, e.message)}
+
+    indexes = []
+    for columns in index_columns:
+        get_key = operator.itemgetter(*[column_names.index(c) for c in columns])
+        entries = {}
+        for row_id, values in enumerate(rows):
+            key = get_key(values)
+            bucket = entries.get(key)
+            if bucket is None:
+                entries[key] = [row_id]
+            else:
+                bucket.append(row_id)
+        indexes.append(entries)
+
+    if rows:
+        column_values = [set(values) for values in zip(*rows)]
+    else:
+        column_values = [set() for c in column_names]
+
+    return {"rows": rows, "indexes": indexes, "column_values": column_values}
+
+
+def iter_chunks(file_name, column_names, index_columns, workers, column_types=()):
+    """
+    Loads a CSV file with a pool of worker processes.
+
+    :param file_name: Path of the CSV file.
+    :param column_names: Names of the columns to load, in the order of the table definition.
+    :param index_columns: List with the column names of each index to build.
+    :param workers: Number of worker processes.
+    :param column_types: List of (column name, column type, not_null) the values are converted to, see
+        CSVColumnStore.column_types.
+    :return: A generator over the loaded chunks (see load_chunk), in file order, or None if the file is too
+        small to be split or does not have all the columns; it must then be loaded serially.
+    """
+    try:
+        header_end, ranges = split_file(file_name, workers * chunks_per_worker)
+        header = read_header(file_name, header_end)
+    except OSError:
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_file,
+            message="Could not read file = " + file_name)
+
+    if len(ranges) < 2 or any(c not in header for c in column_names):
+        return None
+
+    tasks = [(file_name, start, end, header, list(column_names), [list(c) for c in index_columns],
+              list(column_types)) for start, end in ranges]
+    return _run(tasks, workers)
+
+
+def _run(tasks, workers):
+    """
+    Runs the chunk tasks in a process pool, with at most chunks_in_flight chunks per worker parsed ahead.
+
+    :param tasks: The tasks, see load_chunk.
+    :param workers: Number of worker processes.
+    :return: A generator over the loaded chunks, in task order.
+    """
+    tasks = iter(tasks)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(executor.submit(load_chunk, task))
+            if len(pending) >= workers * chunks_in_flight:
+                break
+
+        while pending:
+            chunk = pending.popleft().result()
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(executor.submit(load_chunk, task))
+
+            if "error" in chunk:
+                code, message = chunk["error"]
+                raise DataTableExceptions.DataTableException(code, message)
+            yield chunk
+
+
+
+def _tuple_getter(positions):
+    """
+    :param positions: List of positions in a tuple.
+    :return: A function returning the tuple of the values at these positions.
+    """
+    if len(positions) == 1:
+        p = positions[0]
+        return lambda t: (t[p],)
+    return operator.itemgetter(*positions)
+
+
+def join_columns(left_columns, right_columns):
+    """
+    :param left_columns: Columns of the left rows.
+    :param right_columns: Columns of the right rows.
+    :return: The columns of a joined row {**left, **right}, in order.
+    """
+    return list(left_columns) + [c for c in right_columns if c not in left_columns]
+
+
+def join_partition(task):
+    """
+    Hash joins one partition of both inputs in a worker process, builds on the smaller side, and applies the
+    where template and the projection.
+
+    Rows are tuples of values. The joined row is the concatenation of the left and the right tuple; a column
+    present in both inputs is read from the right one, like in a joined row {**left, **right}.
+
+    :param task: Tuple of the left columns and rows, the right columns and rows, the join fields, the where
+        template (or None) and the fields to return.
+    :return: List of the result rows, as tuples of the values of the fields.
+    """
+    left_columns, left_rows, right_columns, right_rows, on_fields, where_template, fields = task
+
+    width = len(left_columns)
+
+    def position(c):
+        if c in right_columns:
+            return width + right_columns.index(c)
+        return left_columns.index(c)
+
+    left_key = _tuple_getter([left_columns.index(c) for c in on_fields])
+    right_key = _tuple_getter([right_columns.index(c) for c in on_fields])
+    get_result = _tuple_getter([position(c) for c in fields])
+    get_where = None
+    if where_template:
+        get_where = _tuple_getter([position(c) for c in where_template.keys()])
+        where_values = tuple(where_template.values())
+
+    build_left = len(left_rows) <= len(right_rows)
+    if build_left:
+        build_rows, build_key, probe_rows, probe_key = left_rows, left_key, right_rows, right_key
+    else:
+        build_rows, build_key, probe_rows, probe_key = right_rows, right_key, left_rows, left_key
+
+    hash_table = {}
+    for br in build_rows:
+        k = build_key(br)
+        bucket = hash_table.get(k)
+        if bucket is None:
+            hash_table[k] = [br]
+        else:
+            bucket.append(br)
+
+    result = []
+    for pr in probe_rows:
+        matches = hash_table.get(probe_key(pr))
+        if matches is None:
+            continue
+        for br in matches:
+            if build_left:
+                joined = br + pr
+            else:
+                joined = pr + br
+            if get_where is None or get_where(joined) == where_values:
+                result.append(get_result(joined))
+    return result
+
+
+def partitioned_hash_join(left_rows, left_columns, right_rows, right_columns, on_fields, where_template,
+                          fields, workers):
+    """
+    Parallel hash join. Both inputs are hash partitioned on the on_fields, the pairs of partitions are joined
+    by a pool of worker processes (see join_partition) and the results are concatenated. Rows are sent to the
+    workers as tuples of values, which pickle much smaller than dictionaries.
+
+    :param left_rows: Iterator over the left rows (dictionaries).
+    :param left_columns: Columns of the left rows.
+    :param right_rows: Iterator over the right rows.
+    :param right_columns: Columns of the right rows.
+    :param on_fields: List of fields to join on, in both inputs.
+    :param where_template: Template applied to the joined rows, with columns of the inputs, or None.
+    :param fields: Fields to return, columns of the inputs.
+    :param workers: Number of worker processes.
+    :return: A generator over the result rows, grouped by partition.
+    """
+    n = workers * join_partitions_per_worker
+    left_parts = _partition(left_rows, left_columns, on_fields, n)
+    right_parts = _partition(right_rows, right_columns, on_fields, n)
+
+    tasks = []
+    for i in range(n):
+        if left_parts[i] and right_parts[i]:
+            tasks.append((list(left_columns), left_parts[i], list(right_columns), right_parts[i], list(on_fields),
+                          where_template, list(fields)))
+    del left_parts, right_parts
+
+    if not tasks:
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(join_partition, tasks):
+            for values in result:
+                yield dict(zip(fields, values))
+
+
+def _partition(rows, columns, on_fields, n):
+    """
+    :param rows: Iterator over row dictionaries.
+    :param columns: Columns of the rows.
+    :param on_fields: List of fields to partition on.
+    :param n: Number of partitions.
+    :return: List of n lists of row tuples. Rows with equal on_fields values are in the same partition.
+    """
+    get_values = operator.itemgetter(*columns) if len(columns) > 1 else lambda r: (r[columns[0]],)
+    get_key = _tuple_getter([list(columns).index(c) for c in on_fields])
+    parts = [[] for i in range(n)]
+    for r in rows:
+        values = get_values(r)
+        parts[hash(get_key(values)) % n].append(values)
+    return parts
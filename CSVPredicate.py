@@ -0,0 +1,459 @@
+import operator
+import re
+
+import DataTableExceptions
+import CSVStatistics
+
+try:
+    import numpy
+except ImportError:
+    # Masks (vectorized evaluation on a columnar table) are only available with NumPy installed.
+    numpy = None
+
+
+"""
+Predicate expressions for the selects of a CSVTable (see CSVTable.__find_by_predicate__), e.g.
+
+    and_(eq("teamID", "BOS"), between("yearID", 1990, 2000), or_(gt("HR", 40), like("playerID", "ortiz%")))
+
+A predicate is compiled once per query, into a function that tests a row dictionary, or into a NumPy boolean
+mask over the columns of a CSVColumnStore.ColumnStore. The planner hands the conjuncts an index can answer
+(equalities, IN lists and ranges on an ORDERED index) to the index and evaluates the others as a residual filter.
+
+Comparisons use two-valued logic. "=", "!=" and IN compare like templates do, so NULL (None) equals NULL.
+The range comparisons and LIKE are false for NULL.
+"""
+
+
+# Comparison operators -> functions.
+comparison_operators = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+# Operators whose conjuncts an ORDERED index can answer with a range lookup.
+range_operators = ("<", "<=", ">", ">=")
+
+
+def _invalid(message):
+    """
+    :param message: Error message.
+    :return: Nothing, raises a DataTableException.
+    """
+    raise DataTableExceptions.DataTableException(
+        code=DataTableExceptions.DataTableException.invalid_argument,
+        message=message)
+
+
+class Predicate:
+    """
+    Base class of the predicate expressions.
+
+    """
+
+    def compile(self):
+        """
+        :return: A function row -> bool.
+        """
+        raise NotImplementedError()
+
+    def mask(self, store, start=0, stop=None):
+        """
+        :param store: A CSVColumnStore.ColumnStore.
+        :param start: First row id to test.
+        :param stop: Row id after the last one to test, or None for the end of the store.
+        :return: NumPy boolean array, True for the rows for which the predicate is true.
+        """
+        raise NotImplementedError()
+
+    def columns(self):
+        """
+        :return: Set of the column names the predicate references.
+        """
+        raise NotImplementedError()
+
+    def coerce(self, coerce_template):
+        """
+        :param coerce_template: Function template -> template with typed values, e.g.
+            CSVTable.__coerce_template__.
+        :return: The predicate with its values converted to the types of the columns.
+        """
+        raise NotImplementedError()
+
+    def selectivity(self, column_selectivity):
+        """
+        :param column_selectivity: Function returning the selectivity of an equality on a column.
+        :return: Estimated fraction of the rows for which the predicate is true.
+        """
+        raise NotImplementedError()
+
+    def conjuncts(self):
+        """
+        :return: List of the predicates ANDed together at the top of this one.
+        """
+        return [self]
+
+
+class Comparison(Predicate):
+    """
+    column <op> value, with op one of comparison_operators.
+
+    """
+
+    def __init__(self, column_name, op, value):
+        if op not in comparison_operators:
+            _invalid("Invalid comparison operator " + str(op))
+        self.column_name = column_name
+        self.op = op
+        self.value = value
+
+    def __str__(self):
+        return self.column_name + " " + self.op + " " + repr(self.value)
+
+    def compile(self):
+        c = self.column_name
+        v = self.value
+        if self.op == "=":
+            return lambda r: r[c] == v
+        if self.op == "!=":
+            return lambda r: r[c] != v
+        if v is None:
+            return lambda r: False
+
+        compare = comparison_operators[self.op]
+
+        def test(r):
+            x = r[c]
+            return x is not None and compare(x, v)
+        return test
+
+    def mask(self, store, start=0, stop=None):
+        column = store.columns[self.column_name]
+        if self.op == "=":
+            return column.mask(self.value, start, stop)
+        if self.op == "!=":
+            return ~column.mask(self.value, start, stop)
+        return column.compare_mask(comparison_operators[self.op], self.value, start, stop)
+
+    def columns(self):
+        return {self.column_name}
+
+    def coerce(self, coerce_template):
+        t = coerce_template({self.column_name: self.value})
+        return Comparison(self.column_name, self.op, t[self.column_name])
+
+    def selectivity(self, column_selectivity):
+        if self.op == "=":
+            return column_selectivity(self.column_name)
+        if self.op == "!=":
+            return 1 - column_selectivity(self.column_name)
+        return CSVStatistics.range_selectivity
+
+
+class In(Predicate):
+    """
+    column IN (value_1, ..., value_n).
+
+    """
+
+    def __init__(self, column_name, values):
+        self.column_name = column_name
+        self.values = list(values)
+
+    def __str__(self):
+        return self.column_name + " IN (" + ", ".join([repr(v) for v in self.values]) + ")"
+
+    def compile(self):
+        c = self.column_name
+        values = frozenset(self.values)
+        return lambda r: r[c] in values
+
+    def mask(self, store, start=0, stop=None):
+        return store.columns[self.column_name].in_mask(self.values, start, stop)
+
+    def columns(self):
+        return {self.column_name}
+
+    def coerce(self, coerce_template):
+        return In(self.column_name, [coerce_template({self.column_name: v})[self.column_name] for v in self.values])
+
+    def selectivity(self, column_selectivity):
+        return min(1, len(set(self.values)) * column_selectivity(self.column_name))
+
+
+class Like(Predicate):
+    """
+    column LIKE pattern, where % matches any sequence of characters and _ any single character.
+
+    """
+
+    def __init__(self, column_name, pattern):
+        self.column_name = column_name
+        self.pattern = pattern
+
+    def __str__(self):
+        return self.column_name + " LIKE " + repr(self.pattern)
+
+    def __get_test__(self):
+        """
+        :return: Function str -> bool. A pattern without wildcards or with a single trailing % is tested without
+            a regular expression.
+        """
+        pattern = self.pattern
+        if "_" not in pattern:
+            if "%" not in pattern:
+                return lambda s: s == pattern
+            if pattern.index("%") == len(pattern) - 1:
+                prefix = pattern[:-1]
+                return lambda s: s.startswith(prefix)
+
+        regex = "".join([".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern])
+        match = re.compile(regex, re.DOTALL).fullmatch
+        return lambda s: match(s) is not None
+
+    def compile(self):
+        c = self.column_name
+        test = self.__get_test__()
+
+        def like(r):
+            x = r[c]
+            return isinstance(x, str) and test(x)
+        return like
+
+    def mask(self, store, start=0, stop=None):
+        test = self.__get_test__()
+        return store.columns[self.column_name].values_mask(lambda x: isinstance(x, str) and test(x), start, stop)
+
+    def columns(self):
+        return {self.column_name}
+
+    def coerce(self, coerce_template):
+        return self
+
+    def selectivity(self, column_selectivity):
+        return CSVStatistics.range_selectivity
+
+
+class And(Predicate):
+    """
+    predicate_1 AND ... AND predicate_n.
+
+    """
+
+    def __init__(self, predicates):
+        self.predicates = list(predicates)
+
+    def __str__(self):
+        return "(" + " AND ".join([str(p) for p in self.predicates]) + ")"
+
+    def compile(self):
+        # Equalities are tested together with one itemgetter, like a template (see CSVOperators.template_predicate).
+        template = {}
+        others = []
+        for p in self.predicates:
+            if isinstance(p, Comparison) and p.op == "=" and p.column_name not in template:
+                template[p.column_name] = p.value
+            else:
+                others.append(p)
+
+        tests = [p.compile() for p in others]
+        if template:
+            names = list(template.keys())
+            getter = operator.itemgetter(*names)
+            if len(names) == 1:
+                value = template[names[0]]
+            else:
+                value = tuple([template[n] for n in names])
+            tests.insert(0, lambda r: getter(r) == value)
+
+        if not tests:
+            return lambda r: True
+        if len(tests) == 1:
+            return tests[0]
+        if len(tests) == 2:
+            first, second = tests
+            return lambda r: first(r) and second(r)
+
+        def test(r):
+            for t in tests:
+                if not t(r):
+                    return False
+            return True
+        return test
+
+    def mask(self, store, start=0, stop=None):
+        if stop is None:
+            stop = len(store)
+        result = numpy.ones(stop - start, dtype=bool)
+        for p in self.predicates:
+            result &= p.mask(store, start, stop)
+        return result
+
+    def columns(self):
+        result = set()
+        for p in self.predicates:
+            result |= p.columns()
+        return result
+
+    def coerce(self, coerce_template):
+        return And([p.coerce(coerce_template) for p in self.predicates])
+
+    def selectivity(self, column_selectivity):
+        result = 1
+        for p in self.predicates:
+            result *= p.selectivity(column_selectivity)
+        return result
+
+    def conjuncts(self):
+        result = []
+        for p in self.predicates:
+            result.extend(p.conjuncts())
+        return result
+
+
+class Or(Predicate):
+    """
+    predicate_1 OR ... OR predicate_n.
+
+    """
+
+    def __init__(self, predicates):
+        self.predicates = list(predicates)
+
+    def __str__(self):
+        return "(" + " OR ".join([str(p) for p in self.predicates]) + ")"
+
+    def compile(self):
+        tests = [p.compile() for p in self.predicates]
+        if len(tests) == 2:
+            first, second = tests
+            return lambda r: first(r) or second(r)
+
+        def test(r):
+            for t in tests:
+                if t(r):
+                    return True
+            return False
+        return test
+
+    def mask(self, store, start=0, stop=None):
+        if stop is None:
+            stop = len(store)
+        result = numpy.zeros(stop - start, dtype=bool)
+        for p in self.predicates:
+            result |= p.mask(store, start, stop)
+        return result
+
+    def columns(self):
+        result = set()
+        for p in self.predicates:
+            result |= p.columns()
+        return result
+
+    def coerce(self, coerce_template):
+        return Or([p.coerce(coerce_template) for p in self.predicates])
+
+    def selectivity(self, column_selectivity):
+        result = 0
+        for p in self.predicates:
+            s = p.selectivity(column_selectivity)
+            result = result + s - result * s
+        return result
+
+
+class Not(Predicate):
+    """
+    NOT predicate.
+
+    """
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def __str__(self):
+        return "NOT " + str(self.predicate)
+
+    def compile(self):
+        test = self.predicate.compile()
+        return lambda r: not test(r)
+
+    def mask(self, store, start=0, stop=None):
+        return ~self.predicate.mask(store, start, stop)
+
+    def columns(self):
+        return self.predicate.columns()
+
+    def coerce(self, coerce_template):
+        return Not(self.predicate.coerce(coerce_template))
+
+    def selectivity(self, column_selectivity):
+        return 1 - self.predicate.selectivity(column_selectivity)
+
+
+def eq(column_name, value):
+    return Comparison(column_name, "=", value)
+
+
+def ne(column_name, value):
+    return Comparison(column_name, "!=", value)
+
+
+def lt(column_name, value):
+    return Comparison(column_name, "<", value)
+
+
+def le(column_name, value):
+    return Comparison(column_name, "<=", value)
+
+
+def gt(column_name, value):
+    return Comparison(column_name, ">", value)
+
+
+def ge(column_name, value):
+    return Comparison(column_name, ">=", value)
+
+
+def between(column_name, low, high):
+    """
+    :return: low <= column <= high.
+    """
+    return And([ge(column_name, low), le(column_name, high)])
+
+
+def is_in(column_name, values):
+    return In(column_name, values)
+
+
+def like(column_name, pattern):
+    return Like(column_name, pattern)
+
+
+def is_null(column_name):
+    return Comparison(column_name, "=", None)
+
+
+def and_(*predicates):
+    return And(predicates)
+
+
+def or_(*predicates):
+    return Or(predicates)
+
+
+def not_(predicate):
+    return Not(predicate)
+
+
+def from_template(t):
+    """
+    :param t: An equality template (or None).
+    :return: The predicate equivalent to the template.
+    """
+    if not t:
+        return And([])
+    return And([eq(k, v) for k, v in t.items()])
@@ -0,0 +1,97 @@
+import heapq
+import itertools
+import pickle
+import tempfile
+
+import DataTableExceptions
+
+
+# Default memory budget for an external sort, as the number of rows held in memory per sorted run.
+default_run_size = 100000
+
+# Number of rows written to a run file with a single pickle call.
+spill_batch_size = 1000
+
+
+def spill_run(run):
+    """
+    Writes a sorted run to an anonymous temporary file (also used by CSVOperators.hash_aggregate).
+
+    :param run: A sorted list (or iterable) of rows.
+    :return: The temporary file, positioned at the start.
+    """
+    try:
+        f = tempfile.TemporaryFile()
+        rows = iter(run)
+        while True:
+            batch = list(itertools.islice(rows, spill_batch_size))
+            if not batch:
+                break
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+        f.seek(0)
+        return f
+    except OSError as e:
+        raise DataTableExceptions.DataTableException(
+            code=DataTableExceptions.DataTableException.invalid_file,
+            message="Could not write sort run to a temporary file",
+            ex=e)
+
+
+def read_run(f):
+    """
+    Reads back the rows of a run written by spill_run.
+
+    :param f: The run file.
+    :return: A generator over the rows of the run, in sorted order.
+    """
+    while True:
+        try:
+            batch = pickle.load(f)
+        except EOFError:
+            return
+        for r in batch:
+            yield r
+
+
+def external_sort(rows, key, run_size=None, reverse=False):
+    """
+    Sorts rows that may not fit in memory.
+
+    Rows are collected into runs of at most run_size rows. Each run is sorted and spilled to a temporary file,
+    then the runs are streamed back through a k-way merge. If the input fits in a single run nothing is written
+    to disk.
+
+    :param rows: An iterable of rows.
+    :param key: Function returning the sort key of a row.
+    :param run_size: Maximum number of rows held in memory. Defaults to default_run_size.
+    :param reverse: Sort in descending order. Rows with equal keys keep their input order either way.
+    :return: A generator over the rows in sorted order.
+    """
+    if run_size is None:
+        run_size = default_run_size
+
+    run_files = []
+    run = []
+    try:
+        for r in rows:
+            run.append(r)
+            if len(run) >= run_size:
+                run.sort(key=key, reverse=reverse)
+                run_files.append(spill_run(run))
+                run = []
+
+        run.sort(key=key, reverse=reverse)
+        if not run_files:
+            # Everything fit in memory.
+            yield from run
+            return
+
+        if run:
+            run_files.append(spill_run(run))
+            run = []
+
+        yield from heapq.merge(*[read_run(f) for f in run_files], key=key, reverse=reverse)
+
+    finally:
+        for f in run_files:
+            f.close()
@@ -0,0 +1,203 @@
+import json
+import math
+
+
+# Selectivity assumed for an equality predicate on a column without statistics (e.g. of a derived table).
+default_selectivity = 0.1
+
+# Average size of a CSV row in bytes, used to estimate the row count of a table that is not loaded.
+default_row_bytes = 100
+
+# Cost of one index probe, in rows read by a scan. A probe builds the key from the template and looks it up, about
+# ten times the work of testing a scanned row.
+index_probe_cost = 10
+
+# Fraction of the rows assumed to match a range comparison or a LIKE pattern, which have no statistics.
+range_selectivity = 1 / 3
+
+
+class TableStatistics:
+    """
+    Statistics of a CSVTable, collected while the rows are loaded: the row count and the number of distinct
+    values (cardinality) of every column. Index statistics (distinct keys, rows per key) are kept by the
+    index structures themselves.
+
+    """
+
+    def __init__(self, column_names):
+        """
+        :param column_names: Names of the columns to collect statistics for.
+        """
+        self.row_count = 0
+        self.column_names = list(column_names)
+
+        # Distinct values per column while rows are being added, released by finish().
+        self.__values__ = {c: set() for c in self.column_names}
+
+        # column name -> number of distinct values
+        self.column_cardinality = {c: 0 for c in self.column_names}
+
+    def __str__(self):
+        return json.dumps(self.to_json(), indent=2)
+
+    def to_json(self):
+        result = {
+            "row_count": self.row_count,
+            "column_cardinality": self.column_cardinality
+        }
+        return result
+
+    @staticmethod
+    def from_json(j):
+        """
+        Re-creates statistics saved with to_json().
+
+        :param j: The JSON object.
+        :return: A TableStatistics.
+        """
+        result = TableStatistics(j["column_cardinality"].keys())
+        result.row_count = j["row_count"]
+        result.column_cardinality = dict(j["column_cardinality"])
+        result.__values__ = None
+        return result
+
+    def add_row(self, row):
+        """
+        Adds a loaded row to the statistics.
+
+        :param row: The row dictionary.
+        :return: Nothing
+        """
+        self.row_count += 1
+        for c, values in self.__values__.items():
+            values.add(row[c])
+
+    def add_values(self, row_count, column_values):
+        """
+        Adds the statistics of rows loaded elsewhere, e.g. a chunk loaded by a CSVParallel worker.
+
+        :param row_count: Number of rows.
+        :param column_values: Dictionary column name -> set of the distinct values of the rows.
+        :return: Nothing
+        """
+        self.row_count += row_count
+        for c, values in column_values.items():
+            self.__values__[c].update(values)
+
+    def finish(self):
+        """
+        Computes the column cardinalities once all rows were added and releases the distinct value sets.
+
+        :return: Nothing
+        """
+        if self.__values__ is None:
+            return
+        for c, values in self.__values__.items():
+            self.column_cardinality[c] = len(values)
+        self.__values__ = None
+
+    def selectivity(self, column_name):
+        """
+        Fraction of the rows expected to match an equality predicate on a column.
+
+        :param column_name: Name of the column.
+        :return: 1 / cardinality, or default_selectivity if the column has no statistics.
+        """
+        cardinality = self.column_cardinality.get(column_name)
+        if not cardinality:
+            return default_selectivity
+        return 1 / cardinality
+
+    def estimate_rows(self, template):
+        """
+        Estimates the number of rows matching an equality template, assuming independent columns.
+
+        :param template: The template (or None).
+        :return: Estimated number of rows.
+        """
+        return estimate_rows(self.row_count, template, self.selectivity)
+
+
+def estimate_rows(row_count, template, selectivity=None):
+    """
+    Estimates the number of rows matching an equality template, assuming independent columns.
+
+    :param row_count: Number of input rows.
+    :param template: The template (or None).
+    :param selectivity: Function returning the selectivity of a column. Defaults to default_selectivity.
+    :return: Estimated number of rows.
+    """
+    result = row_count
+    if template:
+        for c in template.keys():
+            if selectivity is None:
+                result *= default_selectivity
+            else:
+                result *= selectivity(c)
+    return result
+
+
+def scan_cost(row_count):
+    """
+    :param row_count: Rows in the table.
+    :return: Cost of a full table scan.
+    """
+    return row_count
+
+
+def index_lookup_cost(matching_rows, probes=1):
+    """
+    :param matching_rows: Rows returned by the index.
+    :param probes: Number of keys looked up, e.g. the values of an IN list.
+    :return: Cost of an index lookup, the probes plus the rows they return.
+    """
+    return probes * index_probe_cost + matching_rows
+
+
+def index_nested_loop_cost(scan_rows, rows_per_probe):
+    """
+    :param scan_rows: Rows read from the scanned input.
+    :param rows_per_probe: Rows returned by each probe of the index on the other input.
+    :return: Cost of an index nested loop join.
+    """
+    return scan_rows * index_lookup_cost(rows_per_probe)
+
+
+def hash_join_cost(left_rows, right_rows):
+    """
+    :param left_rows: Rows of the left input.
+    :param right_rows: Rows of the right input.
+    :return: Cost of a hash join, reading both inputs plus building the table on the smaller one.
+    """
+    return left_rows + right_rows + min(left_rows, right_rows)
+
+
+def sort_merge_join_cost(left_rows, right_rows):
+    """
+    :param left_rows: Rows of the left input.
+    :param right_rows: Rows of the right input.
+    :return: Cost of a sort-merge join, sorting both inputs and merging them.
+    """
+    return sort_cost(left_rows) + sort_cost(right_rows) + left_rows + right_rows
+
+
+def sort_cost(row_count):
+    """
+    :param row_count: Rows to sort.
+    :return: Cost of sorting the rows.
+    """
+    if row_count < 2:
+        return row_count
+    return row_count * math.log2(row_count)
+
+
+def top_k_cost(row_count, k):
+    """
+    :param row_count: Rows to sort.
+    :param k: Number of rows to keep.
+    :return: Cost of keeping the first k rows in a bounded heap.
+    """
+    k = min(row_count, k)
+    if k < 2:
+        return row_count
+    return row_count * math.log2(k)
@@ -1,48 +1,103 @@
 import csv
+import itertools
+import operator
+import os
 import tabulate
+import threading
 
 import DataTableExceptions
 import CSVCatalog
+import CSVColumnStore
+import CSVIndex
+import CSVOperators
+import CSVParallel
+import CSVPredicate
+import CSVSort
+import CSVStatistics
 
 
 
 
 max_rows_to_print = 10
 
+# Number of rows read from a CSV file at a time.
+default_chunk_size = 10000
+
+# Version of the values a table holds, part of the signature of its index and cache files. Files written with
+# other values (e.g. strings for number columns, or empty strings for blank text cells) are rebuilt.
+value_format = 3
+
 
 class CSVTable:
     __catalog__ = CSVCatalog.CSVCatalog()
 
-    def __init__(self, t_name, load=True):
+    def __init__(self, t_name, load=True, lazy=False, columnar=False, index_files=True, cache=True,
+                 chunk_size=None, background_indexes=False, workers=None):
         """
         Constructor.
 
         :param t_name: Name for table.
         :param load: Load data from a CSV file. If load=False, this is a derived table and engine will
             add rows instead of loading from file.
+        :param lazy: Only load the metadata. Rows are not held in memory and are streamed from the CSV file,
+            chunk_size rows at a time, whenever the table is scanned, so the file may be larger than memory.
+            The first select that can use an index loads the rows and builds the indexes (see build_indexes).
+        :param columnar: Hold the rows in a CSVColumnStore.ColumnStore, one typed array per column, instead of a
+            list of dictionaries. Rows are materialised when they are read. Values of number columns are ints
+            or floats (None for an empty value), and template values for them are converted once per query.
+        :param index_files: Save the indexes to files next to the CSV file (see CSVIndex.save_index), and open
+            them on the next load instead of rebuilding them: the row ids are memory-mapped, the keys are read
+            from the file (see CSVIndex.load_index). A file is only used if the CSV file (size and modification
+            time) and the table definition are unchanged.
+        :param cache: For a columnar table, save the loaded columns to a binary cache file next to the CSV file
+            (see CSVColumnStore.save_store) and memory-map it on the next load instead of parsing the CSV file.
+            The CSV file stays the source of truth: the cache is rebuilt when it or the table definition changes.
+        :param chunk_size: Number of rows read from the CSV file at a time. Defaults to default_chunk_size.
+        :param background_indexes: For a lazy table, build the indexes in a background thread when a select
+            first needs one, instead of making that select wait. Selects scan the file until the build finished.
+        :param workers: Load the CSV file with this many worker processes (see CSVParallel). The rows, indexes
+            and statistics are the same as with the serial load. Files smaller than two chunks of
+            CSVParallel.min_chunk_bytes are always loaded serially.
         """
 
         self.__table_name__ = t_name
 
         # Holds loaded metadata from the catalog.
         self.__description__ = None
+        self.__rows__ = None
+
+        # Row count and column cardinalities, collected when the rows are loaded.
+        self.__statistics__ = None
+        self.__columnar__ = columnar
+        self.__index_files__ = index_files
+        self.__cache__ = cache
+        self.__chunk_size__ = chunk_size or default_chunk_size
+        self.__background_indexes__ = background_indexes
+        self.__workers__ = workers
+
+        # Guards the loading of a lazy table's rows and indexes, see __ensure_loaded__.
+        self.__load_lock__ = threading.Lock()
+        self.__load_thread__ = None
         if load:
             self.__load_info__()  # Load metadata, stored in self.__description__
-            self.__rows__ = []
-            self.__load__()  # Load rows from the CSV file.
+            if lazy:
+                self.__indexes__ = {}
+            else:
+                self.__rows__ = []
+                self.__load__()  # Load rows from the CSV file.
 
         else:
             self.__file_name__ = "DERIVED"
 
     def __load_info__(self):
         """
-        Loads metadata from catalog and sets __description__ to hold the information.
+        Loads metadata from catalog and sets __description__ to hold the information. The shared catalog caches
+        the table definitions (see CSVCatalog.definition_cache), so opening a table again does not query it.
 
         :return:Nothing
         """
 
-        cat = CSVCatalog.CSVCatalog()
-        t = cat.get_table(self.__table_name__)  # class TableDefinition
+        t = CSVTable.__catalog__.get_table(self.__table_name__)  # class TableDefinition
         self.__description__ = t
 
     def __get_file_name__(self):
@@ -61,76 +116,297 @@ class CSVTable:
         :param row: The row to be added
         :return: Returns nothing
         """
-        self.__rows__.append(row)
-        defined_indexes = self.__description__.indexes
-
-        for index in defined_indexes:
+        if self.__columnar__:
+            row = self.__rows__.convert_row(row)
 
-            name = index.index_name
-
-            key_string = self.__get_key__(index, row)  # returns a string of the key that is the concatentated version for the index
+        row_id = len(self.__rows__)
+        self.__rows__.append(row)
+        self.__statistics__.add_row(row)
 
-            if key_string in self.__keys_added__:  # if key index already exists, row must be added to the list of rows
-                self.__indexes__[name][key_string].append(row)
-            else:
-                self.__indexes__[name][key_string] = []
-                self.__indexes__[name][key_string].append(row)
-                self.__keys_added__.append(key_string)
+        for index in self.__indexes__.values():
+            index.add(index.get_key(row), row_id)
         return
 
     def __get_key__(self, index, row):
         """
-        Gets the key (a string) for the row based off the index columns.
+        Gets the key for the row based off the index columns: the column value for a single column index, and
+        the tuple of column values for a composite index. Unlike a joined string the key cannot be ambiguous,
+        e.g. ("a_b", "c") and ("a", "b_c") are different keys.
 
-        :param index: the index that we are creating the key for
+        :param index: the index that we are creating the key for (a CSVIndex.HashIndex)
         :param row: the row we are creating the key with, will also work for a template because a template is
                 essentially a shortened row
-        :return: a string which is the key of that row
+        :return: the key of that row
         """
-
-        key = []
-        column_names = index.column_names
-        for i in range(len(column_names)):
-            key.append(row[column_names[i]])
-
-        kstring = "_".join(key)
-        return kstring
+        return index.get_key(row)
 
     def __load__(self):
         """
         Load rows from a file into a CSVTable object.
         Update indexes.
 
+        A columnar table is loaded from its column cache file instead if the cache is up to date.
+
         :return: Nothing
         """
         self.__indexes__ = {}  # initialized indexes dictionary
         given_indexes = self.__description__.indexes
-        self.__keys_added__ = []
+
+        signature = None
+        if self.__index_files__ or (self.__columnar__ and self.__cache__):
+            signature = self.__get_file_signature__()
+
+        # Indexes with a valid index file are opened from it (row ids memory-mapped), the others are built while
+        # the rows are added.
+        saved_indexes = {}
         for index in given_indexes:
-            self.__indexes__[index.index_name] = {}  # creates a dictionary for all the index:row values to go in
+            if signature is not None and self.__index_files__:
+                fn = CSVIndex.index_file_name(self.__get_file_name__(), index.index_name)
+                saved = CSVIndex.load_index(index, fn, signature)
+                if saved is not None:
+                    saved_indexes[index.index_name] = saved
+                    continue
+            self.__indexes__[index.index_name] = CSVIndex.create_index(index)  # holds the key:row ids entries
+
+        store = None
+        if self.__columnar__ and self.__cache__ and signature is not None:
+            cache_fn = CSVColumnStore.cache_file_name(self.__get_file_name__())
+            store, statistics = CSVColumnStore.load_store(self.__description__.columns, cache_fn, signature)
+
+        if store is not None:
+            self.__rows__ = store
+            self.__statistics__ = CSVStatistics.TableStatistics.from_json(statistics)
+            self.__build_indexes__()
+
+        else:
+            if self.__columnar__:
+                self.__rows__ = CSVColumnStore.ColumnStore(self.__description__.columns)
+
+            self.__statistics__ = CSVStatistics.TableStatistics(self.__get_column_names__())
+            if not self.__load_parallel__():
+                for r in self.__iter_file_rows__():
+                    self.__add_row__(r)
+            self.__statistics__.finish()
+
+            if self.__columnar__ and self.__cache__ and signature is not None:
+                CSVColumnStore.save_store(self.__rows__, CSVColumnStore.cache_file_name(self.__get_file_name__()),
+                                          signature, self.__statistics__.to_json())
+
+        if signature is not None and self.__index_files__:
+            for index in self.__indexes__.values():
+                fn = CSVIndex.index_file_name(self.__get_file_name__(), index.index_name)
+                CSVIndex.save_index(index, fn, signature)
+        self.__indexes__.update(saved_indexes)
+
+    def __load_parallel__(self):
+        """
+        Loads the rows of the CSV file with a pool of worker processes, if the table has more than one worker.
+        The chunks are merged in file order: the rows are appended, the partial indexes added with the row id
+        of the chunk's first row as offset, and the distinct values added to the statistics.
+
+        :return: True if the rows were loaded, False if they must be loaded serially.
+        """
+        if not self.__workers__ or self.__workers__ < 2:
+            return False
+
+        column_names = self.__get_column_names__()
+        indexes = list(self.__indexes__.values())
+        column_types = CSVColumnStore.column_types(self.__description__.columns)
+
+        chunks = CSVParallel.iter_chunks(self.__get_file_name__(), column_names,
+                                         [index.column_names for index in indexes], self.__workers__, column_types)
+        if chunks is None:
+            return False
+
+        for chunk in chunks:
+            offset = len(self.__rows__)
+            for values in chunk["rows"]:
+                self.__rows__.append(dict(zip(column_names, values)))
+            for index, entries in zip(indexes, chunk["indexes"]):
+                index.add_entries(entries, offset)
+            self.__statistics__.add_values(len(chunk["rows"]), dict(zip(column_names, chunk["column_values"])))
+        return True
+
+    def __build_indexes__(self):
+        """
+        Adds every row of the table to the indexes in self.__indexes__.
+
+        :return: Nothing
+        """
+        indexes = list(self.__indexes__.values())
+        if not indexes:
+            return
+        for row_id, row in enumerate(self.__rows__):
+            for index in indexes:
+                index.add(index.get_key(row), row_id)
+
+    def __get_file_signature__(self):
+        """
+        Identifies the CSV file and the table definition an index or cache file was built from. A file with
+        another signature is out of date.
+
+        :return: A tuple, or None if the CSV file cannot be read.
+        """
+        try:
+            st = os.stat(self.__get_file_name__())
+        except OSError:
+            return None
+
+        columns = []
+        for c in self.__description__.columns:
+            columns.append((c.column_name, c.column_type, c.not_null))
+        return st.st_size, st.st_mtime_ns, tuple(columns), self.__columnar__, value_format
+
+    def __iter_file_rows__(self):
+        """
+        Streams the rows of the CSV file, projected on the columns defined for this table.
+
+        :return: A generator over the row dictionaries in file order.
+        """
+        for chunk in self.__iter_file_chunks__():
+            yield from chunk
+
+    def __iter_file_chunks__(self, chunk_size=None):
+        """
+        Reads the CSV file in chunks, with the rows projected on the columns defined for this table. Only one
+        chunk is held in memory at a time. Rows are parsed like csv.DictReader does: blank lines are skipped
+        and missing trailing values are None. Values are converted to the types of their columns as they are
+        read (see CSVColumnStore.values_converter): number columns hold ints or floats, a blank cell is NULL
+        (None) in every column, and a NULL in a not_null column raises a DataTableException.
+
+        :param chunk_size: Number of rows per chunk. Defaults to the chunk size of the table.
+        :return: A generator over lists of row dictionaries, in file order.
+        """
+        if chunk_size is None:
+            chunk_size = self.__chunk_size__
 
         try:
             fn = self.__get_file_name__()
-            with open(fn, "r") as csvfile:
+            with open(fn, "r", newline="") as csvfile:
 
-                reader = csv.DictReader(csvfile, delimiter=",", quotechar='"')
+                reader = csv.reader(csvfile, delimiter=",", quotechar='"')
+                header = next(reader, None)
+                if header is None:
+                    return
 
                 # Get the names of the columns defined for this table from the metadata.
+                # Only these columns are added to the in-memory table, the CSV file may contain columns that are
+                # not relevant to the definition.
                 column_names = self.__get_column_names__()
-
-                # Loop through each line (each dictionary to be precise) in the input file.
-                for r in reader:
-                    # Only add the defined columns into the in-memory table.
-                    # The CSV file may contain columns that are not relevant to the definition.
-                    projected_r = self.project([r], column_names)[0]
-
-                    self.__add_row__(projected_r)
+                positions = {}
+                for i, name in enumerate(header):
+                    positions[name] = i
+                missing = [c for c in column_names if c not in positions]
+                if len(column_names) > 1 and not missing:
+                    get_values = operator.itemgetter(*[positions[c] for c in column_names])
+                else:
+                    get_values = lambda rec: [rec[positions[c]] for c in column_names]
+                width = len(header)
+                convert = CSVColumnStore.values_converter(
+                    column_names, CSVColumnStore.column_types(self.__description__.columns))
+
+                chunk = []
+                for rec in reader:
+                    if not rec:
+                        continue
+                    if missing:
+                        raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+                    if len(rec) < width:
+                        rec = rec + [None] * (width - len(rec))
+                    values = get_values(rec)
+                    if convert is not None:
+                        values = convert(values)
+                    chunk.append(dict(zip(column_names, values)))
+                    if len(chunk) >= chunk_size:
+                        yield chunk
+                        chunk = []
+                if chunk:
+                    yield chunk
 
         except IOError as e:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_file,
                 message="Could not read file = " + fn)
 
+    def __ensure_loaded__(self):
+        """
+        Loads the rows of a lazy table into memory and builds its indexes, once. The loaded rows, statistics and
+        indexes are published together when they are complete, so selects running in another thread keep
+        streaming the file until then.
+
+        :return: Nothing
+        """
+        with self.__load_lock__:
+            if self.__rows__ is not None:
+                return
+
+            loaded = CSVTable(self.__table_name__, load=False, columnar=self.__columnar__,
+                              index_files=self.__index_files__, cache=self.__cache__, chunk_size=self.__chunk_size__,
+                              workers=self.__workers__)
+            loaded.__description__ = self.__description__
+            loaded.__rows__ = []
+            loaded.__load__()
+
+            # The indexes are published last: a select only uses an index once the rows it points to are there.
+            self.__statistics__ = loaded.__statistics__
+            self.__rows__ = loaded.__rows__
+            self.__indexes__ = loaded.__indexes__
+
+    def build_indexes(self, background=False):
+        """
+        Loads the rows of a lazy table and builds its indexes. Does nothing for a table that is loaded.
+
+        :param background: Build in a background thread and return immediately.
+        :return: The background thread, or None.
+        """
+        if self.__rows__ is not None:
+            return None
+        if not background:
+            self.__ensure_loaded__()
+            return None
+
+        with self.__load_lock__:
+            if self.__load_thread__ is None:
+                self.__load_thread__ = threading.Thread(target=self.__ensure_loaded__, daemon=True)
+                self.__load_thread__.start()
+            return self.__load_thread__
+
+    def __prepare_indexes__(self, template, range_column=None):
+        """
+        Builds the indexes of a lazy table the first time a select could use one of them. With
+        background_indexes the build is started in a background thread and the select scans the file.
+
+        :param template: The template of the select.
+        :param range_column: The column of a range select, if any.
+        :return: Nothing
+        """
+        if self.__rows__ is not None or self.__description__ is None or self.__load_thread__ is not None:
+            return
+
+        usable = False
+        if range_column is None:
+            idx, count = self.__get_access_path__(template)
+            usable = idx is not None
+        else:
+            for idx in self.__description__.indexes:
+                n = self.__get_index_prefix_length__(idx, template or {})
+                if idx.index_type == "ORDERED" and n < len(idx.column_names) and \
+                        idx.column_names[n] == range_column:
+                    usable = True
+
+        if usable:
+            self.build_indexes(background=self.__background_indexes__)
+
+    def __iter_rows__(self):
+        """
+        Iterates over all rows of the table. A lazy table streams them from its CSV file.
+
+        :return: An iterator over row dictionaries.
+        """
+        if self.__rows__ is None:
+            return self.__iter_file_rows__()
+        return iter(self.__rows__)
+
     def __get_column_names__(self):
         """
         Retrieves the column names from the table description.
@@ -138,6 +414,13 @@ class CSVTable:
         :return: a list with the column names
         """
         column_names = []
+        if self.__description__ is None:
+            # Derived table, take the column names from the rows.
+            rows = self.__get_row_list__()
+            if rows:
+                column_names = list(rows[0].keys())
+            return column_names
+
         column_list = self.__description__.columns
         for column in column_list:
             column_names.append(column.column_name)
@@ -178,39 +461,232 @@ class CSVTable:
         i. Figures out if there is an index that can be used
         ii. If multiple indexes can be used , selects the most selective index
         Returns best index matching the set of keys in the template. Best is defined as the most selective index, i.e.
-        the one with the most distinct index entries.
+        the one with the most distinct index entries (for the columns the template uses), according to the index
+        statistics.
 
         An index name is of the form "colname1_colname2_coluname3" The index matches if the
         template references the columns in the index name. The template may have additional columns, but must contain
-        all of the columns in the index definition.
+        all of the columns in the index definition. An ORDERED index also matches if the template only contains a
+        leftmost prefix of its columns.
 
         :param fields: Query template.
-        :return: Two values, the index and the count, or None and None
+        :return: Two values, the index and the count (estimated distinct index entries), or None and -1
         """
 
-        if fields == []:
-            print("Error! Empty fields")
-            return
+        count = -1
+        best_idx = None
+        if not fields or self.__description__ is None:
+            return best_idx, count
+
         # check for validity of indexes
         fields_set = set(fields)
         indexes = self.__description__.indexes
 
         if indexes is None:
             print("Error! Empty indexes")
-        count = -1
-        best_idx = None
+            return best_idx, count
 
         for idx in indexes:
-            columns = idx.column_names
-            s = set(columns)
-            if s.issubset(fields_set):
-                tmp = len(s)
-                if tmp > count:
-                    best_idx = idx
-                    count = tmp
+            n = self.__get_index_prefix_length__(idx, fields_set)
+            if n == 0 or (idx.index_type != "ORDERED" and n < len(idx.column_names)):
+                continue
+            tmp = self.__estimate_distinct__(idx.column_names[:n], idx.index_name)
+            if tmp > count:
+                best_idx = idx
+                count = tmp
 
         return best_idx, count
 
+    def __get_row_count__(self):
+        """
+        Gets the number of rows of the table, estimated from the file size if the table is lazy.
+
+        :return: The (estimated) number of rows.
+        """
+        if self.__statistics__ is not None:
+            return self.__statistics__.row_count
+        if self.__rows__ is not None:
+            return len(self.__rows__)
+        try:
+            return max(1, os.path.getsize(self.__get_file_name__()) // CSVStatistics.default_row_bytes)
+        except OSError:
+            return 1
+
+    def __get_selectivity__(self, column_name):
+        """
+        :param column_name: Name of a column.
+        :return: Fraction of the rows expected to match an equality predicate on the column.
+        """
+        if self.__statistics__ is None:
+            return CSVStatistics.default_selectivity
+        return self.__statistics__.selectivity(column_name)
+
+    def __estimate_rows__(self, template):
+        """
+        Estimates the number of rows matching an equality template.
+
+        :param template: The template (or None).
+        :return: Estimated number of rows.
+        """
+        return CSVStatistics.estimate_rows(self.__get_row_count__(), template, self.__get_selectivity__)
+
+    def __estimate_distinct__(self, column_names, idx_name=None):
+        """
+        Estimates the number of distinct values of a list of columns. Uses the distinct key count of an index on
+        exactly these columns if one is loaded, otherwise the column cardinalities.
+
+        :param column_names: List of column names.
+        :param idx_name: Name of an index whose leading columns are column_names, if any.
+        :return: Estimated number of distinct values, at least 1.
+        """
+        index = getattr(self, "__indexes__", {}).get(idx_name)
+        if index is not None and len(index.column_names) == len(column_names):
+            return max(1, index.distinct_keys())
+
+        distinct = 1
+        for c in column_names:
+            distinct /= self.__get_selectivity__(c)
+        return max(1, min(self.__get_row_count__(), round(distinct)))
+
+    def __choose_access_plan__(self, template):
+        """
+        Chooses between a table scan and an index lookup for a select and estimates the cost.
+
+        :param template: The template of the select.
+        :return: The plan, a dictionary.
+        """
+        row_count = self.__get_row_count__()
+        estimated_rows = self.__estimate_rows__(template)
+        plan = {
+            "operation": "TABLE SCAN",
+            "table": self.__table_name__,
+            "template": template,
+            "estimated_rows": estimated_rows,
+            "estimated_cost": CSVStatistics.scan_cost(row_count)
+        }
+
+        idx, count = self.__get_access_path__(template)
+        if idx is not None and idx.index_name in getattr(self, "__indexes__", {}):
+            cost = CSVStatistics.index_lookup_cost(row_count / count)
+            if cost < plan["estimated_cost"]:
+                plan["operation"] = "INDEX LOOKUP"
+                plan["index"] = idx.index_name
+                plan["estimated_cost"] = cost
+
+        return plan
+
+    def __choose_join_plan__(self, right_r, on_fields, where_template=None):
+        """
+        Chooses the join algorithm for a join with right_r and estimates its cost.
+
+        - INDEX NESTED LOOP JOIN: select one input with its part of the where template and probe an index of the
+          other one on the on_fields.
+        - HASH JOIN: push the where template down to both inputs and hash join the results.
+        - SORT MERGE JOIN: used instead of the hash join when an input is lazy (not held in memory).
+
+        :param right_r: The right table of the join.
+        :param on_fields: List of fields to join on.
+        :param where_template: The where template of the join.
+        :return: The plan, a dictionary.
+        """
+        template_l, template_r = self.__get_join_sub_where_templates__(right_r, on_fields, where_template)
+        left_plan = self.__choose_access_plan__(template_l)
+        right_plan = right_r.__choose_access_plan__(template_r)
+        left_rows = left_plan["estimated_rows"]
+        right_rows = right_plan["estimated_rows"]
+
+        # The where template columns that could not be pushed down are applied to the join result.
+        residual_template = {}
+        if where_template is not None:
+            for k in where_template.keys():
+                if k not in template_l and k not in template_r:
+                    residual_template[k] = where_template[k]
+
+        distinct = max(self.__estimate_distinct__(on_fields), right_r.__estimate_distinct__(on_fields))
+        estimated_rows = CSVStatistics.estimate_rows(left_rows * right_rows / distinct, residual_template)
+
+        plan = {
+            "operation": "HASH JOIN",
+            "left": left_plan,
+            "right": right_plan,
+            "on": on_fields,
+            "estimated_rows": estimated_rows,
+            "estimated_cost": left_plan["estimated_cost"] + right_plan["estimated_cost"] +
+                              CSVStatistics.hash_join_cost(left_rows, right_rows)
+        }
+        if self.__rows__ is None or right_r.__rows__ is None:
+            plan["operation"] = "SORT MERGE JOIN"
+            plan["estimated_cost"] = left_plan["estimated_cost"] + right_plan["estimated_cost"] + \
+                CSVStatistics.sort_merge_join_cost(left_rows, right_rows)
+
+        # The scanned input is selected with its part of the where template first, so it is only probed for the
+        # rows that pass it.
+        for scan, prob, side, scan_plan in [(self, right_r, "left", left_plan), (right_r, self, "right", right_plan)]:
+            idx, count = prob.__get_access_path__(on_fields)
+            if idx is None or idx.index_name not in getattr(prob, "__indexes__", {}) or scan.__rows__ is None:
+                continue
+            cost = scan_plan["estimated_cost"] + \
+                CSVStatistics.index_nested_loop_cost(scan_plan["estimated_rows"], prob.__get_row_count__() / count)
+            if cost < plan["estimated_cost"]:
+                plan = {
+                    "operation": "INDEX NESTED LOOP JOIN",
+                    "scan": side,
+                    "scan_table": scan.__table_name__,
+                    "scan_plan": scan_plan,
+                    "probe_table": prob.__table_name__,
+                    "index": idx.index_name,
+                    "on": on_fields,
+                    "estimated_rows": estimated_rows,
+                    "estimated_cost": cost
+                }
+
+        return plan
+
+    def explain(self, template=None, right_r=None, on_fields=None):
+        """
+        Returns the plan the optimizer chooses for a select on this table, or for a join with right_r, with its
+        estimated number of rows and cost.
+
+        :param template: The select template (or a CSVPredicate.Predicate), or the where template of the join.
+        :param right_r: The right table, to explain a join.
+        :param on_fields: The join fields, to explain a join.
+        :return: The plan, a dictionary.
+        """
+        if right_r is None and isinstance(template, CSVPredicate.Predicate):
+            return self.__choose_predicate_plan__(template)
+        if right_r is None:
+            return self.__choose_access_plan__(template)
+        return self.__choose_join_plan__(right_r, on_fields, template)
+
+    def __get_index_prefix_length__(self, index, fields):
+        """
+        Counts the leading columns of an index that are referenced by the template.
+
+        :param index: An IndexDefinition or index structure.
+        :param fields: The template (or a set of column names).
+        :return: The number of leading index columns in fields.
+        """
+        n = 0
+        for column_name in index.column_names:
+            if column_name not in fields:
+                break
+            n += 1
+        return n
+
+    def __find_ids_by_index__(self, index, t):
+        """
+        Looks up the rows matching the template with an index. A template that only covers a leftmost prefix of
+        an ordered index does a prefix lookup.
+
+        :param index: The index structure (from self.__indexes__).
+        :param t: Template, must contain the index columns (or a prefix of them for an ordered index).
+        :return: List of row ids.
+        """
+        n = self.__get_index_prefix_length__(index, t)
+        if n == len(index.column_names):
+            return index.find(self.__get_key__(index, t))
+        return index.find_range(prefix=[t[c] for c in index.column_names[:n]])
+
     def matches_template(self, row, t):
         """
         A helper function that returns True if the row matches the template.
@@ -235,105 +711,658 @@ class CSVTable:
         except Exception as e:
             raise (e)
 
-    def __find_by_template_scan__(self, t, fields=None):
+    def __coerce_template__(self, t):
+        """
+        Converts the values of a template to the types the table holds, once per query, so the rows are compared
+        without conversions. A derived table has no column types; its template is returned unchanged.
+
+        :param t: The template (or None).
+        :return: The template with typed values.
+        """
+        if self.__description__ is None:
+            return t
+        return CSVColumnStore.coerce_template(self.__description__.columns, t)
+
+    def __coerce_join_template__(self, right_r, t):
+        """
+        Converts the values of a join's where template to the types of the joined rows. A column present in both
+        tables is read from the right row.
+
+        :param right_r: The right table of the join.
+        :param t: The where template (or None).
+        :return: The template with typed values.
+        """
+        return right_r.__coerce_template__(self.__coerce_template__(t))
+
+    def __find_by_template_scan__(self, t, fields=None, limit=None, offset=None):
         """
         Returns a new, derived table containing rows that match the template and the requested fields if any.
         Returns all rows if template is None and all columns if fields is None.
 
         :param t: The template representing a select predicate.
         :param fields: The list of fields (project fields)
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
         :return: New table (CSVTable obj) containing the result of the select and project.
         """
+        result = list(self.__iter_find_by_template_scan__(t, fields, limit, offset))
+        final_table = self.__table_from_rows__(table_name="scanned_table", rows=result)
+        return final_table
+
+    def __iter_find_by_template_scan__(self, t, fields=None, limit=None, offset=None):
+        """
+        Streaming version of __find_by_template_scan__: scan -> select -> limit -> project. The scan stops as
+        soon as offset + limit rows matched.
+
+        :param t: The template representing a select predicate.
+        :param fields: The list of fields (project fields)
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
+        :return: An iterator over the matching rows.
+        """
 
         if fields == []:
             fields = None
 
-        result = []
-        for r in self.__rows__:
-            if self.matches_template(r, t):
-                new_r = self.project([r], fields)[0]
-                result.append(new_r)
+        t = self.__coerce_template__(t)
+        if self.__columnar__ and self.__rows__ is not None:
+            # Compare the column arrays (vectorized if NumPy is installed) and only materialise the matching rows.
+            return CSVOperators.limit(self.__iter_columnar_select__(t, fields), limit, offset)
 
-        final_table = self.__table_from_rows__(table_name="scanned_table", rows=result)
-        return final_table
+        rows = CSVOperators.scan(self.__iter_rows__())
+        if t:
+            rows = CSVOperators.select(rows, CSVOperators.template_predicate(t))
+        return CSVOperators.project(CSVOperators.limit(rows, limit, offset), fields)
+
+    def __iter_columnar_select__(self, t, fields, predicate=None):
+        """
+        Streams a select on the column store of a columnar table (see CSVColumnStore.ColumnStore.iter_select).
 
-    def __find_by_template_index__(self, t, idx_name, fields=None):
+        :param t: A template with typed values.
+        :param fields: The list of fields (project fields), or None.
+        :param predicate: A CSVPredicate.Predicate with typed values to select with instead of the template.
+        :return: A generator over the matching rows.
+        """
+        try:
+            if predicate is not None:
+                yield from self.__rows__.iter_select_predicate(predicate, fields)
+            else:
+                yield from self.__rows__.iter_select(t, fields)
+        except KeyError as ke:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+
+    def __find_by_template_index__(self, t, idx_name, fields=None, limit=None, offset=None):
         """
         Find by template using a selected index.
 
-        An example of an index is:
-         {"TeamID": {"BOS":[list of dictionary rows with BOS]}, {"CL1":[list of dictionary rows with CL1]}}
+        An example of an index is a CSVIndex.HashIndex on TeamID with the entries:
+         {"BOS": [ids of the rows with BOS], "CL1": [ids of the rows with CL1]}
 
         An index allows us to select rows much faster.
 
         :param t: Template representing a where clause/
         :param idx_name: Name of index to use.
         :param fields: Fields to return. #deciding not to push
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
         :return: New table (CSVTable obj) containing the result of the select and project.
         """
+        result = list(self.__iter_find_by_template_index__(t, idx_name, fields, limit, offset))
+        final_table = self.__table_from_rows__(table_name="final_table", rows=result)
+        return final_table
+
+    def __iter_find_by_template_index__(self, t, idx_name, fields=None, limit=None, offset=None):
+        """
+        Streaming version of __find_by_template_index__: index lookup -> select -> limit -> project. Only the
+        list of matching row ids is computed up front, rows are read until offset + limit rows matched.
+
+        :param t: Template representing a where clause.
+        :param idx_name: Name of index to use.
+        :param fields: Fields to return.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
+        :return: An iterator over the matching rows.
+        """
 
         if fields == []:
             fields = None
 
         if t == {}:
-            return self.__find_by_template_scan__(t, fields)
+            return self.__iter_find_by_template_scan__(t, fields, limit, offset)
 
-        dic = self.__indexes__[idx_name]
+        t = self.__coerce_template__(t)
+        index = self.__indexes__[idx_name]
 
-        # create key string for the template
-        idx_column_names = self.__description__.get_index(idx_name)[0].column_names
-        key = ""
-        for name in idx_column_names:
-            key += t[name] + "_"
-        else:
-            key = key[:-1]
+        rows = self.__iter_row_ids__(self.__find_ids_by_index__(index, t))
+        rows = CSVOperators.select(rows, CSVOperators.template_predicate(t))
+        return CSVOperators.project(CSVOperators.limit(rows, limit, offset), fields)
 
-        rows = dic[key]
-        new_table = self.__table_from_rows__(table_name="new_table", rows=rows)
-        # print(new_table)
-
-        result = []
-        for r in new_table.__rows__:
-            if new_table.matches_template(r, t):
-                new_r = new_table.project([r], fields)[0]
-                result.append(new_r)
-
-        final_table = new_table.__table_from_rows__(table_name="final_table", rows=result)
-        return final_table
+    def __iter_row_ids__(self, row_ids):
+        """
+        :param row_ids: Iterable of row ids, e.g. from an index lookup.
+        :return: A generator over the rows with these ids.
+        """
+        rows = self.__rows__
+        for row_id in row_ids:
+            yield rows[row_id]
 
     def __find_by_template__(self, template, fields=None, limit=None, offset=None):
         """
         # 1. Validate the template values relative to the defined columns.
-        # 2. Determine if there is an applicable index, and call __find_by_template_index__ if one exists.
-        # 3. Call __find_by_template_scan__ if not applicable index.
+        # 2. Determine if there is an applicable index, and call __find_by_template_index__ if the cost model
+        #    chooses it (see __choose_access_plan__).
+        # 3. Call __find_by_template_scan__ otherwise.
 
         :param template: Dictionary. The template that you search by
         :param fields: Fields that you want to return for the table
-        :param limit: limit is not supported
-        :param offset: offset is not supported
+        :param limit: Maximum number of rows to return, or None for all rows. The scan or index lookup stops
+            as soon as enough rows matched.
+        :param offset: Number of matching rows to skip, or None.
         :return: returns new list of rows that have the template and the fields applied
         """
 
-        try:
-            indexes = self.__indexes__
-        except:
-            indexes = None
+        self.__prepare_indexes__(template)
+        plan = self.__choose_access_plan__(template)
+        if plan["operation"] == "INDEX LOOKUP":
+            result_rows = self.__find_by_template_index__(template, plan["index"], fields, limit, offset)
+        else:
+            result_rows = self.__find_by_template_scan__(template, fields, limit, offset)
+
+        return result_rows
+
+    def __iter_find_by_template__(self, template, fields=None, limit=None, offset=None):
+        """
+        Streaming version of __find_by_template__, with the same choice of access path.
+
+        :param template: Dictionary. The template that you search by
+        :param fields: Fields that you want to return for the table
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
+        :return: An iterator over the matching rows.
+        """
+        self.__prepare_indexes__(template)
+        plan = self.__choose_access_plan__(template)
+        if plan["operation"] == "INDEX LOOKUP":
+            return self.__iter_find_by_template_index__(template, plan["index"], fields, limit, offset)
+        return self.__iter_find_by_template_scan__(template, fields, limit, offset)
+
+    def __find_by_range__(self, column_name, low=None, high=None, template=None, fields=None, limit=None,
+                          offset=None):
+        """
+        Range select, e.g. "yearID BETWEEN 1990 AND 2000". Both bounds are inclusive, a bound of None is open.
+
+        Uses an ORDERED index whose leading columns are covered by the template and whose next column is the
+        range column, if there is one. Otherwise scans the table.
+
+        :param column_name: Column the range applies to.
+        :param low: Lower bound, or None.
+        :param high: Upper bound, or None.
+        :param template: Optional equality template applied together with the range.
+        :param fields: Fields to return.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
+        :return: New table (CSVTable obj) containing the result of the select and project.
+        """
+        if fields == []:
+            fields = None
+        if template is None:
+            template = {}
+
+        self.__prepare_indexes__(template, column_name)
+        template = self.__coerce_template__(template)
+        low = self.__coerce_template__({column_name: low})[column_name]
+        high = self.__coerce_template__({column_name: high})[column_name]
+
+        best_index = None
+        best_n = -1
+        for index in getattr(self, "__indexes__", {}).values():
+            if index.index_type != "ORDERED":
+                continue
+            n = self.__get_index_prefix_length__(index, template)
+            if n < len(index.column_names) and index.column_names[n] == column_name and n > best_n:
+                best_index = index
+                best_n = n
+
+        if best_index is not None:
+            prefix = [template[c] for c in best_index.column_names[:best_n]]
+            rows = self.__iter_row_ids__(best_index.find_range(prefix, low, high))
+        else:
+            rows = self.__iter_rows__()
+
+        def in_range(r):
+            v = r[column_name]
+            if v is None or (low is not None and v < low) or (high is not None and v > high):
+                return False
+            return self.matches_template(r, template)
+
+        rows = CSVOperators.limit(CSVOperators.select(rows, in_range), limit, offset)
+        result = list(CSVOperators.project(rows, fields))
+
+        return self.__table_from_rows__("RANGE(" + self.__table_name__ + "," + column_name + ")", result)
+
+    def __iter_ordered__(self, idx_name, reverse=False):
+        """
+        Iterates over the rows of the table in the order of an ORDERED index, so ORDER BY on the index columns
+        (with or without a LIMIT) does not need a sort.
+
+        :param idx_name: Name of an ORDERED index.
+        :param reverse: Iterate in descending order.
+        :return: A generator over row dictionaries.
+        """
+        index = self.__indexes__[idx_name]
+        for row_id in index.iter_ordered(reverse):
+            yield self.__rows__[row_id]
+
+    def __find_by_predicate__(self, predicate, fields=None, limit=None, offset=None):
+        """
+        Select with a predicate expression (see CSVPredicate), e.g.
+            t.__find_by_predicate__(CSVPredicate.and_(CSVPredicate.eq("teamID", "BOS"),
+                                                      CSVPredicate.between("yearID", 1990, 2000)))
+
+        The conjuncts an index can answer are handed to it, the others are evaluated on the rows it returns (see
+        __plan_predicate__). A scan of a columnar table evaluates the predicate as NumPy masks over the columns.
+
+        :param predicate: A CSVPredicate.Predicate.
+        :param fields: Fields to return.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
+        :return: New table (CSVTable obj) containing the result of the select and project.
+        """
+        result = list(self.__iter_find_by_predicate__(predicate, fields, limit, offset))
+        return self.__table_from_rows__("WHERE(" + self.__table_name__ + ")", result)
+
+    def __iter_find_by_predicate__(self, predicate, fields=None, limit=None, offset=None):
+        """
+        Streaming version of __find_by_predicate__: access path -> residual select -> limit -> project.
+
+        :param predicate: A CSVPredicate.Predicate.
+        :param fields: Fields to return.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of matching rows to skip, or None.
+        :return: An iterator over the matching rows.
+        """
+        if fields == []:
+            fields = None
+
+        predicate = self.__coerce_predicate__(predicate)
+
+        # A lazy table builds its indexes if one of them can answer the equality, IN or range conjuncts.
+        equal_template = {}
+        range_columns = []
+        for p in predicate.conjuncts():
+            if isinstance(p, CSVPredicate.In) or (isinstance(p, CSVPredicate.Comparison) and p.op == "="):
+                equal_template[p.column_name] = None
+            elif isinstance(p, CSVPredicate.Comparison) and p.op in CSVPredicate.range_operators:
+                range_columns.append(p.column_name)
+        self.__prepare_indexes__(equal_template)
+        for c in range_columns:
+            self.__prepare_indexes__(equal_template, c)
+
+        plan, row_ids, residual = self.__plan_predicate__(predicate)
+        if row_ids is None:
+            if self.__columnar__ and self.__rows__ is not None:
+                return CSVOperators.limit(self.__iter_columnar_select__(None, fields, predicate), limit, offset)
+            rows = CSVOperators.select(CSVOperators.scan(self.__iter_rows__()), predicate.compile())
+        else:
+            rows = self.__iter_row_ids__(row_ids())
+            if residual is not None:
+                rows = CSVOperators.select(rows, residual.compile())
+        return CSVOperators.project(CSVOperators.limit(rows, limit, offset), fields)
+
+    def __coerce_predicate__(self, predicate):
+        """
+        Checks the columns of a predicate and converts its values to the types the table holds, once per query.
+
+        :param predicate: A CSVPredicate.Predicate.
+        :return: The predicate with typed values.
+        """
+        if self.__description__ is not None:
+            column_names = self.__get_column_names__()
+            for c in sorted(predicate.columns()):
+                if c not in column_names:
+                    raise DataTableExceptions.DataTableException(
+                        code=DataTableExceptions.DataTableException.invalid_argument,
+                        message="Invalid column " + c + " in predicate")
+        return predicate.coerce(self.__coerce_template__)
+
+    def __choose_predicate_plan__(self, predicate):
+        """
+        :param predicate: A CSVPredicate.Predicate.
+        :return: The plan of a select with the predicate, a dictionary (see __plan_predicate__).
+        """
+        plan, row_ids, residual = self.__plan_predicate__(self.__coerce_predicate__(predicate))
+        return plan
+
+    def __plan_predicate__(self, predicate):
+        """
+        Chooses the access path of a select with a predicate and estimates its cost. The conjuncts of the predicate
+        an index can answer are handed to it:
 
-        if indexes is None or indexes == {}:
-            result_rows = self.__find_by_template_scan__(template, fields)
+        - INDEX LOOKUP: equalities and IN lists on all the columns of an index, or on a leftmost prefix of an
+          ORDERED index, with one probe per combination of the values.
+        - INDEX RANGE SCAN: equalities on a leftmost prefix of an ORDERED index and range comparisons on its next
+          column. A strict bound is also kept in the residual predicate, the index bounds are inclusive.
 
+        The other conjuncts are the residual predicate, evaluated on the rows the index returns. A TABLE SCAN
+        evaluates the whole predicate.
+
+        :param predicate: A CSVPredicate.Predicate with typed values.
+        :return: The plan (a dictionary), a function returning the row ids of the index access (None for a scan)
+            and the residual predicate (None if there is none).
+        """
+        conjuncts = predicate.conjuncts()
+        row_count = self.__get_row_count__()
+        result_rows = row_count * predicate.selectivity(self.__get_selectivity__)
+        plan = {
+            "operation": "TABLE SCAN",
+            "table": self.__table_name__,
+            "predicate": str(predicate),
+            "estimated_rows": result_rows,
+            "estimated_cost": CSVStatistics.scan_cost(row_count)
+        }
+        best = (plan, None, predicate)
+
+        # column -> the first equality (or IN list) on the column, and column -> the range comparisons on it.
+        equal = {}
+        in_lists = {}
+        ranges = {}
+        for p in conjuncts:
+            if isinstance(p, CSVPredicate.Comparison) and p.op == "=":
+                equal.setdefault(p.column_name, p)
+            elif isinstance(p, CSVPredicate.In):
+                in_lists.setdefault(p.column_name, p)
+            elif isinstance(p, CSVPredicate.Comparison) and p.op in CSVPredicate.range_operators and \
+                    p.value is not None:
+                ranges.setdefault(p.column_name, []).append(p)
+
+        def candidate(operation, index, used, cost, row_ids):
+            residual = [p for p in conjuncts if not any(p is u for u in used)]
+            residual = CSVPredicate.And(residual) if residual else None
+            index_plan = {
+                "operation": operation,
+                "table": self.__table_name__,
+                "index": index.index_name,
+                "index_predicate": str(CSVPredicate.And(used)),
+                "residual": None if residual is None else str(residual),
+                "estimated_rows": result_rows,
+                "estimated_cost": cost
+            }
+            return index_plan, row_ids, residual
+
+        for index in getattr(self, "__indexes__", {}).values():
+            columns = index.column_names
+            ordered = index.index_type == "ORDERED"
+
+            # Equalities and IN lists.
+            m = self.__get_index_prefix_length__(index, set(equal) | set(in_lists))
+            if m == len(columns) or (ordered and m > 0):
+                used = [equal.get(c) or in_lists[c] for c in columns[:m]]
+                value_lists = []
+                for p in used:
+                    if isinstance(p, CSVPredicate.In):
+                        value_lists.append(list(dict.fromkeys(p.values)))
+                    else:
+                        value_lists.append([p.value])
+                probes = 1
+                for values in value_lists:
+                    probes *= len(values)
+                estimated_rows = probes * row_count / self.__estimate_distinct__(columns[:m], index.index_name)
+                cost = CSVStatistics.index_lookup_cost(estimated_rows, probes)
+                if cost < best[0]["estimated_cost"]:
+                    def row_ids(index=index, value_lists=value_lists, probes=probes, m=m):
+                        result = []
+                        for key in itertools.product(*value_lists):
+                            result.extend(self.__find_ids_by_index__(index, dict(zip(index.column_names[:m], key))))
+                        # Several probes return the rows in table order, like a scan.
+                        if probes > 1:
+                            result.sort()
+                        return result
+                    best = candidate("INDEX LOOKUP", index, used, cost, row_ids)
+
+            # Ranges after a prefix of equalities.
+            n = self.__get_index_prefix_length__(index, equal)
+            if not ordered or n == len(columns) or columns[n] not in ranges:
+                continue
+            used = [equal[c] for c in columns[:n]]
+            comparisons = ranges[columns[n]]
+            lows = [p for p in comparisons if p.op in (">", ">=")]
+            highs = [p for p in comparisons if p.op in ("<", "<=")]
+            low = max([p.value for p in lows]) if lows else None
+            high = min([p.value for p in highs]) if highs else None
+            for p in lows:
+                if p.op == ">=" or p.value < low:
+                    used.append(p)
+            for p in highs:
+                if p.op == "<=" or p.value > high:
+                    used.append(p)
+
+            estimated_rows = row_count / self.__estimate_distinct__(columns[:n], index.index_name) * \
+                CSVStatistics.range_selectivity
+            cost = CSVStatistics.index_lookup_cost(estimated_rows)
+            if cost < best[0]["estimated_cost"]:
+                prefix = [equal[c].value for c in columns[:n]]
+                best = candidate("INDEX RANGE SCAN", index, used, cost,
+                                 lambda index=index, prefix=prefix, low=low, high=high:
+                                 index.find_range(prefix, low, high))
+
+        return best
+
+    def group_by(self, group_fields, aggregates, where=None, max_groups=None):
+        """
+        GROUP BY with hash aggregation (see CSVOperators.hash_aggregate), e.g. the home runs per team and year:
+            batting.group_by(["teamID", "yearID"], [("SUM", "HR"), ("COUNT", "*")], {"lgID": "AL"})
+
+        Works on base tables and on derived tables, e.g. the result of a join. The rows are selected with the
+        usual access path and aggregated in the same pass, without copying them.
+
+        :param group_fields: List of the group by columns, or [] for a single group over all rows.
+        :param aggregates: List of (function, column) or (function, column, output name), the functions being
+            COUNT, SUM, MIN, MAX and AVG. COUNT(*) counts the rows, the other functions ignore NULL values.
+        :param where: A select template or CSVPredicate.Predicate applied before the aggregation, or None.
+        :param max_groups: Maximum number of groups held in memory before partial aggregates are spilled to disk.
+        :return: New table (CSVTable obj) with one row per group.
+        """
+        result = list(self.__iter_group_by__(group_fields, aggregates, where, max_groups))
+        return self.__table_from_rows__("GROUP(" + self.__table_name__ + ")", result)
+
+    def __iter_group_by__(self, group_fields, aggregates, where=None, max_groups=None):
+        """
+        Streaming version of group_by. The result rows are produced after the whole input was read.
+
+        :return: A generator over the result rows.
+        """
+        fields = list(group_fields)
+        for a in aggregates:
+            if len(a) < 2:
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_argument,
+                    message="Invalid aggregate " + str(a))
+            if a[1] != "*" and a[1] not in fields:
+                fields.append(a[1])
+
+        column_names = self.__get_column_names__()
+        for c in fields:
+            if column_names and c not in column_names:
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_argument,
+                    message="Invalid column " + c + " in group by")
+
+        # A columnar table only materialises the columns the aggregation reads.
+        select_fields = fields if self.__columnar__ and fields else None
+        if isinstance(where, CSVPredicate.Predicate):
+            rows = self.__iter_find_by_predicate__(where, select_fields)
         else:
-            result_index, count = self.__get_access_path__(template)
-            if result_index is not None:
+            rows = self.__iter_find_by_template__(where, select_fields)
+        return CSVOperators.hash_aggregate(rows, group_fields, aggregates, max_groups)
+
+    def order_by(self, order_fields, where=None, fields=None, limit=None, offset=None, run_size=None):
+        """
+        ORDER BY, e.g. the ten Red Sox seasons with the most home runs:
+            batting.order_by([("HR", "DESC"), "yearID"], {"teamID": "BOS"}, limit=10)
+
+        The rows are read in the order of an ORDERED index on the sort columns when there is one and the cost
+        model prefers it, otherwise they are selected and sorted: with a bounded heap when there is a limit,
+        with an external merge sort otherwise (see __choose_order_plan__). Both sorts are stable: rows with equal
+        sort keys keep the order in which the where clause selects them (file order for a scan). Rows read from
+        an ORDERED index come in the order of its columns after the sort columns, then in file order.
+
+        :param order_fields: List of columns, or of (column, "ASC" or "DESC"). NULLs come first in ascending order
+            and last in descending order.
+        :param where: A select template or CSVPredicate.Predicate, or None.
+        :param fields: Fields to return.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of rows to skip, or None.
+        :param run_size: Memory budget of the external sort, in rows. Defaults to CSVSort.default_run_size.
+        :return: New table (CSVTable obj) with the sorted rows.
+        """
+        result = list(self.__iter_order_by__(order_fields, where, fields, limit, offset, run_size))
+        return self.__table_from_rows__("ORDER(" + self.__table_name__ + ")", result)
+
+    def __iter_order_by__(self, order_fields, where=None, fields=None, limit=None, offset=None, run_size=None):
+        """
+        Streaming version of order_by. Only the ordered index scan streams, a sort reads its whole input first.
+
+        :return: An iterator over the sorted rows.
+        """
+        if fields == []:
+            fields = None
+
+        plan, access = self.__plan_order_by__(order_fields, where, limit, offset, run_size)
+        order_fields, where, test = access["order_fields"], access["where"], access["test"]
 
-                #result_rows = self.__find_by_template_index__(template, result_index, fields)
-                result_rows = self.__find_by_template_index__(template, result_index.index_name, fields)
+        if plan["operation"] == "ORDERED INDEX SCAN":
+            index = self.__indexes__[plan["index"]]
+            if access["prefix"]:
+                row_ids = index.find_range(access["prefix"], reverse=plan["reverse"])
             else:
-                result_rows = self.__find_by_template_scan__(template, fields)
+                row_ids = index.iter_ordered(plan["reverse"])
+            rows = CSVOperators.select(self.__iter_row_ids__(row_ids), test)
+            return CSVOperators.project(CSVOperators.limit(rows, limit, offset), fields)
+
+        # A columnar table only materialises the columns the sort and the result need.
+        select_fields = None
+        if self.__columnar__ and fields:
+            select_fields = list(fields) + [c for c, descending in order_fields if c not in fields]
+        if isinstance(where, CSVPredicate.Predicate):
+            rows = self.__iter_find_by_predicate__(where, select_fields)
+        else:
+            rows = self.__iter_find_by_template__(where, select_fields)
 
-        return result_rows
+        if not order_fields:
+            rows = CSVOperators.limit(rows, limit, offset)
+        else:
+            rows = CSVOperators.order_by(rows, order_fields, limit, offset, run_size)
+        return CSVOperators.project(rows, fields)
 
-    def dumb_join(self, right_r, on_fields, where_template=None, project_fields=None):
+    def __choose_order_plan__(self, order_fields, where=None, limit=None, offset=None, run_size=None):
+        """
+        :return: The plan of an ORDER BY, a dictionary (see __plan_order_by__).
+        """
+        plan, access = self.__plan_order_by__(order_fields, where, limit, offset, run_size)
+        return plan
+
+    def __plan_order_by__(self, order_fields, where=None, limit=None, offset=None, run_size=None):
+        """
+        Chooses how to execute an ORDER BY and estimates its cost.
+
+        - ORDERED INDEX SCAN: the where equalities cover a leftmost prefix of an ORDERED index and the sort columns
+          are its next columns, all in the same direction. The rows are read in index order and filtered with the
+          where clause, and a limit stops the scan early.
+        - TOP-K SORT: with a limit, the first offset + limit rows of the select are kept in a bounded heap.
+        - SORT: the select is sorted with an external merge sort, in memory if it fits in run_size rows.
+
+        Sort columns fixed by a where equality do not change the order and are dropped.
+
+        :param order_fields: List of columns, or of (column, "ASC" or "DESC").
+        :param where: A select template or CSVPredicate.Predicate, or None.
+        :param limit: Maximum number of rows to return, or None.
+        :param offset: Number of rows to skip, or None.
+        :param run_size: Memory budget of the external sort, in rows.
+        :return: The plan, a dictionary, and a dictionary with what the execution needs: the remaining order fields
+            as (column, descending), the coerced where clause, its row test and the index prefix.
+        """
+        column_names = self.__get_column_names__()
+        normalized = []
+        for f in order_fields:
+            c, direction = (f, "ASC") if isinstance(f, str) else f
+            if str(direction).upper() not in ("ASC", "DESC") or (column_names and c not in column_names):
+                raise DataTableExceptions.DataTableException(
+                    code=DataTableExceptions.DataTableException.invalid_argument,
+                    message="Invalid order by field " + str(f))
+            normalized.append((c, str(direction).upper() == "DESC"))
+
+        if isinstance(where, CSVPredicate.Predicate):
+            where = self.__coerce_predicate__(where)
+            equal = {}
+            for p in where.conjuncts():
+                if isinstance(p, CSVPredicate.Comparison) and p.op == "=" and p.column_name not in equal:
+                    equal[p.column_name] = p.value
+            test = where.compile()
+            input_plan = self.__choose_predicate_plan__(where)
+        else:
+            where = self.__coerce_template__(where)
+            equal = where or {}
+            test = CSVOperators.template_predicate(where)
+            self.__prepare_indexes__(where)
+            input_plan = self.__choose_access_plan__(where)
+
+        normalized = [(c, descending) for c, descending in normalized if c not in equal]
+        access = {"order_fields": normalized, "where": where, "test": test, "prefix": None}
+
+        estimated_rows = input_plan["estimated_rows"]
+        k = None
+        if limit is not None:
+            k = limit + (offset or 0)
+        plan = {
+            "operation": "SORT",
+            "order_by": [c + (" DESC" if descending else " ASC") for c, descending in normalized],
+            "input": input_plan,
+            "estimated_rows": estimated_rows if k is None else min(estimated_rows, k),
+            "estimated_cost": input_plan["estimated_cost"] + CSVStatistics.sort_cost(estimated_rows)
+        }
+        if not normalized:
+            plan["operation"] = "NO SORT"
+            plan["estimated_cost"] = input_plan["estimated_cost"]
+            return plan, access
+        if k is not None:
+            plan["operation"] = "TOP-K SORT"
+            plan["k"] = k
+            plan["estimated_cost"] = input_plan["estimated_cost"] + CSVStatistics.top_k_cost(estimated_rows, k)
+        elif estimated_rows > (run_size or CSVSort.default_run_size):
+            plan["operation"] = "EXTERNAL SORT"
+
+        # A lazy table builds its indexes if an ORDERED index gives the order.
+        self.__prepare_indexes__(equal, normalized[0][0])
+
+        directions = set([descending for c, descending in normalized])
+        sort_columns = [c for c, descending in normalized]
+        for index in getattr(self, "__indexes__", {}).values():
+            n = self.__get_index_prefix_length__(index, equal)
+            if index.index_type != "ORDERED" or len(directions) > 1 or \
+                    index.column_names[n:n + len(sort_columns)] != sort_columns:
+                continue
+
+            # The index scan reads the rows of the prefix, a limit stops it once enough of them matched.
+            rows_read = self.__get_row_count__() / self.__estimate_distinct__(index.column_names[:n],
+                                                                              index.index_name)
+            if k is not None:
+                rows_read = min(rows_read, k * rows_read / max(1, estimated_rows))
+            cost = CSVStatistics.index_lookup_cost(rows_read)
+            if cost < plan["estimated_cost"]:
+                plan = {
+                    "operation": "ORDERED INDEX SCAN",
+                    "table": self.__table_name__,
+                    "index": index.index_name,
+                    "reverse": normalized[0][1],
+                    "order_by": plan["order_by"],
+                    "estimated_rows": plan["estimated_rows"],
+                    "estimated_cost": cost
+                }
+                access["prefix"] = [equal[c] for c in index.column_names[:n]]
+
+        return plan, access
+
+    def dumb_join(self, right_r, on_fields, where_template=None, project_fields=None, limit=None, offset=None):
         """
         A 'dumb' JOIN on two CSV Tables. Support equi-join only on a list of common
         columns names.
@@ -344,84 +1373,346 @@ class CSVTable:
         :param on_fields: A list of common fields used for the equi-join.
         :param where_template: Select template to apply to the result to determine what to return.
         :param project_fields: List of fields to return from the result.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
         :return: CSVTable object that is the joined and filtered rows
         """
-        left_r = self
-        left_rows = left_r.__get_row_list__()
+        where_template = self.__coerce_join_template__(right_r, where_template)
         right_rows = right_r.__get_row_list__()
-        result_rows = []
-
-        left_rows_processed = 0
-        for lr in left_rows:
-            on_template = self.__get_on_template__(lr, on_fields)
-            for rr in right_rows:
-                if self.matches_template(rr, on_template):
-                    new_r = {**lr, **rr}
-                    result_rows.append(new_r)
-            left_rows_processed += 1
-            if left_rows_processed % 1000 == 0:
-                print("Processed", left_rows_processed, "left rows.")
-
-        join_result = self.__table_from_rows__("JOIN:" + left_r.__table_name__ + ":" + right_r.__table_name__, result_rows)
-        result = join_result.__find_by_template__(template=where_template, fields=project_fields)  # join table won't have indexes so it will use template_scan
-        final_table = self.__table_from_rows__("Filtered JOIN(" + self.__table_name__ + "," + right_r.__table_name__ + ")", result)
+
+        def left_rows():
+            left_rows_processed = 0
+            for lr in self.__iter_rows__():
+                yield lr
+                left_rows_processed += 1
+                if left_rows_processed % 1000 == 0:
+                    print("Processed", left_rows_processed, "left rows.")
+
+        joined = CSVOperators.nested_loop_join(left_rows(), right_rows, on_fields)
+        result_rows = list(self.__iter_join_result__(joined, where_template, project_fields, limit, offset))
+        final_table = self.__table_from_rows__("Filtered JOIN(" + self.__table_name__ + "," + right_r.__table_name__ + ")",
+                                               result_rows)
         return final_table
 
-    def __smart_join__(self, right_r, on_fields, where_template=None, project_fields=None):
+    def hash_join(self, right_r, on_fields, where_template=None, project_fields=None, limit=None, offset=None,
+                  workers=None):
         """
-        A JOIN on two CSV Tables. Support equi-join only on a list of common
+        A hash JOIN on two CSV Tables. Support equi-join only on a list of common
         columns names.
 
-        If no optimizations are possible, do a simple nested loop join and then apply where_clause and project to result
+        Builds a hash table on the smaller input, keyed by the tuple of on_fields values, and streams the larger
+        input through it. Returns the same rows as dumb_join (merged rows are always {**left, **right}).
+
+        With workers, both inputs are hash partitioned on the on_fields and the partitions are joined in
+        parallel. The rows are then grouped by partition instead of being in probe order.
 
         :param right_r: The right table, or second input table.
         :param on_fields: A list of common fields used for the equi-join.
         :param where_template: Select template to apply to the result to determine what to return.
         :param project_fields: List of fields to return from the result.
-        :return: A CSVTable. List of dictionary elements, each representing a row.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
+        :param workers: Join with this many worker processes (see CSVParallel.partitioned_hash_join).
+        :return: CSVTable object that is the joined and filtered rows
         """
+        result_rows = list(self.__iter_hash_join__(right_r, on_fields, where_template, project_fields, limit,
+                                                   offset, workers))
+        final_table = self.__table_from_rows__("Filtered JOIN(" + self.__table_name__ + "," + right_r.__table_name__ + ")",
+                                               result_rows)
+        return final_table
 
-        idx1, count1 = self.__get_access_path__(on_fields)
-        idx2, count2 = right_r.__get_access_path__(on_fields)
-        #print(count1, count2)
+    def __iter_hash_join__(self, right_r, on_fields, where_template=None, project_fields=None, limit=None,
+                           offset=None, workers=None):
+        """
+        Streaming version of hash_join. Only the build side is held in memory. With a limit, the probe side is
+        only read until enough rows were produced.
 
+        :param right_r: The right table, or second input table.
+        :param on_fields: A list of common fields used for the equi-join.
+        :param where_template: Select template to apply to the result to determine what to return.
+        :param project_fields: List of fields to return from the result.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
+        :param workers: Join with this many worker processes (see CSVParallel.partitioned_hash_join).
+        :return: A generator over the joined rows.
+        """
+        where_template = self.__coerce_join_template__(right_r, where_template)
+
+        if workers is not None and workers > 1:
+            columns = self.__get_parallel_join_columns__(right_r, on_fields, where_template, project_fields)
+            if columns is not None:
+                rows = CSVParallel.partitioned_hash_join(self.__iter_rows__(), columns[0], right_r.__iter_rows__(),
+                                                         columns[1], on_fields, where_template, columns[2], workers)
+                return CSVOperators.limit(rows, limit, offset)
+
+        # Build on the smaller input, probe with the larger one.
+        build_left = self.__get_row_count__() <= right_r.__get_row_count__()
+        if build_left:
+            build_rows, probe_rows = self.__iter_rows__(), right_r.__iter_rows__()
+        else:
+            build_rows, probe_rows = right_r.__iter_rows__(), self.__iter_rows__()
 
-        # scenario 1: no indexes available in both tables, rewrite it as a more efficient querry
-        if count1 == -1 and count2 == -1:
-            print("no optimization by indexing")
-            template_l = self.__get_sub_where_template__(where_template)
-            left_table = self.__find_by_template__(template=template_l)
-            template_r = right_r.__get_sub_where_template__(where_template)
-            right_table = right_r.__find_by_template__(template=template_r)
+        joined = CSVOperators.hash_join(build_rows, probe_rows, on_fields, build_left)
+        return self.__iter_join_result__(joined, where_template, project_fields, limit, offset)
 
-            return left_table.dumb_join(right_table, on_fields, where_template, project_fields)
+    def __get_parallel_join_columns__(self, right_r, on_fields, where_template, project_fields):
+        """
+        Gets the columns a parallel hash join sends to the workers. The join is run serially if a join, where or
+        project field is not a column of the inputs, so that it fails the same way.
+
+        :param right_r: The right table of the join.
+        :param on_fields: List of fields to join on.
+        :param where_template: The where template of the join.
+        :param project_fields: List of fields to return, or None.
+        :return: The left columns, the right columns and the fields to return, or None.
+        """
+        left_columns = self.__get_column_names__()
+        right_columns = right_r.__get_column_names__()
+        columns = CSVParallel.join_columns(left_columns, right_columns)
+        fields = project_fields or columns
+
+        if any(f not in left_columns or f not in right_columns for f in on_fields):
+            return None
+        if any(f not in columns for f in list(fields) + list((where_template or {}).keys())):
+            return None
+        return left_columns, right_columns, fields
+
+    def sort_merge_join(self, right_r, on_fields, where_template=None, project_fields=None, run_size=None,
+                        limit=None, offset=None):
+        """
+        A sort-merge JOIN on two CSV Tables. Support equi-join only on a list of common
+        columns names.
 
-        # scenario 2: indexing available
-        scan = self
-        prob = right_r
+        Both inputs are sorted on the on_fields with an external sort, so neither input has to fit in memory.
+        Use a lazy table (CSVTable(t_name, lazy=True)) to stream an input from its CSV file.
 
-        # check which table has a more efficient index
-        if count1 > count2:
-            scan = right_r
-            prob = self
+        :param right_r: The right table, or second input table.
+        :param on_fields: A list of common fields used for the equi-join.
+        :param where_template: Select template to apply to the result to determine what to return.
+        :param project_fields: List of fields to return from the result.
+        :param run_size: Memory budget of each external sort, in rows. Defaults to CSVSort.default_run_size.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
+        :return: CSVTable object that is the joined and filtered rows
+        """
+        result_rows = list(self.__iter_sort_merge_join__(right_r, on_fields, where_template, project_fields,
+                                                         run_size, limit, offset))
+        final_table = self.__table_from_rows__("Filtered JOIN(" + self.__table_name__ + "," + right_r.__table_name__ + ")",
+                                               result_rows)
+        return final_table
 
-        #print(scan.__description__)
+    def __iter_sort_merge_join__(self, right_r, on_fields, where_template=None, project_fields=None,
+                                 run_size=None, limit=None, offset=None):
+        """
+        Streams the rows of a sort-merge join. Only one group of right rows with equal join keys is held in
+        memory at a time, besides the runs of the external sorts. Both inputs are always sorted completely,
+        a limit only stops the merge. With project_fields, the inputs only keep the columns the join needs
+        before they are sorted (see __get_join_fields__).
 
-        result_rows = []
-        for lr in scan.__get_row_list__():
-            on_template = scan.__get_on_template__(lr, on_fields)
-            result = prob.__find_by_template__(on_template)
-            # print(result.__rows__)
-            for rr in result.__rows__:
-                new_r = {**lr, **rr}
-                result_rows.append(new_r)
+        :param right_r: The right table, or second input table.
+        :param on_fields: A list of common fields used for the equi-join.
+        :param where_template: Select template to apply to the result to determine what to return.
+        :param project_fields: List of fields to return from the result.
+        :param run_size: Memory budget of each external sort, in rows.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
+        :return: A generator over the joined rows, in on_fields order.
+        """
+        where_template = self.__coerce_join_template__(right_r, where_template)
+        template_l, template_r = self.__get_join_sub_where_templates__(right_r, on_fields, where_template)
+
+        # NULLs sort first, so number columns holding None can be sorted.
+        def key(r):
+            return CSVIndex.order_key(self.__get_on_key__(r, on_fields))
+
+        fields_l, fields_r = self.__get_join_fields__(right_r, on_fields, where_template, project_fields)
+
+        left_rows = CSVOperators.select(self.__iter_rows__(), CSVOperators.template_predicate(template_l))
+        right_rows = CSVOperators.select(right_r.__iter_rows__(), CSVOperators.template_predicate(template_r))
+        left_rows = CSVOperators.project(left_rows, fields_l)
+        right_rows = CSVOperators.project(right_rows, fields_r)
+
+        joined = CSVOperators.merge_join(CSVSort.external_sort(left_rows, key, run_size),
+                                         CSVSort.external_sort(right_rows, key, run_size), key)
+        return self.__iter_join_result__(joined, where_template, project_fields, limit, offset)
+
+    def __iter_join_result__(self, joined, where_template, project_fields, limit=None, offset=None):
+        """
+        Applies the where template, the limit and the projection of a join to the stream of joined rows.
+        Skipped rows are not projected.
+
+        :param joined: Iterator over the joined rows.
+        :param where_template: Select template to apply to the result.
+        :param project_fields: List of fields to return from the result.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
+        :return: An iterator over the result rows.
+        """
+        if project_fields == []:
+            project_fields = None
+        rows = CSVOperators.select(joined, CSVOperators.template_predicate(where_template))
+        return CSVOperators.project(CSVOperators.limit(rows, limit, offset), project_fields)
+
+    def __smart_join__(self, right_r, on_fields, where_template=None, project_fields=None, limit=None,
+                       offset=None, workers=None):
+        """
+        A JOIN on two CSV Tables. Support equi-join only on a list of common
+        columns names.
 
-        join_result = scan.__table_from_rows__("JOIN:" + scan.__table_name__ + ":" + right_r.__table_name__,
+        The join algorithm is chosen by the cost model (see __choose_join_plan__ and explain). Whatever the
+        algorithm, the where_template is pushed down to each input, and with project_fields each input only keeps
+        the columns needed by the join fields, the where_template and the project_fields.
+
+        :param right_r: The right table, or second input table.
+        :param on_fields: A list of common fields used for the equi-join.
+        :param where_template: Select template to apply to the result to determine what to return.
+        :param project_fields: List of fields to return from the result.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
+        :param workers: Run a hash join plan with this many worker processes (see hash_join).
+        :return: A CSVTable. List of dictionary elements, each representing a row.
+        """
+        result_rows = list(self.__iter_smart_join__(right_r, on_fields, where_template, project_fields, limit,
+                                                    offset, workers))
+        final_table = self.__table_from_rows__("Filtered JOIN(" + self.__table_name__ + "," + right_r.__table_name__ + ")",
                                                result_rows)
-        result = join_result.__find_by_template__(template=where_template, fields=project_fields)
-        final_table = scan.__table_from_rows__("Filtered JOIN(" + scan.__table_name__ + "," + right_r.__table_name__ + ")", result)
         return final_table
 
+    def __iter_smart_join__(self, right_r, on_fields, where_template=None, project_fields=None, limit=None,
+                            offset=None, workers=None):
+        """
+        Streaming version of __smart_join__. The join result is produced one row at a time, so the selected
+        inputs and the unfiltered join result are never materialised, and a limit stops reading the inputs
+        (the build side of a hash join and the sorts of a sort-merge join are always complete).
+
+        With workers, a hash join plan runs as a parallel partitioned hash join (see hash_join). The other
+        plans are not affected.
+
+        :param right_r: The right table, or second input table.
+        :param on_fields: A list of common fields used for the equi-join.
+        :param where_template: Select template to apply to the result to determine what to return.
+        :param project_fields: List of fields to return from the result.
+        :param limit: Maximum number of rows to return, or None for all rows.
+        :param offset: Number of result rows to skip, or None.
+        :param workers: Run a hash join plan with this many worker processes (see hash_join).
+        :return: A generator over the joined rows.
+        """
+
+        where_template = self.__coerce_join_template__(right_r, where_template)
+        plan = self.__choose_join_plan__(right_r, on_fields, where_template)
+
+        # scenario 1: no usable index, push the selects down and hash join (or sort-merge join) the results
+        if plan["operation"] == "SORT MERGE JOIN":
+            return self.__iter_sort_merge_join__(right_r, on_fields, where_template, project_fields,
+                                                 limit=limit, offset=offset)
+
+        # The selects are pushed down to both inputs. If nothing is left to check on the joined rows, they are
+        # built with the project fields only.
+        template_l, template_r = self.__get_join_sub_where_templates__(right_r, on_fields, where_template)
+        merge = self.__get_projected_merge__(right_r, where_template, template_l, template_r, project_fields)
+
+        if plan["operation"] == "HASH JOIN":
+            if workers is not None and workers > 1:
+                columns = self.__get_parallel_join_columns__(right_r, on_fields, where_template, project_fields)
+                if columns is not None:
+                    left_rows = self.__iter_find_by_template__(template=template_l)
+                    right_rows = right_r.__iter_find_by_template__(template=template_r)
+                    rows = CSVParallel.partitioned_hash_join(left_rows, columns[0], right_rows, columns[1], on_fields,
+                                                             where_template, columns[2], workers)
+                    return CSVOperators.limit(rows, limit, offset)
+
+            left_rows = self.__iter_find_by_template__(template=template_l)
+            right_rows = right_r.__iter_find_by_template__(template=template_r)
+
+            # Build on the input with fewer estimated rows, probe with the other one.
+            build_left = plan["left"]["estimated_rows"] <= plan["right"]["estimated_rows"]
+            if build_left:
+                joined = CSVOperators.hash_join(left_rows, right_rows, on_fields, True, merge or CSVOperators.merge_rows)
+            else:
+                joined = CSVOperators.hash_join(right_rows, left_rows, on_fields, False, merge or CSVOperators.merge_rows)
+            if merge is not None:
+                return CSVOperators.limit(joined, limit, offset)
+            return self.__iter_join_result__(joined, where_template, project_fields, limit, offset)
+
+        # scenario 2: indexing available, select the side the plan chose and probe the other one
+        scan, scan_template = self, template_l
+        prob, prob_template = right_r, template_r
+        if plan["scan"] == "right":
+            scan, scan_template = right_r, template_r
+            prob, prob_template = self, template_l
+
+        # Probe the index directly with the key of each selected row, together with the probed table's part of
+        # the where template. The fields that are not in the index prefix used are checked on the matching rows.
+        index = prob.__indexes__[plan["index"]]
+        prob_template = prob.__coerce_template__(prob_template)
+        lookup_fields = list(on_fields) + [f for f in prob_template.keys() if f not in on_fields]
+        prefix_length = prob.__get_index_prefix_length__(index, lookup_fields)
+        residual_fields = [f for f in lookup_fields if f not in index.column_names[:prefix_length]]
+
+        def lookup(sr):
+            lookup_template = {**prob_template, **scan.__get_on_template__(sr, on_fields)}
+            residual = CSVOperators.template_predicate({f: lookup_template[f] for f in residual_fields})
+            matches = prob.__iter_row_ids__(prob.__find_ids_by_index__(index, lookup_template))
+            return CSVOperators.select(matches, residual)
+
+        # Joined rows are always {**left, **right}, whichever side is scanned.
+        scan_rows = scan.__iter_find_by_template__(template=scan_template)
+        joined = CSVOperators.index_nested_loop_join(scan_rows, lookup, scan is self, merge or CSVOperators.merge_rows)
+        if merge is not None:
+            return CSVOperators.limit(joined, limit, offset)
+        return self.__iter_join_result__(joined, where_template, project_fields, limit, offset)
+
+    def __get_projected_merge__(self, right_r, where_template, template_l, template_r, project_fields):
+        """
+        Gets the merge function of a join whose where template was completely pushed down to the inputs. The
+        joined rows are then built with the project fields only, instead of merging the full rows and projecting.
+
+        :param right_r: The right table of the join.
+        :param where_template: The where template of the join.
+        :param template_l: The part of the where template pushed down to this (left) table.
+        :param template_r: The part of the where template pushed down to the right table.
+        :param project_fields: List of fields to return, or None for all fields.
+        :return: A merge function (see CSVOperators.projected_merge), or None if the joined rows still have to be
+            selected and projected.
+        """
+        if not project_fields:
+            return None
+        if any(k not in template_l and k not in template_r for k in (where_template or {}).keys()):
+            return None
+
+        left_columns = self.__get_column_names__()
+        right_columns = right_r.__get_column_names__()
+        if any(f not in left_columns and f not in right_columns for f in project_fields):
+            return None
+        return CSVOperators.projected_merge(project_fields, right_columns)
+
+    def __get_join_fields__(self, right_r, on_fields, where_template, project_fields):
+        """
+        Gets the columns each input of a join has to provide: the join fields, the where template fields and the
+        project fields. A column present in both tables is read from the right row, so the left input only
+        provides it if it is a join field.
+
+        :param right_r: The right table of the join.
+        :param on_fields: List of fields to join on.
+        :param where_template: The where template of the join.
+        :param project_fields: List of fields to return, or None for all fields.
+        :return: Two lists of fields, for this (left) table and for the right table, or None, None to keep all
+            the columns.
+        """
+        if not project_fields:
+            return None, None
+
+        fields = list(on_fields)
+        for f in list((where_template or {}).keys()) + list(project_fields):
+            if f not in fields:
+                fields.append(f)
+
+        left_columns = self.__get_column_names__()
+        right_columns = right_r.__get_column_names__()
+        fields_l = [f for f in fields if f in left_columns and (f not in right_columns or f in on_fields)]
+        fields_r = [f for f in fields if f in right_columns]
+        return fields_l, fields_r
+
     def __get_sub_where_template__(self, where_template):
         """
         Gets the where template fields that are applicable to the table
@@ -432,6 +1723,8 @@ class CSVTable:
         :return: where template dictionary
         """
         sub_template = {}
+        if where_template is None:
+            return sub_template
         table_columns = self.__get_column_names__()
 
         # Go through each key in the where template and see if it is a column in the table
@@ -441,6 +1734,37 @@ class CSVTable:
 
         return sub_template
 
+    def __get_join_sub_where_templates__(self, right_r, on_fields, where_template):
+        """
+        Splits the where template of a join into the parts that can be applied to each input before the join.
+
+        A joined row is {**left, **right}, so a column present in both tables is read from the right row. Those
+        columns may only be pushed to the right input, unless they are join columns (equal on both sides).
+
+        :param right_r: The right table of the join.
+        :param on_fields: List of fields to join on.
+        :param where_template: The where template of the join.
+        :return: Two templates, one for this (left) table and one for the right table.
+        """
+        template_l = self.__get_sub_where_template__(where_template)
+        template_r = right_r.__get_sub_where_template__(where_template)
+
+        for key_name in list(template_l.keys()):
+            if key_name in template_r and key_name not in on_fields:
+                del template_l[key_name]
+
+        return template_l, template_r
+
+    def __get_on_key__(self, row, on_fields):
+        """
+        Gets the values of the on clause for an individual row as a tuple, to be used as a hash key.
+
+        :param row: the row that you are creating the key for
+        :param on_fields: list of fields to join ex: ['playerID', 'teamID']
+        :return: tuple of the row's values for the on_fields
+        """
+        return tuple([row[field] for field in on_fields])
+
     def __get_on_template__(self, row, on_fields):
         """
         Gets the on clause as a template for an individual row to easily compare to other table
@@ -458,10 +1782,12 @@ class CSVTable:
 
     def __get_row_list__(self):
         """
-        Gets all rows of the table
+        Gets all rows of the table. A lazy table reads them from its CSV file.
 
         :return: List of row dictionaries
         """
+        if self.__rows__ is None:
+            return list(self.__iter_file_rows__())
         return self.__rows__
 
     def __table_from_rows__(self, table_name, rows):
@@ -479,11 +1805,10 @@ class CSVTable:
         return new_table
 
     def __str__(self):
-        data = self.__rows__
-        header = data[0].keys()
+        header = self.__get_column_names__()
 
-        # only print the first 100 rows
-        rows = [x.values() for x in data[:100]]
+        # only print the first 100 rows, a lazy table reads them from its file
+        rows = [[x[c] for c in header] for x in itertools.islice(self.__iter_rows__(), 100)]
         return tabulate.tabulate(rows, header, tablefmt='grid')
 
     def insert(self, r):
@@ -4,6 +4,8 @@ class DataTableException(Exception):
     duplicate_table_name        =   -101
     not_implemented             =   -200
     invalid_file                =   -300
+    invalid_argument            =   -400
+    not_null_violation          =   -500
 
     def __init__(self, code=None, message=None, ex=None):
         self.code = code
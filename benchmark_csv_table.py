@@ -0,0 +1,111 @@
+import CSVJoinPlanner
+import CSVTable
+import time
+import tracemalloc
+
+
+def index_key_allocation_benchmark():
+    """
+    Compares building the index keys of a load with the old "_".join string keys and with the keys built by
+    __get_key__. A string key copies the text of every column into a new string through a temporary list. The
+    new keys reference the column values: a single column key is the value itself, a composite key a tuple.
+    """
+    batting_table = CSVTable.CSVTable("batting")
+    rows = batting_table.__get_row_list__()
+    indexes = list(batting_table.__indexes__.values())
+
+    def string_keys():
+        result = []
+        for index in indexes:
+            keys = []
+            for r in rows:
+                key = []
+                for c in index.column_names:
+                    key.append(r[c])
+                keys.append("_".join(key))
+            result.append(keys)
+        return result
+
+    def new_keys():
+        return [[batting_table.__get_key__(index, r) for r in rows] for index in indexes]
+
+    for name, build in [("string keys", string_keys), ("new keys", new_keys)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        keys = build()
+        elapsed = time.perf_counter() - start
+        allocated, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{:<12} rows = {}, allocated = {} bytes, peak = {} bytes, time = {:.3f}s".format(
+            name, len(rows), allocated, peak, elapsed))
+
+# index_key_allocation_benchmark()
+
+
+def vectorized_scan_benchmark():
+    """
+    Compares the row-at-a-time template scan with the columnar scan, with and without the NumPy engine.
+    All three must return the same rows.
+    """
+    template = {"teamID": "BOS", "lgID": "AL"}
+    fields = ["playerID", "yearID", "teamID", "HR"]
+
+    batting_table = CSVTable.CSVTable("batting")
+    columnar_table = CSVTable.CSVTable("batting", columnar=True)
+    store = columnar_table.__rows__
+    typed_template = columnar_table.__coerce_template__(template)
+
+    runs = [
+        ("row scan", lambda: batting_table.__find_by_template_scan__(template, fields).__rows__),
+        ("columnar", lambda: store.select(typed_template, fields, vectorized=False)),
+        ("vectorized", lambda: store.select(typed_template, fields, vectorized=True))
+    ]
+
+    expected = None
+    for name, run in runs:
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = [{k: str(v) for k, v in r.items()} for r in result]
+        same = [{k: str(v) for k, v in r.items()} for r in result] == expected
+        print("{:<12} rows = {}, time = {:.4f}s, same result = {}".format(name, len(result), elapsed, same))
+
+# vectorized_scan_benchmark()
+
+
+def join_order_benchmark():
+    """
+    Compares a hand-ordered chain of pairwise joins (appearances, batting, then people) with the multi-way join,
+    whose order is chosen by CSVJoinPlanner. Both must return the same rows.
+    """
+    people_table = CSVTable.CSVTable("people")
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+    where_template = {"nameLast": "Williams", "lgID": "AL"}
+    fields = ["playerID", "nameLast", "yearID", "teamID", "H", "G_all"]
+    join_predicates = [("people", "batting", ["playerID"]),
+                       ("batting", "appearances", ["playerID", "yearID", "teamID"])]
+
+    def chain():
+        result = appearances_table.__smart_join__(batting_table, ["playerID", "yearID", "teamID"])
+        return result.__smart_join__(people_table, ["playerID"], where_template, fields).__rows__
+
+    def planned():
+        return CSVJoinPlanner.multi_join([appearances_table, batting_table, people_table], join_predicates,
+                                         where_template, fields).__rows__
+
+    print(CSVJoinPlanner.explain_join([appearances_table, batting_table, people_table], join_predicates,
+                                      where_template))
+
+    expected = None
+    for name, run in [("chain", chain), ("planned", planned)]:
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = sorted(map(str, result))
+        print("{:<12} rows = {}, time = {:.4f}s, same result = {}".format(
+            name, len(result), elapsed, sorted(map(str, result)) == expected))
+
+# join_order_benchmark()
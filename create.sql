@@ -20,9 +20,9 @@ CREATE TABLE `csvcolumns` (
 CREATE TABLE `csvindexes` (
   `table_name` varchar(45) NOT NULL,
   `column_name` varchar(45) NOT NULL,
-  `type` enum('PRIMARY','UNIQUE','INDEX') NOT NULL,
+  `type` enum('PRIMARY','UNIQUE','INDEX','ORDERED') NOT NULL,
   `index_name` varchar(45) NOT NULL,
   `index_order` varchar(45) NOT NULL,
-  PRIMARY KEY (`table_name`,`column_name`),
+  PRIMARY KEY (`table_name`,`index_name`,`column_name`),
   CONSTRAINT `ind_to_col` FOREIGN KEY (`table_name`, `column_name`) REFERENCES `csvcolumns` (`table_name`, `column_name`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
\ No newline at end of file
@@ -1,14 +1,29 @@
 import CSVCatalog
 import json
+import os
 
 
-def create_table_test():
-    cat = CSVCatalog.CSVCatalog(
+def get_catalog():
+    """
+    Creates the catalog the tests run against. The backend is selected by the CSV_CATALOG_BACKEND environment
+    variable: "mysql" (the default) or "sqlite", for a SQLite catalog in the file CSV_CATALOG_FILE (by default
+    csv_catalog.db).
+
+    :return: A CSVCatalog.
+    """
+    if os.environ.get("CSV_CATALOG_BACKEND", "mysql") == "sqlite":
+        file_name = os.environ.get("CSV_CATALOG_FILE", "csv_catalog.db")
+        return CSVCatalog.CSVCatalog(backend=CSVCatalog.SQLiteBackend(file_name))
+    return CSVCatalog.CSVCatalog(
         dbhost="XXX",
         dbport=3306,
         dbuser="admin",
         dbpw="XXX",
         db="CSVCatalog")
+
+
+def create_table_test():
+    cat = get_catalog()
     cat.create_table("test_table", "file_path_test.woo")
 
     t = cat.get_table("test_table")
@@ -18,12 +33,7 @@ def create_table_test():
 #create_table_test()
 
 def drop_table_test():
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     # t = cat.get_table("test_table")
     # print("before dropping Table = ", t)
 
@@ -35,12 +45,7 @@ def drop_table_test():
 
 def add_column_test():
     print("--- in add_column_test ---")
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     t = cat.get_table("test_table")
     c = CSVCatalog.ColumnDefinition("first_col","text",not_null= False)
     t.add_column_definition(c)
@@ -58,12 +63,7 @@ def add_column_test():
 
 def load_column_test():
     print("--- load_column_test ---")
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     t = cat.get_table("test_table")
     print("Table = ", t)
 
@@ -73,12 +73,7 @@ def load_column_test():
 
 
 def column_name_failure_test():
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     col = CSVCatalog.ColumnDefinition(None, "text", False)
     t = cat.get_table("test_table")
     t.add_column_definition(col)
@@ -87,12 +82,7 @@ def column_name_failure_test():
 
 
 def column_type_failure_test():
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     col = CSVCatalog.ColumnDefinition("bird", "canary", False)
     t = cat.get_table("test_table")
     t.add_column_definition(col)
@@ -101,12 +91,7 @@ def column_type_failure_test():
 
 
 def column_not_null_failure_test():
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     col = CSVCatalog.ColumnDefinition("name", "text", "happy")
     t = cat.get_table("test_table")
     t.add_column_definition(col)
@@ -116,12 +101,7 @@ def column_not_null_failure_test():
 
 def add_index_test():
     # define index
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     t = cat.get_table("test_table")
 
     idx = CSVCatalog.IndexDefinition("first_index", "INDEX", ["first_col"])
@@ -142,12 +122,7 @@ def add_index_test():
 
 def load_index_test():
     # define index
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     t = cat.get_table("test_table")
     print(t)
 
@@ -155,12 +130,7 @@ def load_index_test():
 
 def col_drop_test():
     print("--- drop_column_test ---")
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     t = cat.get_table("test_table")
     t.drop_column_definition("first_col")
 
@@ -177,12 +147,7 @@ def col_drop_test():
 
 def index_drop_test():
     print("--- drop_index_test ---")
-    cat = CSVCatalog.CSVCatalog(
-        dbhost="XXX",
-        dbport=3306,
-        dbuser="admin",
-        dbpw="XXX",
-        db="CSVCatalog")
+    cat = get_catalog()
     t = cat.get_table("test_table")
     ## check for invalid input
     idx = t.get_index("error_index")
@@ -193,7 +158,7 @@ def index_drop_test():
 #index_drop_test()
 
 def describe_table_test():
-    cat = CSVCatalog.CSVCatalog()
+    cat = get_catalog()
     t = cat.get_table("test_table")
     desc = t.describe_table()
 
@@ -202,3 +167,84 @@ def describe_table_test():
 
 #describe_table_test()
 
+
+
+def definition_cache_test():
+    cat = get_catalog()
+    t = cat.get_table("test_table")
+    print("cached = ", (cat.cnx.key, "test_table") in CSVCatalog.definition_cache.entries)
+
+    # Served from the cache, without querying the database.
+    t2 = cat.get_table("test_table")
+    print("same definition = ", t.to_json() == t2.to_json())
+
+    # A change to the catalog invalidates the cached definitions.
+    t.add_column_definition(CSVCatalog.ColumnDefinition("cache_col", "text", False))
+    print("cached after add_column_definition = ", (cat.cnx.key, "test_table") in CSVCatalog.definition_cache.entries)
+    t3 = cat.get_table("test_table")
+    print("new column loaded = ", t3.get_column("cache_col") is not None)
+    t3.drop_column_definition("cache_col")
+
+
+#definition_cache_test()
+
+
+def connection_pool_test():
+    import threading
+
+    cat = CSVCatalog.CSVCatalog(pool_size=2)
+    print("connections before the first query = ", cat.cnx.pool.open_count)
+
+    threads = [threading.Thread(target=lambda: CSVCatalog.CSVCatalog().get_table("test_table")) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print("connections after 8 concurrent opens = ", cat.cnx.pool.open_count)
+
+
+#connection_pool_test()
+
+
+def batch_definition_test():
+    cat = get_catalog()
+    columns = [CSVCatalog.ColumnDefinition("col_" + str(i), "text", False) for i in range(25)]
+    indexes = [CSVCatalog.IndexDefinition("batch_index", "INDEX", ["col_2", "col_1"]),
+               CSVCatalog.IndexDefinition("other_index", "UNIQUE", ["col_10"])]
+
+    # The table, its columns and its indexes are saved in a single transaction.
+    t = CSVCatalog.TableDefinition("batch_table", "batch_file.csv", columns, indexes, cnx=cat.cnx)
+    t = cat.get_table("batch_table")
+    print("Table = ", t)
+    cat.drop_table("batch_table")
+
+#batch_definition_test()
+
+
+def overlapping_index_test():
+    # A column can be in several indexes, e.g. an ORDERED index on columns of the primary key. The test runs on
+    # an in-memory SQLite catalog, so it needs no server.
+    cat = CSVCatalog.CSVCatalog(backend=CSVCatalog.SQLiteBackend())
+    columns = [CSVCatalog.ColumnDefinition(c, "text", True) for c in ["playerID", "yearID", "teamID"]]
+    cat.create_table("overlap_table", "overlap_file.csv", columns)
+
+    t = cat.get_table("overlap_table")
+    t.define_index("overlap_primary", ["yearID", "teamID", "playerID"], "PRIMARY")
+    t.define_index("overlap_ordered", ["yearID", "teamID"], "ORDERED")
+
+    t = cat.get_table("overlap_table")
+    indexes = {idx.index_name: idx.column_names for idx in t.indexes}
+    print("indexes = ", indexes)
+    assert indexes == {"overlap_primary": ["yearID", "teamID", "playerID"], "overlap_ordered": ["yearID", "teamID"]}
+
+    # Dropping a column removes it from every index it is in, an index left without columns is dropped.
+    t.drop_column_definition("teamID")
+    t.drop_column_definition("yearID")
+    expected = {"overlap_primary": ["playerID"]}
+    print("indexes after dropping teamID and yearID = ", {idx.index_name: idx.column_names for idx in t.indexes})
+    assert {idx.index_name: idx.column_names for idx in t.indexes} == expected
+    t = cat.get_table("overlap_table")
+    assert {idx.index_name: idx.column_names for idx in t.indexes} == expected
+    cat.drop_table("overlap_table")
+
+# overlapping_index_test()
@@ -1,7 +1,13 @@
 import CSVTable
+import CSVColumnStore
+import CSVIndex
+import CSVOperators
 import CSVCatalog
+import CSVJoinPlanner
+import CSVPredicate
 import json
 import csv
+import pickle
 
 
 def drop_tables_for_prep():
@@ -30,14 +36,18 @@ def update_people_columns():
                   "deathCity", "nameFirst", "nameLast", "nameGiven", "weight", "height", "bats",
                   "throws", "debut", "finalGame", "retroID", "bbrefID"]
     t = cat.get_table("people")
+    column_definitions = []
     for col_name in column_lst:
 
         if col_name in ["playerID"]:
             c = CSVCatalog.ColumnDefinition(col_name, "text", not_null=True)
-            t.add_column_definition(c)
+            column_definitions.append(c)
         else:
             c = CSVCatalog.ColumnDefinition(col_name, "text", not_null=False)
-            t.add_column_definition(c)
+            column_definitions.append(c)
+
+    # One batched insert for all the columns.
+    t.add_column_definitions(column_definitions)
 
     # print("table is ", t)
 
@@ -52,14 +62,16 @@ def update_appearances_columns():
                   "G_batting", "G_defense", "G_p","G_c", "G_1b", "G_2b",
                   "G_3b", "G_ss", "G_lf", "G_cf", "G_rf", "G_of", "G_dh", "G_ph", "G_pr"]
 
+    column_definitions = []
     for col_name in column_lst:
 
         if col_name in ["yearID", "teamID", "playerID"]:
             c = CSVCatalog.ColumnDefinition(col_name, "text", not_null=True)
-            t.add_column_definition(c)
+            column_definitions.append(c)
         else:
             c = CSVCatalog.ColumnDefinition(col_name, "text", not_null=False)
-            t.add_column_definition(c)
+            column_definitions.append(c)
+    t.add_column_definitions(column_definitions)
 
     print("table is ", t)
     # for col_name in column_lst:
@@ -74,13 +86,15 @@ def update_batting_columns():
     column_lst = ["playerID", "yearID", "stint", "teamID", "lgID", "G", "AB", "R", "H", "2B", "3B",
                   "HR", "RBI", "SB", "CS", "BB", "SO", "IBB", "HBP", "SH", "SF", "GIDP"]
 
+    column_definitions = []
     for col_name in column_lst:
         if col_name in ["playerID",  "yearID", "stint"]:
             c = CSVCatalog.ColumnDefinition(col_name, "text", not_null=True)
-            t.add_column_definition(c)
+            column_definitions.append(c)
         else:
             c = CSVCatalog.ColumnDefinition(col_name, "text", not_null=False)
-            t.add_column_definition(c)
+            column_definitions.append(c)
+    t.add_column_definitions(column_definitions)
 
     print("table is ", t)
 
@@ -255,3 +269,397 @@ def smart_join_test():
     print("table is ", res.__rows__)
 
 # smart_join_test()
+
+
+def hash_join_test():
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+
+    res = batting_table.hash_join(appearances_table, ["playerID", "yearID"], {"playerID": "baxtemi01"},
+                                  ["playerID", "yearID", "teamID", "AB", "H", "G_all", "G_batting"])
+    print("table is ", res.__rows__)
+
+    dumb = batting_table.dumb_join(appearances_table, ["playerID", "yearID"], {"playerID": "baxtemi01"},
+                                   ["playerID", "yearID", "teamID", "AB", "H", "G_all", "G_batting"])
+    print("same rows as dumb_join: ", sorted(map(str, res.__rows__)) == sorted(map(str, dumb.__rows__)))
+
+# hash_join_test()
+
+
+def sort_merge_join_test():
+    # Lazy tables stream their rows from the CSV files instead of loading them.
+    batting_table = CSVTable.CSVTable("batting", lazy=True)
+    appearances_table = CSVTable.CSVTable("appearances", lazy=True)
+
+    res = batting_table.sort_merge_join(appearances_table, ["playerID", "yearID"], {"playerID": "baxtemi01"},
+                                        ["playerID", "yearID", "teamID", "AB", "H", "G_all", "G_batting"],
+                                        run_size=10000)
+    print("table is ", res.__rows__)
+
+# sort_merge_join_test()
+
+
+def index_statistics_test():
+    batting_table = CSVTable.CSVTable("batting")
+    for index in batting_table.__indexes__.values():
+        print(index)
+
+# index_statistics_test()
+
+
+def add_ordered_index():
+    cat = CSVCatalog.CSVCatalog()
+    t = cat.get_table("appearances")
+    idx = CSVCatalog.IndexDefinition("year_team_index", "ORDERED", ["yearID", "teamID"])
+    t.define_index(idx.index_name, idx.column_names, idx.index_type)
+
+    # yearID and teamID are in appearance_index (the primary key) too.
+    t = cat.get_table("appearances")
+    indexes = {idx.index_name: idx.column_names for idx in t.indexes}
+    print("indexes = ", indexes)
+    assert indexes["year_team_index"] == ["yearID", "teamID"]
+    assert indexes["appearance_index"] == ["yearID", "teamID", "playerID"]
+
+# add_ordered_index()
+
+
+def ordered_index_test():
+    appearances_table = CSVTable.CSVTable("appearances")
+
+    print("------ leftmost prefix lookup ------")
+    result = appearances_table.__find_by_template__({"yearID": "1995"}, ["playerID", "yearID", "teamID"])
+    print("table is ", result)
+
+    print("------ range lookup ------")
+    result = appearances_table.__find_by_range__("yearID", "1990", "2000", {"playerID": "baxtemi01"},
+                                                 ["playerID", "yearID", "teamID"])
+    print("table is ", result)
+
+    print("------ ordered scan ------")
+    for r in appearances_table.__iter_ordered__("year_team_index", reverse=True):
+        print(r)
+        break
+
+# ordered_index_test()
+
+
+def explain_test():
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+    print("statistics = ", batting_table.__statistics__)
+
+    print("------ select plan ------")
+    plan = batting_table.explain({"playerID": "aaronha01", "teamID": "ML1", "stint": "1"})
+    print(json.dumps(plan, indent=2))
+
+    print("------ join plan ------")
+    plan = batting_table.explain({"playerID": "baxtemi01"}, appearances_table, ["teamID", "playerID", "yearID"])
+    print(json.dumps(plan, indent=2))
+
+# explain_test()
+
+
+def columnar_load_test():
+    batting_table = CSVTable.CSVTable("batting", columnar=True)
+    print("rows = ", len(batting_table.__rows__))
+
+    template = {"playerID": "aaronha01", "teamID": "ML1", "stint": "1"}
+    fields = ["playerID", "teamID", "stint", "yearID", "lgID"]
+    result = batting_table.__find_by_template__(template, fields)
+    print("table is ", result)
+
+# columnar_load_test()
+
+
+def index_files_test():
+    # The first load builds the indexes and saves them next to the CSV file, the second one maps them.
+    batting_table = CSVTable.CSVTable("batting")
+    batting_table = CSVTable.CSVTable("batting")
+    for index in batting_table.__indexes__.values():
+        print(index.index_name, "loaded from file: ", index.mapped_file is not None)
+
+    template = {"playerID": "aaronha01", "teamID": "ML1", "stint": "1", "yearID": "1954"}
+    result = batting_table.__find_by_template__(template, ["playerID", "teamID", "yearID", "lgID"])
+    print("table is ", result)
+
+# index_files_test()
+
+
+def index_file_header_test():
+    # An index file whose header is not valid JSON (here a pickle, which could run code) is ignored and rebuilt.
+    batting_table = CSVTable.CSVTable("batting")
+    index = batting_table.__description__.indexes[0]
+    file_name = CSVIndex.index_file_name(batting_table.__get_file_name__(), index.index_name)
+    header = pickle.dumps({"keys": []})
+    with open(file_name, "wb") as f:
+        f.write(CSVIndex.index_file_magic + len(header).to_bytes(8, "little") + header)
+
+    print("loaded: ", CSVIndex.load_index(index, file_name, batting_table.__get_file_signature__()) is not None)
+    batting_table = CSVTable.CSVTable("batting")
+    batting_table = CSVTable.CSVTable("batting")
+    print("rebuilt and loaded from file: ", batting_table.__indexes__[index.index_name].mapped_file is not None)
+
+# index_file_header_test()
+
+
+def column_cache_test():
+    # The first load parses the CSV file and writes the column cache, the second one maps the cache.
+    batting_table = CSVTable.CSVTable("batting", columnar=True)
+    batting_table = CSVTable.CSVTable("batting", columnar=True)
+    print("loaded from cache: ", batting_table.__rows__.mapped_file is not None)
+    print("statistics = ", batting_table.__statistics__)
+
+    template = {"playerID": "aaronha01", "teamID": "ML1", "stint": "1"}
+    result = batting_table.__find_by_template__(template, ["playerID", "teamID", "yearID", "lgID"])
+    print("table is ", result)
+
+# column_cache_test()
+
+
+def column_cache_header_test():
+    # A cache file whose header is not valid JSON (here a pickle, which could run code) is ignored, the table is
+    # loaded from the CSV file and the cache rewritten.
+    batting_table = CSVTable.CSVTable("batting", columnar=True)
+    file_name = CSVColumnStore.cache_file_name(batting_table.__get_file_name__())
+    header = pickle.dumps({"columns": []})
+    with open(file_name, "wb") as f:
+        f.write(CSVColumnStore.cache_file_magic + len(header).to_bytes(8, "little") + header)
+
+    batting_table = CSVTable.CSVTable("batting", columnar=True)
+    print("loaded from cache: ", batting_table.__rows__.mapped_file is not None)
+    batting_table = CSVTable.CSVTable("batting", columnar=True)
+    print("loaded from the rewritten cache: ", batting_table.__rows__.mapped_file is not None)
+
+# column_cache_header_test()
+
+
+def streaming_join_test():
+    # The streaming join yields the joined rows one at a time, without building intermediate tables.
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+    on_fields = ["teamID", "playerID", "yearID"]
+    where_template = {"teamID": "BOS", "yearID": "2004"}
+    project_fields = ["playerID", "yearID", "teamID", "AB", "H", "G_all"]
+
+    rows = batting_table.__iter_smart_join__(appearances_table, on_fields, where_template, project_fields)
+    for r in rows:
+        print(r)
+        break
+
+    result = batting_table.__smart_join__(appearances_table, on_fields, where_template, project_fields)
+    print("table is ", result)
+
+# streaming_join_test()
+
+
+def limit_offset_test():
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+    template = {"teamID": "BOS"}
+    fields = ["playerID", "teamID", "yearID", "AB", "H"]
+
+    result = batting_table.__find_by_template__(template, fields, limit=10)
+    print("first 10 rows: ", result)
+    result = batting_table.__find_by_template__(template, fields, limit=10, offset=10)
+    print("next 10 rows: ", result)
+
+    result = batting_table.__smart_join__(appearances_table, ["teamID", "playerID", "yearID"], template,
+                                          ["playerID", "yearID", "teamID", "AB", "H", "G_all"], limit=5)
+    print("first 5 joined rows: ", result)
+
+# limit_offset_test()
+
+
+def lazy_index_test():
+    # Only the metadata is loaded. The scan streams the file, the indexed select loads the rows and indexes.
+    batting_table = CSVTable.CSVTable("batting", lazy=True)
+    print("lazy table is ", batting_table)
+    print("loaded after print: ", batting_table.__rows__ is not None)
+    result = batting_table.__find_by_template__({"lgID": "AL"}, ["playerID", "yearID", "teamID"], limit=5)
+    print("loaded after scan: ", batting_table.__rows__ is not None)
+    print("table is ", result)
+
+    result = batting_table.__find_by_template__({"teamID": "BOS", "yearID": "2004"}, ["playerID", "yearID", "teamID"])
+    print("loaded after indexed select: ", batting_table.__rows__ is not None)
+    print("table is ", result)
+
+# lazy_index_test()
+
+
+def parallel_load_test():
+    serial_table = CSVTable.CSVTable("batting", index_files=False)
+    parallel_table = CSVTable.CSVTable("batting", index_files=False, workers=4)
+    print("same rows: ", list(serial_table.__rows__) == list(parallel_table.__rows__))
+    for name, index in serial_table.__indexes__.items():
+        print(name, "same index: ", index.entries == parallel_table.__indexes__[name].entries)
+    print("same statistics: ", serial_table.__statistics__.to_json() == parallel_table.__statistics__.to_json())
+
+# parallel_load_test()
+
+
+def parallel_join_test():
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+    on_fields = ["playerID", "yearID", "teamID"]
+    project_fields = ["playerID", "yearID", "teamID", "AB", "H", "G_all"]
+
+    serial = batting_table.hash_join(appearances_table, on_fields, None, project_fields)
+    parallel = batting_table.hash_join(appearances_table, on_fields, None, project_fields, workers=4)
+    print("rows = ", len(parallel.__rows__))
+    print("same rows: ", sorted(map(str, serial.__rows__)) == sorted(map(str, parallel.__rows__)))
+
+# parallel_join_test()
+
+
+def multi_join_test():
+    people_table = CSVTable.CSVTable("people")
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+    tables = [people_table, batting_table, appearances_table]
+    join_predicates = [("people", "batting", ["playerID"]),
+                       ("batting", "appearances", ["playerID", "yearID", "teamID"])]
+    where_template = {"nameLast": "Williams", "teamID": "BOS"}
+
+    print(CSVJoinPlanner.explain_join(tables, join_predicates, where_template))
+    result = CSVJoinPlanner.multi_join(tables, join_predicates, where_template,
+                                       ["playerID", "nameLast", "yearID", "teamID", "H", "G_all"])
+    print("table is ", result)
+
+# multi_join_test()
+
+
+def join_pushdown_test():
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+    on_fields = ["playerID", "yearID", "teamID"]
+    where_template = {"teamID": "BOS", "yearID": "2004", "HR": "5"}
+    project_fields = ["playerID", "yearID", "HR", "G_all"]
+
+    print(batting_table.explain(where_template, appearances_table, on_fields))
+    smart = batting_table.__smart_join__(appearances_table, on_fields, where_template, project_fields)
+    hashed = batting_table.hash_join(appearances_table, on_fields, where_template, project_fields)
+    print("table is ", smart)
+    print("same rows: ", sorted(map(str, smart.__rows__)) == sorted(map(str, hashed.__rows__)))
+
+# join_pushdown_test()
+
+
+def create_typed_batting():
+    cat = CSVCatalog.CSVCatalog()
+    column_definitions = [CSVCatalog.ColumnDefinition("playerID", "text", not_null=True),
+                          CSVCatalog.ColumnDefinition("yearID", "number", not_null=True),
+                          CSVCatalog.ColumnDefinition("stint", "number", not_null=True),
+                          CSVCatalog.ColumnDefinition("teamID", "text", not_null=False),
+                          CSVCatalog.ColumnDefinition("AB", "number", not_null=False),
+                          CSVCatalog.ColumnDefinition("HR", "number", not_null=False)]
+    t = cat.create_table("batting_typed", "/Users/hz/Downloads/NewBatting.csv", column_definitions)
+    t.define_index("typed_year_index", ["yearID", "playerID"], "ORDERED")
+
+# create_typed_batting()
+
+
+def typed_load_test():
+    typed_table = CSVTable.CSVTable("batting_typed")
+    columnar_table = CSVTable.CSVTable("batting_typed", columnar=True)
+    print("row = ", typed_table.__rows__[0])
+    print("same rows as columnar: ", list(typed_table.__rows__) == list(columnar_table.__rows__))
+
+    # Template values are converted once per query, "2004" and 2004 select the same rows.
+    result = typed_table.__find_by_template__({"yearID": "2004", "HR": 40}, ["playerID", "yearID", "HR"])
+    print("table is ", result)
+
+    result = typed_table.__find_by_range__("yearID", 2000, "2004", {"playerID": "ortizda01"},
+                                           ["playerID", "yearID", "HR"])
+    print("table is ", result)
+
+# typed_load_test()
+
+
+def predicate_test():
+    typed_table = CSVTable.CSVTable("batting_typed")
+    columnar_table = CSVTable.CSVTable("batting_typed", columnar=True)
+    predicate = CSVPredicate.and_(CSVPredicate.between("yearID", 2000, 2004),
+                                  CSVPredicate.or_(CSVPredicate.gt("HR", 40),
+                                                   CSVPredicate.like("playerID", "ortiz%")),
+                                  CSVPredicate.not_(CSVPredicate.is_in("teamID", ["NYA", "BOS"])))
+
+    print(json.dumps(typed_table.explain(predicate), indent=2))
+    result = typed_table.__find_by_predicate__(predicate, ["playerID", "yearID", "teamID", "HR"])
+    print("table is ", result)
+    columnar_result = columnar_table.__find_by_predicate__(predicate, ["playerID", "yearID", "teamID", "HR"])
+    print("same rows: ", sorted(map(str, result.__rows__)) == sorted(map(str, columnar_result.__rows__)))
+
+# predicate_test()
+
+
+def group_by_test():
+    batting_table = CSVTable.CSVTable("batting")
+    appearances_table = CSVTable.CSVTable("appearances")
+
+    print("------ home runs per team and year ------")
+    result = batting_table.group_by(["teamID", "yearID"], [("SUM", "HR"), ("COUNT", "*"), ("MAX", "HR")],
+                                    {"lgID": "AL"})
+    print("table is ", result)
+
+    # HR is a text column: MAX compares its values as numbers, like SUM adds them.
+    expected = {}
+    for r in batting_table.__find_by_template__({"lgID": "AL"}).__rows__:
+        if r["HR"] is not None:
+            key = (r["teamID"], r["yearID"])
+            expected[key] = max(expected.get(key, 0), int(r["HR"]))
+    for r in result.__rows__:
+        assert r["MAX(HR)"] == expected.get((r["teamID"], r["yearID"]))
+
+    print("------ aggregate of a join ------")
+    joined = batting_table.__smart_join__(appearances_table, ["playerID", "yearID", "teamID"], {"teamID": "BOS"})
+    result = joined.group_by(["yearID"], [("AVG", "G_all", "avg_games"), ("SUM", "H")])
+    print("table is ", result)
+
+    print("------ spilled partial aggregates ------")
+    spilled = batting_table.group_by(["playerID"], [("SUM", "HR")], max_groups=1000)
+    in_memory = batting_table.group_by(["playerID"], [("SUM", "HR")])
+    print("same rows: ", sorted(map(str, spilled.__rows__)) == sorted(map(str, in_memory.__rows__)))
+
+# group_by_test()
+
+
+def group_by_blank_test():
+    # Blank cells are NULL when the rows are read, in text columns too: SUM, AVG, MIN, MAX and COUNT of the
+    # column skip them, COUNT(*) does not. Numeric text is aggregated as numbers.
+    convert = CSVColumnStore.values_converter(["teamID", "HR"], [("teamID", "text", False), ("HR", "text", False)])
+    records = [["BOS", "10"], ["BOS", ""], ["BOS", "9"], ["NYA", ""]]
+    rows = [dict(zip(["teamID", "HR"], convert(values))) for values in records]
+    aggregates = [("SUM", "HR"), ("AVG", "HR"), ("MIN", "HR"), ("MAX", "HR"), ("COUNT", "HR"), ("COUNT", "*")]
+    for max_groups in [None, 1]:
+        result = list(CSVOperators.hash_aggregate(rows, ["teamID"], aggregates, max_groups))
+        result = sorted(result, key=lambda r: r["teamID"])
+        print("max_groups = ", max_groups, "result = ", result)
+        assert result == [
+            {"teamID": "BOS", "SUM(HR)": 19, "AVG(HR)": 9.5, "MIN(HR)": 9, "MAX(HR)": 10, "COUNT(HR)": 2,
+             "COUNT(*)": 3},
+            {"teamID": "NYA", "SUM(HR)": None, "AVG(HR)": None, "MIN(HR)": None, "MAX(HR)": None, "COUNT(HR)": 0,
+             "COUNT(*)": 1}]
+
+# group_by_blank_test()
+
+
+def order_by_test():
+    batting_table = CSVTable.CSVTable("batting_typed")
+    appearances_table = CSVTable.CSVTable("appearances")
+
+    print("------ top 10 home run seasons ------")
+    print(json.dumps(batting_table.__choose_order_plan__([("HR", "DESC")], None, 10), indent=2))
+    result = batting_table.order_by([("HR", "DESC"), "playerID"], None, ["playerID", "yearID", "HR"], limit=10)
+    print("table is ", result)
+
+    print("------ ordered index ------")
+    print(json.dumps(batting_table.__choose_order_plan__(["playerID"], {"yearID": "2004"}), indent=2))
+    result = batting_table.order_by(["playerID"], {"yearID": "2004"}, ["playerID", "yearID", "HR"], limit=10)
+    print("table is ", result)
+
+    print("------ external sort ------")
+    in_memory = appearances_table.order_by(["teamID", ("yearID", "DESC")])
+    external = appearances_table.order_by(["teamID", ("yearID", "DESC")], run_size=10000)
+    print("same rows: ", list(map(str, in_memory.__rows__)) == list(map(str, external.__rows__)))
+
+# order_by_test()